@@ -0,0 +1,321 @@
+"""\
+GLO-2000 Travail pratique 4 - Serveur asyncio 2025
+Noms et numéros étudiants:
+- Samuel Blanchette 111 159 329
+- Wiseley Paul Enzer Petiton 537 047 716
+- Jacob Provencher 111 272 785
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import glocodec
+import glosocket
+import glostore
+import gloutils
+import TP4_server
+from TP4_server import logger
+
+logging.getLogger("asyncio").setLevel(logging.WARNING)
+
+# Delai d'inactivite, en secondes, apres lequel une connexion est fermee. Aucun par
+# defaut, comme le serveur select: un client attendant les avis de nouveaux courriels
+# peut rester silencieux indefiniment.
+IDLE_TIMEOUT: float | None = None
+
+# Entetes dont le traitement accede au stockage, hors de la boucle. Les autres ne
+# touchent qu'a l'etat en memoire et sont traites par la boucle elle-meme.
+_STORE_HEADERS = frozenset({
+    gloutils.Headers.INBOX_READING_CHOICE,
+    gloutils.Headers.EMAIL_SENDING,
+    gloutils.Headers.EMAIL_BATCH_SENDING,
+})
+
+
+class AsyncServer(TP4_server.Server):
+    """
+    Serveur mail @glo2000.ca 2025 reposant sur asyncio.
+
+    Réutilise les traitements de `Server`: chaque connexion est une
+    coroutine et le flux d'écriture asyncio du client tient lieu de socket
+    client dans les structures de données du serveur.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float | None = IDLE_TIMEOUT,
+        password_workers: int = TP4_server.PASSWORD_WORKERS,
+        password_max_pending: int = TP4_server.PASSWORD_MAX_PENDING,
+        storage: str | None = None,
+        data_dir: str = gloutils.SERVER_DATA_DIR,
+    ) -> None:
+        """
+        Prépare le serveur comme `Server` ainsi que les attributs suivants:
+        - `_idle_timeout` le délai d'inactivité d'une connexion, ou None
+            pour n'en fermer aucune.
+        - `_executor` un fil d'exécution unique auquel sont confiés les
+            traitements accédant au stockage: livraisons, lecture d'un
+            courriel, construction d'un index, fin d'un hachage et
+            validation des lots. Étant seul à utiliser le stockage, il n'a
+            pas besoin de verrou pour y accéder.
+        - `_lock` le verrou de l'état en mémoire partagé entre la boucle et
+            ce fil, tenu pendant chaque traitement mais pas pendant la
+            synchronisation d'un lot.
+        - `_held` un dictionnaire associant chaque client en attente de la
+            fin du lot de livraisons aux réponses qui lui sont retenues.
+        """
+        super().__init__(
+            password_workers=password_workers,
+            password_max_pending=password_max_pending,
+            storage=storage,
+            data_dir=data_dir,
+        )
+        self._idle_timeout = idle_timeout
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._held: dict[asyncio.StreamWriter, list[bytes]] = {}
+
+    def cleanup(self) -> None:
+        """Arrête le fil d'exécution et ferme toutes les connexions résiduelles."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        super().cleanup()
+
+    def _try_send_message(
+        self, destination_socket: asyncio.StreamWriter, message: gloutils.GloMessage
+    ) -> None:
+        """
+        Confie le message au flux du client, ou le retient jusqu'à la fin du
+        lot de livraisons. Appelée avec le verrou `_lock`, depuis la boucle
+        ou le fil d'exécution des traitements.
+        """
+        data = self._encode_message(destination_socket, message)
+        if destination_socket in self._awaiting_commit:
+            self._held.setdefault(destination_socket, []).append(data)
+            return
+        self._loop.call_soon_threadsafe(self._write, destination_socket, data)
+
+    def _await_commit(self, client_soc: asyncio.StreamWriter) -> None:
+        """
+        Retient les réponses du client jusqu'à la fin du lot de livraisons.
+
+        La première livraison d'un lot confie sa validation au fil
+        d'exécution: elle suit les traitements déjà en attente, dont les
+        livraisons rejoignent le même lot.
+        """
+        if not self._awaiting_commit:
+            self._executor.submit(self._commit_deliveries)
+        super()._await_commit(client_soc)
+
+    def _release_batch(self) -> None:
+        """
+        Clôt le lot comme `Server`, sous le verrou: une réponse ne peut être
+        retenue pour un lot déjà clos.
+        """
+        with self._lock:
+            super()._release_batch()
+
+    def _release_replies(self, client_soc: asyncio.StreamWriter) -> None:
+        """Confie au flux du client les réponses retenues jusqu'à la fin du lot."""
+        held = self._held.pop(client_soc, None)
+        if held:
+            self._loop.call_soon_threadsafe(self._write, client_soc, b"".join(held))
+
+    def _password_job_done(self, client_soc: asyncio.StreamWriter, _future) -> None:
+        """La coroutine du client attend elle-même la fin du hachage."""
+
+    def _locked(self, function, *args) -> None:
+        """Appelle `function(*args)` en tenant le verrou de l'état du serveur."""
+        with self._lock:
+            function(*args)
+
+    def _uses_store(
+        self, client_soc: asyncio.StreamWriter, reply: gloutils.GloMessage
+    ) -> bool:
+        """
+        Indique si le traitement du message accède au stockage. La liste
+        des courriels n'y accède que pour construire l'index de la boîte.
+        """
+        if reply["header"] == gloutils.Headers.INBOX_READING_REQUEST:
+            username = self._logged_users.get(client_soc)
+            return username is not None and username.lower() not in self._inboxes
+        return reply["header"] in _STORE_HEADERS
+
+    def _process_stored(
+        self, client_soc: asyncio.StreamWriter, reply: gloutils.GloMessage
+    ) -> None:
+        """
+        Traite, depuis le fil d'exécution, un message accédant au stockage.
+        L'index manquant est construit sans tenir le verrou, seul ce fil
+        utilisant le stockage et y ajoutant des courriels, puis publié
+        sous le verrou.
+        """
+        with self._lock:
+            username = self._logged_users.get(client_soc)
+            missing = (
+                reply["header"] == gloutils.Headers.INBOX_READING_REQUEST
+                and username is not None
+                and username.lower() not in self._inboxes
+            )
+        if missing:
+            inbox = self._build_inbox(username)
+            with self._lock:
+                self._inboxes.setdefault(username.lower(), inbox)
+        self._locked(self._process_message, client_soc, reply)
+
+    async def _flush_held(self, writer: asyncio.StreamWriter) -> None:
+        """
+        Attend la fin du lot dont dépendent les réponses retenues du client,
+        puis leur transmission. Le lot est validé par le fil d'exécution
+        avant toute tâche confiée ensuite.
+        """
+        with self._lock:
+            waiting = writer in self._awaiting_commit
+        if waiting:
+            await self._loop.run_in_executor(self._executor, lambda: None)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, data: bytes) -> None:
+        if not writer.is_closing():
+            writer.write(data)
+
+    def _remove_client(self, client_soc: asyncio.StreamWriter) -> None:
+        """Retire le client des structures de données et ferme sa connexion."""
+        self._end_session(client_soc)
+        self._session_tokens.pop(client_soc, None)
+        self._codecs.pop(client_soc, None)
+        self._compressing.discard(client_soc)
+        self._notified.discard(client_soc)
+        self._held.pop(client_soc, None)
+        self._loop.call_soon_threadsafe(client_soc.close)
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Coroutine servant une connexion jusqu'à sa fermeture."""
+        logger.info("Le serveur a accepte un nouveau client.")
+        try:
+            while not writer.is_closing():
+                try:
+                    data = await asyncio.wait_for(
+                        glosocket.recv_frame_async(reader), self._idle_timeout
+                    )
+                    reply = self._decode_message(writer, data)
+                except (glosocket.GLOSocketError, glocodec.CodecError, TimeoutError):
+                    break
+
+                # Comme `_close_client`, les reponses deja dues sont transmises avant la fermeture
+                if reply["header"] == gloutils.Headers.BYE:
+                    self._locked(self._revoke_token, writer)
+                    await self._flush_held(writer)
+                    break
+
+                # Seuls les traitements accedant au stockage s'executent hors de la boucle
+                with self._lock:
+                    uses_store = self._uses_store(writer, reply)
+                if uses_store:
+                    await self._loop.run_in_executor(
+                        self._executor, self._process_stored, writer, reply
+                    )
+                else:
+                    self._locked(self._process_message, writer, reply)
+                # Le hachage d'un mot de passe s'execute dans son bassin, pendant que les
+                # autres clients sont servis; la requete suivante attend sa fin
+                job = self._password_jobs.get(writer)
+                if job is not None:
+                    # Un hachage annule ou en erreur est repondu par _finish_password_job
+                    await asyncio.wait([asyncio.wrap_future(job[0])])
+                    await self._loop.run_in_executor(
+                        self._executor, self._locked, self._finish_password_job, writer
+                    )
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    break
+        finally:
+            self._locked(self._remove_client, writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            logger.info("Un client a quitte.")
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+
+        # Le socket deja en ecoute est confie a asyncio
+        server = await asyncio.start_server(
+            self._handle_client, sock=self._server_socket
+        )
+        async with server:
+            await server.serve_forever()
+
+    def run(self) -> None:
+        """Point d'entrée du serveur."""
+        asyncio.run(self._serve())
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--idle-timeout",
+        action="store",
+        dest="idle_timeout",
+        type=float,
+        default=IDLE_TIMEOUT,
+        help="Délai d'inactivité, en secondes, avant la fermeture d'une connexion.",
+    )
+    parser.add_argument(
+        "--password-workers",
+        action="store",
+        dest="password_workers",
+        type=int,
+        default=TP4_server.PASSWORD_WORKERS,
+        help="Nombre de fils hachant les mots de passe.",
+    )
+    parser.add_argument(
+        "--password-max-pending",
+        action="store",
+        dest="password_max_pending",
+        type=int,
+        default=TP4_server.PASSWORD_MAX_PENDING,
+        help="Nombre maximal de hachages de mots de passe en cours ou en attente.",
+    )
+    parser.add_argument(
+        "--storage",
+        action="store",
+        dest="storage",
+        choices=tuple(glostore.MAIL_STORES),
+        default=None,
+        help=(
+            "Moteur de stockage des courriels. À défaut, celui de la variable "
+            f"d'environnement {TP4_server.STORAGE_ENV_VAR}, sinon "
+            f"`{glostore.FileMailStore.name}`."
+        ),
+    )
+    args = parser.parse_args(sys.argv[1:])
+    server = AsyncServer(
+        idle_timeout=args.idle_timeout,
+        password_workers=args.password_workers,
+        password_max_pending=args.password_max_pending,
+        storage=args.storage,
+    )
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        server.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
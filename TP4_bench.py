@@ -0,0 +1,419 @@
+"""\
+GLO-2000 Travail pratique 4 - Banc d'essai de charge 2025
+Noms et numéros étudiants:
+- Samuel Blanchette 111 159 329
+- Wiseley Paul Enzer Petiton 537 047 716
+- Jacob Provencher 111 272 785
+"""
+
+import argparse
+import json
+import math
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import glocodec
+import glosocket
+import glostore
+import gloutils
+
+
+# Proportions par defaut des operations effectuees par chaque client simule.
+DEFAULT_MIX = "send=4,list=3,choice=2,stats=1,login=1,register=1"
+
+# Operations pouvant figurer dans un melange.
+OPERATIONS = ("send", "batch", "list", "choice", "stats", "login", "register")
+
+# Nombre de courriels envoyes par une operation `batch`.
+BATCH_SIZE = 50
+
+BENCH_PASSWORD = "Benchmark123"  # nosec:B105
+
+
+class BenchmarkError(Exception):
+    """Erreur levée lorsque la préparation d'une mesure échoue."""
+
+
+def percentile(samples: list[float], rank: float) -> float:
+    """Retourne le centile `rank` (0-100) d'une liste triée, au rang le plus proche."""
+    if not samples:
+        return 0.0
+    index = max(math.ceil(rank / 100 * len(samples)) - 1, 0)
+    return samples[index]
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    """Interprète un mélange de la forme `send=4,list=3,...`."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Opération inconnue: {name}")
+        weights[name] = int(weight)
+    if not any(weights.values()):
+        raise ValueError("Le mélange ne contient aucune opération.")
+    return weights
+
+
+class SimulatedClient:
+    """
+    Client non interactif parlant le protocole de `gloutils.Headers` et
+    mesurant la latence de chacune de ses requêtes.
+    """
+
+    def __init__(
+        self,
+        destination: str,
+        username: str,
+        peers: list[str],
+        codec: str = "json",
+        compress: bool = False,
+    ) -> None:
+        self._socket = socket.create_connection((destination, gloutils.APP_PORT))
+        # Les requetes successives sans reponse (deconnexion puis connexion) ne
+        # doivent pas attendre l'acquittement de la precedente.
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._username = username
+        self._peers = peers
+        self._email_ids: list[str] = []
+        self._list_version: int | None = None
+        self._registered = 0
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+        self._codec: glocodec.Codec = glocodec.JSON_CODEC
+        self._compress = False
+        if codec != glocodec.JSON_CODEC.name or compress:
+            reply = self._request(
+                gloutils.Headers.HELLO,
+                gloutils.HelloPayload(
+                    codecs=[codec],
+                    compression=[glosocket.COMPRESSION] if compress else [],
+                ),
+            )
+            self._codec = glocodec.CODECS[reply["payload"]["codecs"][0]]
+            self._compress = bool(reply["payload"].get("compression"))
+
+    def close(self) -> None:
+        try:
+            self._send(gloutils.GloMessage(header=gloutils.Headers.BYE))
+        except glosocket.GLOSocketError:
+            pass
+        self._socket.close()
+
+    def _send(self, message: gloutils.GloMessage) -> None:
+        glosocket.send_frame(self._socket, self._codec.encode(message), self._compress)
+
+    def _exchange(
+        self, header: gloutils.Headers, payload: dict | None = None
+    ) -> gloutils.GloMessage:
+        """Envoie une requête et attend la réponse, sans la mesurer."""
+        message = gloutils.GloMessage(header=header)
+        if payload is not None:
+            message["payload"] = payload
+        self._send(message)
+        return self._codec.decode(glosocket.recv_frame(self._socket))
+
+    def _request(
+        self, header: gloutils.Headers, payload: dict | None = None
+    ) -> gloutils.GloMessage:
+        """Envoie une requête, attend la réponse et note sa latence."""
+        start = time.perf_counter()
+        reply = self._exchange(header, payload)
+        elapsed = time.perf_counter() - start
+
+        self.latencies.setdefault(header.name, []).append(elapsed)
+        if reply["header"] == gloutils.Headers.ERROR:
+            self.errors[header.name] = self.errors.get(header.name, 0) + 1
+        return reply
+
+    def _check(self, reply: gloutils.GloMessage, action: str) -> None:
+        """Lève BenchmarkError si le serveur a refusé l'action."""
+        if reply["header"] != gloutils.Headers.OK:
+            error_message = reply.get("payload", {}).get("error_message", "")
+            raise BenchmarkError(f"{action} de {self._username} a échoué: {error_message}")
+
+    def create_account(self) -> None:
+        """Crée le compte du client simulé, hors des mesures."""
+        reply = self._exchange(
+            gloutils.Headers.AUTH_REGISTER,
+            gloutils.AuthPayload(username=self._username, password=BENCH_PASSWORD),
+        )
+        self._check(reply, "La création du compte")
+
+    def register(self) -> None:
+        # Seule la creation d'un nouveau compte est mesuree: le client se reconnecte
+        # ensuite a son propre compte pour poursuivre son melange.
+        self._registered += 1
+        self._list_version = None
+        self._email_ids = []
+        self._send(gloutils.GloMessage(header=gloutils.Headers.AUTH_LOGOUT))
+        self._request(
+            gloutils.Headers.AUTH_REGISTER,
+            gloutils.AuthPayload(
+                username=f"{self._username}_{self._registered}", password=BENCH_PASSWORD
+            ),
+        )
+        self._send(gloutils.GloMessage(header=gloutils.Headers.AUTH_LOGOUT))
+        reply = self._exchange(
+            gloutils.Headers.AUTH_LOGIN,
+            gloutils.AuthPayload(username=self._username, password=BENCH_PASSWORD),
+        )
+        self._check(reply, "La reconnexion")
+
+    def login(self) -> None:
+        # La deconnexion n'attend pas de reponse, seule la connexion est mesuree.
+        self._list_version = None
+        self._send(gloutils.GloMessage(header=gloutils.Headers.AUTH_LOGOUT))
+        self._request(
+            gloutils.Headers.AUTH_LOGIN,
+            gloutils.AuthPayload(username=self._username, password=BENCH_PASSWORD),
+        )
+
+    def _make_email(self) -> gloutils.EmailContentPayload:
+        destination = random.choice(self._peers)
+        return gloutils.EmailContentPayload(
+            sender=f"{self._username}@{gloutils.SERVER_DOMAIN}",
+            destination=f"{destination}@{gloutils.SERVER_DOMAIN}",
+            subject=f"Essai {random.randrange(1 << 30)}",
+            date=gloutils.get_current_utc_time(),
+            content="x" * random.randrange(64, 4096),
+        )
+
+    def send(self) -> None:
+        self._request(gloutils.Headers.EMAIL_SENDING, self._make_email())
+
+    def batch(self) -> None:
+        self._request(
+            gloutils.Headers.EMAIL_BATCH_SENDING,
+            gloutils.EmailBatchPayload(
+                emails=[self._make_email() for _ in range(BATCH_SIZE)]
+            ),
+        )
+
+    def list(self) -> None:
+        # Comme le client, la page deja recue n'est redemandee que si elle a change
+        payload = gloutils.EmailListRequestPayload(
+            offset=0, limit=gloutils.EMAIL_LIST_PAGE_SIZE
+        )
+        if self._list_version is not None:
+            payload["since_version"] = self._list_version
+        reply = self._request(gloutils.Headers.INBOX_READING_REQUEST, payload)
+        if reply["header"] == gloutils.Headers.OK:
+            self._email_ids = reply["payload"]["email_ids"]
+            self._list_version = reply["payload"]["version"]
+
+    def choice(self) -> None:
+        if not self._email_ids:
+            self.list()
+        if self._email_ids:
+            self._request(
+                gloutils.Headers.INBOX_READING_CHOICE,
+                gloutils.EmailIdChoicePayload(email_id=random.choice(self._email_ids)),
+            )
+
+    def stats(self) -> None:
+        self._request(gloutils.Headers.STATS_REQUEST)
+
+
+def _run_client(
+    client: SimulatedClient,
+    weights: dict[str, int],
+    deadline: float,
+    max_requests: int | None,
+) -> None:
+    operations = list(weights)
+    counts = list(weights.values())
+    done = 0
+    try:
+        while time.perf_counter() < deadline and (max_requests is None or done < max_requests):
+            operation = random.choices(operations, counts)[0]
+            getattr(client, operation)()
+            done += 1
+    except glosocket.GLOSocketError:
+        client.errors["connection"] = client.errors.get("connection", 0) + 1
+    except Exception as error:
+        # Une reponse inattendue arrete ce client: elle est comptee et signalee
+        print(f"Un client simule s'est arrete: {error!r}", file=sys.stderr)
+        client.errors["client"] = client.errors.get("client", 0) + 1
+
+
+def run_benchmark(
+    destination: str,
+    clients: int,
+    duration: float,
+    mix: str,
+    max_requests: int | None = None,
+    codec: str = "json",
+    compress: bool = False,
+) -> dict:
+    """
+    Lance `clients` clients simulés contre le serveur et retourne, par
+    entête, le nombre de requêtes, le débit et les latences p50/p95/p99.
+    """
+    weights = parse_mix(mix)
+    run_id = random.randrange(1 << 30)
+    usernames = [f"bench{run_id}_{index}" for index in range(clients)]
+    simulated = [
+        SimulatedClient(destination, name, usernames, codec, compress)
+        for name in usernames
+    ]
+
+    # Un client sans compte ne recevrait que des erreurs: la mesure est abandonnee
+    try:
+        for client in simulated:
+            client.create_account()
+    except BenchmarkError:
+        for client in simulated:
+            client.close()
+        raise
+
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(
+            target=_run_client,
+            args=(client, weights, start + duration, max_requests),
+        )
+        for client in simulated
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for client in simulated:
+        client.close()
+
+    latencies: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    for client in simulated:
+        for header, samples in client.latencies.items():
+            latencies.setdefault(header, []).extend(samples)
+        for header, count in client.errors.items():
+            errors[header] = errors.get(header, 0) + count
+
+    results = {}
+    for header, samples in sorted(latencies.items()):
+        samples.sort()
+        results[header] = {
+            "count": len(samples),
+            "errors": errors.get(header, 0),
+            "throughput": len(samples) / elapsed,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+        }
+
+    return {
+        "clients": clients,
+        "duration": elapsed,
+        "mix": weights,
+        "codec": codec,
+        "compress": compress,
+        "connection_errors": errors.get("connection", 0),
+        "client_errors": errors.get("client", 0),
+        "headers": results,
+    }
+
+
+def _start_local_server(engine: str, storage: str, data_dir: str) -> str:
+    """
+    Démarre un serveur gardant ses données dans `data_dir`, sur un fil
+    d'exécution dédié, et retourne son adresse.
+    """
+    if engine == "asyncio":
+        import TP4_async_server
+        server = TP4_async_server.AsyncServer(storage=storage, data_dir=data_dir)
+    else:
+        import TP4_server
+        server = TP4_server.Server(storage=storage, data_dir=data_dir)
+    threading.Thread(target=server.run, daemon=True).start()
+    return "127.0.0.1"
+
+
+def _print_report(report: dict) -> None:
+    print(
+        f"{report['clients']} clients, {report['duration']:.2f} s, "
+        f"{report['connection_errors']} connexions perdues, "
+        f"{report['client_errors']} clients arrêtés sur une erreur"
+    )
+    print(f"{'Entête':<24}{'Requêtes':>10}{'Erreurs':>9}{'Req/s':>10}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for header, result in report["headers"].items():
+        print(
+            f"{header:<24}{result['count']:>10}{result['errors']:>9}"
+            f"{result['throughput']:>10.1f}{result['p50_ms']:>9.2f}"
+            f"{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+        )
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--destination",
+        action="store",
+        dest="dest",
+        help="Adresse IP/URL du serveur. Sans adresse, un serveur local est démarré.",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("select", "asyncio"),
+        default="select",
+        help="Moteur du serveur local.",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=tuple(glostore.MAIL_STORES),
+        default=glostore.FileMailStore.name,
+        help="Stockage des courriels du serveur local.",
+    )
+    parser.add_argument("-c", "--clients", type=int, default=10,
+                        help="Nombre de clients simulés.")
+    parser.add_argument("-t", "--duration", type=float, default=10.0,
+                        help="Durée de la mesure, en secondes.")
+    parser.add_argument("-n", "--requests", type=int, default=None,
+                        help="Nombre maximal de requêtes par client.")
+    parser.add_argument("-m", "--mix", default=DEFAULT_MIX,
+                        help="Proportions des opérations, ex. " + DEFAULT_MIX)
+    parser.add_argument("--codec", choices=tuple(glocodec.CODECS), default="json",
+                        help="Codec négocié par les clients simulés.")
+    parser.add_argument("--compress", action="store_true",
+                        help="Négocier la compression des messages.")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Fichier où écrire le rapport au format JSON.")
+    args = parser.parse_args(sys.argv[1:])
+
+    workdir = None
+    destination = args.dest
+    if destination is None:
+        workdir = tempfile.mkdtemp(prefix="glo_bench_")
+        destination = _start_local_server(args.engine, args.storage, workdir)
+    try:
+        report = run_benchmark(
+            destination, args.clients, args.duration, args.mix, args.requests, args.codec,
+            args.compress,
+        )
+    except BenchmarkError as error:
+        print(error, file=sys.stderr)
+        return 1
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
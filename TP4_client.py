@@ -8,14 +8,37 @@ Noms et numéros étudiants:
 
 import argparse
 import getpass
-import json
+import queue
+import random
 import socket
 import sys
+import threading
+import time
 
+import glocodec
 import glosocket
 import gloutils
 
 
+# Delai maximal, en secondes, avant une reconnexion. Le delai est tire au hasard pour
+# que les clients d'un serveur redemarre ne se reconnectent pas tous a la fois.
+RECONNECT_DELAY = 1.0
+
+# Delai, en secondes, accorde au serveur pour repondre a HELLO. Un serveur qui ne
+# connait pas cette entete n'y repond pas: le client se reconnecte alors sans negocier.
+NEGOTIATION_TIMEOUT = 2.0
+
+# Entetes des requetes auxquelles le serveur ne repond pas.
+_NO_REPLY = (gloutils.Headers.AUTH_LOGOUT, gloutils.Headers.BYE)
+
+
+class SessionExpiredError(Exception):
+    """
+    Erreur levée lorsque la connexion a été rétablie mais que le serveur
+    a refusé de reprendre la session de l'utilisateur.
+    """
+
+
 class Client:
     """Client pour le serveur mail @glo2000.ca 2025."""
 
@@ -25,10 +48,36 @@ class Client:
 
         Prépare un attribut `_username` pour stocker le nom d'utilisateur
         courant. Laissé vide quand l'utilisateur n'est pas connecté.
+
+        Prépare un attribut `_email_pages` associant le rang de chaque page
+        de courriels reçue à son contenu, réutilisé tant que la boîte de
+        l'utilisateur n'a pas changé.
+
+        Prépare un attribut `_resumption_token` pour stocker le jeton de
+        reprise de la session courante, présenté au serveur lors d'une
+        reconnexion, et `_last_request` pour la dernière requête attendant
+        une réponse, transmise à nouveau après la reconnexion.
+
+        Prépare un attribut `_negotiating`, faux une fois établi que le
+        serveur ne répond pas utilement à l'entête `HELLO`.
         """
         self._username = ""
         self._destination = destination
+        self._email_pages: dict[int, gloutils.EmailListPayload] = {}
+        self._resumption_token = ""
+        self._last_request: gloutils.GloMessage | None = None
+        self._reconnecting = False
+        self._negotiating = True
+        self._connect()
+
+    def _connect(self) -> None:
+        """
+        Crée le socket `_client_socket`, le connecte au serveur, démarre le
+        fil de lecture des messages et négocie les options de la connexion.
 
+        Si la connexion est impossible, fait appel à la méthode sys.exit avec
+        un code différent de 0.
+        """
         # Crée un socket et le connecte au serveur.
         try:
             self._client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -40,12 +89,194 @@ class Client:
             self._client_socket.close()
             sys.exit(1)
 
-    def _try_send_message(self, destination_socket: socket.socket, message: str) -> None:
+        # Un fil dedie lit les messages du serveur: il affiche les avis de nouveaux
+        # courriels des leur arrivee et transmet les reponses par la file `_replies`.
+        # Chaque connexion a sa file, pour qu'un ancien fil ne puisse y ecrire.
+        self._replies: queue.Queue[gloutils.GloMessage | None] = queue.Queue()
+        self._reader = threading.Thread(
+            target=self._read_messages,
+            args=(self._client_socket, self._replies),
+            daemon=True,
+        )
+
+        # Le client negocie le codec et la compression des messages, JSON sans
+        # compression jusqu'a la reponse du serveur.
+        self._codec: glocodec.Codec = glocodec.JSON_CODEC
+        self._compress = False
+        self._reader.start()
+        if self._negotiating:
+            self._negotiate()
+
+    def _reconnect(self) -> None:
+        """
+        Rétablit la connexion perdue avec le serveur après un court délai
+        aléatoire, puis reprend la session de l'utilisateur connecté avec
+        son jeton de reprise plutôt qu'avec ses identifiants.
+
+        Quitte si la connexion est perdue à nouveau pendant la reconnexion.
+        Lève `SessionExpiredError` si le serveur refuse la reprise.
+        """
+        self._client_socket.close()
+        if self._reconnecting:
+            sys.exit(1)
+
+        self._reconnecting = True
+        time.sleep(random.uniform(0, RECONNECT_DELAY))
+        self._connect()
+        if self._username:
+            self._resume()
+        self._reconnecting = False
+
+    def _resume(self) -> None:
+        """
+        Présente le jeton de reprise au serveur avec l'entête `AUTH_RESUME`.
+
+        Si la reprise est refusée, l'utilisateur est déconnecté et
+        `SessionExpiredError` est levée avec le message du serveur.
+        """
+        header = gloutils.Headers.AUTH_RESUME
+        payload = gloutils.ResumptionPayload(token=self._resumption_token)
+        message = gloutils.GloMessage(header=header, payload=payload)
+        self._try_send_message(self._client_socket, message)
+
+        reply = self._recv_message()
+        if reply["header"] == gloutils.Headers.OK:
+            self._resumption_token = reply["payload"]["token"]
+            return
+
+        self._username = ""
+        self._resumption_token = ""
+        self._email_pages.clear()
+        self._reconnecting = False
+        raise SessionExpiredError(reply["payload"]["error_message"])
+
+    def _negotiate(self) -> None:
+        """
+        Propose au serveur les codecs connus, par ordre de préférence, la
+        compression des messages et les avis de nouveaux courriels avec
+        l'entête `HELLO`, puis retient les options qu'il choisit.
+
+        Si le serveur ne répond pas à temps, ou que sa réponse est
+        inutilisable, la connexion est rétablie sans négociation, en JSON
+        sans compression: une réponse tardive ne peut ainsi être prise pour
+        celle d'une autre requête.
+        """
+        header = gloutils.Headers.HELLO
+        payload = gloutils.HelloPayload(
+            codecs=list(glocodec.CODECS),
+            compression=[glosocket.COMPRESSION],
+            features=[gloutils.NEW_MAIL_FEATURE],
+        )
+        message = gloutils.GloMessage(header=header, payload=payload)
+        self._try_send_message(self._client_socket, message)
+
+        try:
+            reply = self._replies.get(timeout=NEGOTIATION_TIMEOUT)
+        except queue.Empty:
+            reply = None
+
+        options = self._negotiated_options(reply)
+        if options is None:
+            self._negotiating = False
+            self._client_socket.close()
+            self._connect()
+            return
+        self._codec, self._compress = options
+
+    @staticmethod
+    def _negotiated_options(
+        reply: gloutils.GloMessage | None,
+    ) -> tuple[glocodec.Codec, bool] | None:
+        """
+        Retourne le codec et la compression retenus par le serveur dans sa
+        réponse à `HELLO`: ceux par défaut s'il l'a refusée avec l'entête
+        `ERROR`, None si la réponse est absente ou inutilisable.
+        """
+        if not isinstance(reply, dict):
+            return None
+        if reply.get("header") == gloutils.Headers.ERROR:
+            return glocodec.JSON_CODEC, False
+
+        payload = reply.get("payload")
+        if reply.get("header") != gloutils.Headers.OK or not isinstance(payload, dict):
+            return None
+        codecs = payload.get("codecs")
+        compression = payload.get("compression", [])
+        if (
+            not isinstance(codecs, list)
+            or len(codecs) != 1
+            or codecs[0] not in glocodec.CODECS
+            or not isinstance(compression, list)
+            or any(name != glosocket.COMPRESSION for name in compression)
+        ):
+            return None
+        return glocodec.CODECS[codecs[0]], bool(compression)
+
+    def _try_send_message(
+        self, destination_socket: socket.socket, message: gloutils.GloMessage
+    ) -> None:
+        """
+        Transmet le message au serveur. Si la connexion est perdue, la
+        rétablit puis transmet le message une seconde fois; quitte si elle
+        est perdue à nouveau.
+        """
+        if message["header"] not in _NO_REPLY:
+            self._last_request = message
+        for attempt in range(2):
+            try:
+                glosocket.send_frame(
+                    self._client_socket, self._codec.encode(message), self._compress
+                )
+                return
+            except glosocket.GLOSocketError:
+                if attempt == 0:
+                    self._reconnect()
+            except glocodec.CodecError:
+                break
+        self._client_socket.close()
+        sys.exit(1)
+
+    def _read_messages(
+        self,
+        client_socket: socket.socket,
+        replies: queue.Queue[gloutils.GloMessage | None],
+    ) -> None:
+        """
+        Reçoit et décode les messages du serveur jusqu'à la fermeture de la
+        connexion. Les avis `NEW_MAIL` sont affichés, les réponses sont
+        placées dans la file `replies`, suivies de None à la fermeture.
+        """
         try:
-            glosocket.send_mesg(destination_socket, message)
-        except glosocket.GLOSocketError:
+            while True:
+                data = glosocket.recv_frame(client_socket)
+                # Le codec est lu apres la reception: HELLO a pu le changer entre temps
+                message = self._codec.decode(data)
+                if message["header"] == gloutils.Headers.NEW_MAIL:
+                    print(gloutils.NEW_MAIL_DISPLAY.format(
+                        sender=message["payload"]["sender"],
+                        subject=message["payload"]["subject"],
+                    ))
+                else:
+                    replies.put(message)
+        except (glosocket.GLOSocketError, glocodec.CodecError):
+            replies.put(None)
+
+    def _recv_message(self) -> gloutils.GloMessage:
+        """
+        Attend la réponse du serveur. Si la connexion est perdue avant la
+        réponse, la rétablit et transmet une seconde fois la dernière
+        requête; quitte si elle est perdue à nouveau.
+        """
+        reply = self._replies.get()
+        if reply is None:
+            request = self._last_request
+            self._reconnect()
+            self._try_send_message(self._client_socket, request)
+            reply = self._replies.get()
+        if reply is None:
             self._client_socket.close()
             sys.exit(1)
+        return reply
 
     def _register(self) -> None:
         """
@@ -66,16 +297,15 @@ class Client:
                                        password=password)
         message = gloutils.GloMessage(header=header,
                                       payload=payload)
-        data = json.dumps(message)
-        self._try_send_message(self._client_socket, data)
+        self._try_send_message(self._client_socket, message)
 
         # Reception de la reponse du serveur
-        data = glosocket.recv_mesg(self._client_socket)
-        reply = json.loads(data)
+        reply = self._recv_message()
 
         # Si la réponse est OK, l’utilisateur est authentifié.
         if reply["header"] == gloutils.Headers.OK:
             self._username = username
+            self._resumption_token = reply.get("payload", {}).get("token", "")
 
         # Si la réponse est ERROR, le client affiche l’erreur et retourne au menu de connexion.
         elif reply["header"] == gloutils.Headers.ERROR:
@@ -100,16 +330,15 @@ class Client:
                                        password=password)
         message = gloutils.GloMessage(header=header,
                                       payload=payload)
-        data = json.dumps(message)
-        self._try_send_message(self._client_socket, data)
+        self._try_send_message(self._client_socket, message)
 
         # Reception de la reponse du serveur
-        data = glosocket.recv_mesg(self._client_socket)
-        reply = json.loads(data)
+        reply = self._recv_message()
 
         # Si la reponse est OK, l'utilisateur est authentifie
         if reply["header"] == gloutils.Headers.OK:
             self._username = username
+            self._resumption_token = reply.get("payload", {}).get("token", "")
 
         # Si la réponse est ERROR, le client affiche l’erreur et retourne au menu de connexion.
         if reply["header"] == gloutils.Headers.ERROR:
@@ -124,19 +353,45 @@ class Client:
         # Si l’utilisateur choisit de quitter, le client prévient le serveur avec l’entete BYE...
         header = gloutils.Headers.BYE
         message = gloutils.GloMessage(header=header)
-        data = json.dumps(message)
-        self._try_send_message(self._client_socket, data)
+        self._try_send_message(self._client_socket, message)
 
         # ...avant de fermer la connexion.
         self._client_socket.close()
 
+    def _request_email_page(self, offset: int) -> gloutils.EmailListPayload:
+        """
+        Demande au serveur la page de courriels débutant au rang `offset`
+        avec l'entête `INBOX_READING_REQUEST`.
+
+        Si la page est en cache, sa version accompagne la demande et le
+        cache est réutilisé quand le serveur répond `NOT_MODIFIED`.
+        """
+        header = gloutils.Headers.INBOX_READING_REQUEST
+        payload = gloutils.EmailListRequestPayload(
+            offset=offset, limit=gloutils.EMAIL_LIST_PAGE_SIZE
+        )
+        cached_page = self._email_pages.get(offset)
+        if cached_page is not None:
+            payload["since_version"] = cached_page["version"]
+        message = gloutils.GloMessage(header=header, payload=payload)
+        self._try_send_message(self._client_socket, message)
+
+        # Reception de la reponse du serveur
+        reply = self._recv_message()
+        if reply["header"] == gloutils.Headers.NOT_MODIFIED:
+            return cached_page
+
+        self._email_pages[offset] = reply["payload"]
+        return reply["payload"]
+
     def _read_email(self) -> None:
         """
         Demande au serveur la liste de ses courriels avec l'entête
-        `INBOX_READING_REQUEST`.
+        `INBOX_READING_REQUEST`, une page à la fois.
 
-        Affiche la liste des courriels puis transmet le choix de l'utilisateur
-        avec l'entête `INBOX_READING_CHOICE`.
+        Affiche la page courante des courriels puis transmet le choix de
+        l'utilisateur avec l'entête `INBOX_READING_CHOICE`. L'utilisateur
+        peut aussi passer à la page suivante ou précédente.
 
         Affiche le courriel à l'aide du gabarit `EMAIL_DISPLAY`.
 
@@ -144,44 +399,70 @@ class Client:
         retourner au menu principal.
         """
 
-        # Le client demande la liste des courriels avec l’entete INBOX_READING_REQUEST.
-        header = gloutils.Headers.INBOX_READING_REQUEST
-        message = gloutils.GloMessage(header=header)
-        data = json.dumps(message)
-        self._try_send_message(self._client_socket, data)
-
-        # Reception de la reponse du serveur
-        data = glosocket.recv_mesg(self._client_socket)
-        reply = json.loads(data)
-        email_list = reply["payload"]["email_list"]
-
-        # Si la liste contient au moins un courriel, elle est affichée, sinon le client retourne au
-        # menu principal.
-        if email_list:
-            for email in email_list:
-                print(email)
-
-            # L’utilisateur choisit un courriel dans la liste.
-            choice = int(input(f"Entrez votre choix [1-{len(email_list)}]: "))
+        # Le client demande la premiere page de courriels avec l’entete INBOX_READING_REQUEST.
+        offset = 0
+        page = self._request_email_page(offset)
+
+        # Si la boite contient au moins un courriel, la page est affichée, sinon le client
+        # retourne au menu principal.
+        if page["total"]:
+            choice = 0
+            while not choice:
+                for email in page["email_list"]:
+                    print(email)
+
+                total = page["total"]
+                has_previous = offset > 0
+                has_next = offset + len(page["email_list"]) < total
+
+                prompt = f"Entrez votre choix [1-{total}]"
+                if has_previous:
+                    prompt += ", 'p' pour la page précédente"
+                if has_next:
+                    prompt += ", 's' pour la page suivante"
+                user_input = input(f"{prompt}: ")
+
+                # L’utilisateur choisit un courriel ou change de page.
+                if user_input == "s" and has_next:
+                    offset += gloutils.EMAIL_LIST_PAGE_SIZE
+                    page = self._request_email_page(offset)
+                elif user_input == "p" and has_previous:
+                    offset = max(offset - gloutils.EMAIL_LIST_PAGE_SIZE, 0)
+                    page = self._request_email_page(offset)
+                elif user_input.isdigit() and 1 <= int(user_input) <= total:
+                    choice = int(user_input)
+                    email_ids = page["email_ids"]
+                else:
+                    print(f"Aucune option correspond à {user_input}. Réessayez.")
 
-            # Le client transmet ce choix avec l’entete INBOX_READING_CHOICE.
+            # Le client transmet ce choix avec l’entete INBOX_READING_CHOICE, par
+            # l'identifiant du courriel s'il figure dans la page affichée.
             header = gloutils.Headers.INBOX_READING_CHOICE
-            payload = gloutils.EmailChoicePayload(choice=choice)
+            if 0 <= choice - offset - 1 < len(email_ids):
+                payload = gloutils.EmailIdChoicePayload(
+                    email_id=email_ids[choice - offset - 1]
+                )
+            else:
+                payload = gloutils.EmailChoicePayload(choice=choice)
             message = gloutils.GloMessage(header=header,
                                         payload=payload)
-            data = json.dumps(message)
-            self._try_send_message(self._client_socket, data)
+            self._try_send_message(self._client_socket, message)
 
             # Reception de la reponse du serveur
-            data = glosocket.recv_mesg(self._client_socket)
-            reply = json.loads(data)
+            reply = self._recv_message()
             email_content = reply["payload"]
 
+            # Le courriel a pu disparaitre de la liste entre temps.
+            if reply["header"] == gloutils.Headers.ERROR:
+                print(email_content["error_message"])
+                return
+
             # Le client affiche le courriel à l’aide du gabarit EMAIL_DISPLAY et retourne au menu
             # principal.
+            destination = email_content["destination"]
             string_to_display = gloutils.EMAIL_DISPLAY.format(
                 sender=email_content["sender"],
-                to=email_content["destination"],
+                to=destination if isinstance(destination, str) else ", ".join(destination),
                 subject=email_content["subject"],
                 date=email_content["date"],
                 body=email_content["content"],
@@ -206,8 +487,10 @@ class Client:
         # Variables
         sender = f"{self._username}@{gloutils.SERVER_DOMAIN}"
 
-        # Le client demande à l’utilisateur respectivement : dest, subject, body
+        # Le client demande à l’utilisateur respectivement : dest, subject, body.
+        # Plusieurs destinataires sont separes par des virgules.
         destination = input("Entrez l'adresse du destinataire: ")
+        addresses = [address.strip() for address in destination.split(",")]
         subject = input("Entrez le sujet: ")
         print("Entrez le contenu du courriel, terminez la saisie avec un '.'seul sur une ligne:")
         body = ""
@@ -223,19 +506,17 @@ class Client:
         header = gloutils.Headers.EMAIL_SENDING
         payload = gloutils.EmailContentPayload(
             sender=sender,
-            destination=destination,
+            destination=addresses[0] if len(addresses) == 1 else addresses,
             subject=subject,
             date=current_date_time,
             content=body
         )
         message = gloutils.GloMessage(header=header,
                                       payload=payload)
-        data = json.dumps(message)
-        self._try_send_message(self._client_socket, data)
+        self._try_send_message(self._client_socket, message)
 
         # Reception de la reponse du serveur
-        data = glosocket.recv_mesg(self._client_socket)
-        reply = json.loads(data)
+        reply = self._recv_message()
 
         # Le client affiche si l’envoi s’est effectué avec succès.
         if reply["header"] == gloutils.Headers.OK:
@@ -253,12 +534,10 @@ class Client:
         # Le client demande les statistiques du compte avec un entete STATS_REQUEST.
         header = gloutils.Headers.STATS_REQUEST
         message = gloutils.GloMessage(header=header)
-        data = json.dumps(message)
-        self._try_send_message(self._client_socket, data)
+        self._try_send_message(self._client_socket, message)
 
         # Reception de la reponse du serveur
-        data = glosocket.recv_mesg(self._client_socket)
-        reply = json.loads(data)
+        reply = self._recv_message()
 
         # Le client affiche les statistiques en utilisant le gabarit STATS_DISPLAY.
         string_to_display = gloutils.STATS_DISPLAY.format(**reply["payload"])
@@ -274,11 +553,12 @@ class Client:
         # Le client informe le serveur de la déconnexion avec l’entete AUTH_LOGOUT.
         header = gloutils.Headers.AUTH_LOGOUT
         message = gloutils.GloMessage(header=header)
-        data = json.dumps(message)
-        self._try_send_message(self._client_socket, data)
+        self._try_send_message(self._client_socket, message)
 
         # Le client retourne sur le menu de connexion.
         self._username = ""
+        self._resumption_token = ""
+        self._email_pages.clear()
 
     def run(self) -> None:
         """Point d'entrée du client."""
@@ -309,15 +589,20 @@ class Client:
                     print(f"Aucune option correspond à {user_input}. Réessayez.")
                     continue
 
-                match int(user_input):
-                    case 1:
-                        self._read_email()
-                    case 2:
-                        self._send_email()
-                    case 3:
-                        self._check_stats()
-                    case 4:
-                        self._logout()
+                # Si la session n'a pu etre reprise apres une reconnexion, le client
+                # retourne au menu de connexion.
+                try:
+                    match int(user_input):
+                        case 1:
+                            self._read_email()
+                        case 2:
+                            self._send_email()
+                        case 3:
+                            self._check_stats()
+                        case 4:
+                            self._logout()
+                except SessionExpiredError as ex:
+                    print(ex)
 
 
 # NE PAS ÉDITER PASSÉ CE POINT
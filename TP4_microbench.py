@@ -0,0 +1,302 @@
+"""\
+GLO-2000 Travail pratique 4 - Microbancs d'essai 2025
+Noms et numéros étudiants:
+- Samuel Blanchette 111 159 329
+- Wiseley Paul Enzer Petiton 537 047 716
+- Jacob Provencher 111 272 785
+"""
+
+import argparse
+import hashlib
+import json
+import platform
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from typing import Callable
+
+import glocodec
+import glosocket
+import glostore
+import gloutils
+
+
+DEFAULT_MESSAGE_SIZES = "100,10000,1000000,50000000"
+DEFAULT_MAILBOX_SIZES = "10,10000,1000000"
+
+BENCH_USERNAME = "microbench"
+
+
+def measure(function: Callable[[], object], repeat: int) -> dict:
+    """Exécute `function` `repeat` fois et résume les durées, en secondes."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {
+        "repeat": repeat,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.fmean(durations),
+    }
+
+
+def _repeat_for(size: int) -> int:
+    """Nombre de répétitions adapté à la taille de l'entrée."""
+    return max(3, min(1000, 10_000_000 // max(size, 1)))
+
+
+def bench_framing(sizes: list[int]) -> list[dict]:
+    """
+    Mesure send_mesg/recv_mesg sur une paire de sockets, par taille de
+    message, puis send_frame/recv_frame avec compression sur un texte.
+    """
+    results = []
+    for size in sizes:
+        message = "x" * size
+        text = ("Bonjour, voici le courriel numéro 42 de la série. " * (size // 50 + 1))[:size]
+        sender, receiver = socket.socketpair()
+        max_size = max(size, glosocket.MAX_MESG_SIZE)
+
+        def round_trip() -> None:
+            thread = threading.Thread(target=glosocket.send_mesg, args=(sender, message))
+            thread.start()
+            glosocket.recv_mesg(receiver, max_size=max_size)
+            thread.join()
+
+        def compressed_round_trip() -> None:
+            data = text.encode("utf-8")
+            thread = threading.Thread(target=glosocket.send_frame, args=(sender, data, True))
+            thread.start()
+            glosocket.recv_frame(receiver, max_size=max_size)
+            thread.join()
+
+        for name, function in (
+            ("glosocket.send_recv", round_trip),
+            ("glosocket.send_recv.zlib", compressed_round_trip),
+        ):
+            result = measure(function, _repeat_for(size))
+            result.update(name=name, size=size)
+            result["throughput_mb_s"] = size / result["median"] / 1e6
+            results.append(result)
+
+        sender.close()
+        receiver.close()
+    return results
+
+
+def _sample_email(index: int, content_size: int = 512) -> gloutils.EmailContentPayload:
+    return gloutils.EmailContentPayload(
+        sender=f"expediteur{index % 97}@{gloutils.SERVER_DOMAIN}",
+        destination=f"{BENCH_USERNAME}@{gloutils.SERVER_DOMAIN}",
+        subject=f"Sujet numéro {index}",
+        date=time.strftime(
+            "%a, %d %b %Y %H:%M:%S +0000", time.gmtime(1_700_000_000 + index)
+        ),
+        content="x" * content_size,
+    )
+
+
+def bench_serialization() -> list[dict]:
+    """
+    Mesure json.dumps/json.loads, puis l'encodage et le décodage de chaque
+    codec de glocodec, sur des messages GloMessage typiques.
+    """
+    messages = {
+        "auth": gloutils.GloMessage(
+            header=gloutils.Headers.AUTH_LOGIN,
+            payload=gloutils.AuthPayload(username="alice", password="Password123"),
+        ),
+        "email_512": gloutils.GloMessage(
+            header=gloutils.Headers.EMAIL_SENDING, payload=_sample_email(0)
+        ),
+        "email_100k": gloutils.GloMessage(
+            header=gloutils.Headers.EMAIL_SENDING, payload=_sample_email(0, 100_000)
+        ),
+        "email_list_1000": gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload=gloutils.EmailListPayload(
+                email_list=[f"#{i} alice@glo2000.ca - Sujet {i}" for i in range(1000)],
+                email_ids=[hashlib.sha256(str(i).encode()).hexdigest() for i in range(1000)],
+                total=1000,
+            ),
+        ),
+    }
+
+    results = []
+    for name, message in messages.items():
+        data = json.dumps(message)
+        repeat = _repeat_for(len(data))
+        for operation, function in (
+            ("json.dumps", lambda: json.dumps(message)),
+            ("json.loads", lambda: json.loads(data)),
+        ):
+            result = measure(function, repeat)
+            result.update(name=operation, message=name, size=len(data))
+            results.append(result)
+
+        for codec in glocodec.CODECS.values():
+            encoded = codec.encode(message)
+            for operation, function in (
+                (f"glocodec.{codec.name}.encode", lambda: codec.encode(message)),
+                (f"glocodec.{codec.name}.decode", lambda: codec.decode(encoded)),
+            ):
+                result = measure(function, repeat)
+                result.update(name=operation, message=name, size=len(encoded))
+                results.append(result)
+    return results
+
+
+def _populate_mailbox(store: glostore.MailStore, count: int) -> None:
+    """Crée dans `store` un compte et une boîte synthétique de `count` courriels."""
+    import TP4_server
+
+    store.create_mailbox(BENCH_USERNAME)
+    store.save_account(BENCH_USERNAME, "")
+
+    size = 0
+    for index in range(count):
+        email_id, data = TP4_server.encode_email(_sample_email(index))
+        store.deliver([BENCH_USERNAME], email_id, data, 1_700_000_000 + index)
+        size += len(data)
+    store.save_stats(BENCH_USERNAME, gloutils.StatsPayload(count=count, size=size))
+    store.commit()
+
+
+def bench_mailbox(sizes: list[int], storage: str) -> list[dict]:
+    """
+    Mesure _get_email_list, _get_email et _get_stats du serveur sur des
+    boîtes synthétiques, avec le stockage `storage`. Le premier accès, qui
+    construit l'index, est mesuré à part.
+    """
+    import TP4_server
+
+    results = []
+    for count in sizes:
+        workdir = tempfile.mkdtemp(prefix="glo_microbench_")
+        # La boite est remplie par le stockage du serveur: celui en memoire n'est pas partage
+        server = TP4_server.Server(storage=storage, data_dir=workdir, listen=False)
+        _populate_mailbox(server._store, count)
+        server._load_accounts()
+        # Une cle sans tampon d'envoi: les reponses sont construites mais pas transmises.
+        client = object()
+        server._start_session(client, BENCH_USERNAME)
+
+        try:
+            cold = measure(lambda: server._get_email_list(client), 1)
+            cold.update(name="server._get_email_list.cold", mailbox=count, storage=storage)
+            results.append(cold)
+
+            page = gloutils.EmailListRequestPayload(
+                offset=0, limit=gloutils.EMAIL_LIST_PAGE_SIZE
+            )
+            listed = server._get_email_list(client, page)["payload"]
+            email_id = listed["email_ids"][0]
+            unchanged = gloutils.EmailListRequestPayload(
+                offset=0,
+                limit=gloutils.EMAIL_LIST_PAGE_SIZE,
+                since_version=listed["version"],
+            )
+            repeat = max(3, min(200, 1_000_000 // count))
+            for name, function in (
+                ("server._get_email_list", lambda: server._get_email_list(client)),
+                ("server._get_email_list.page", lambda: server._get_email_list(client, page)),
+                ("server._get_email_list.not_modified",
+                 lambda: server._get_email_list(client, unchanged)),
+                ("server._get_email.choice", lambda: server._get_email(client, {"choice": 1})),
+                ("server._get_email.id", lambda: server._get_email(client, {"email_id": email_id})),
+                ("server._get_stats", lambda: server._get_stats(client)),
+            ):
+                result = measure(function, repeat)
+                result.update(name=name, mailbox=count, storage=storage)
+                results.append(result)
+        finally:
+            server.cleanup()
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _result_key(result: dict) -> tuple:
+    return tuple(
+        (key, result[key])
+        for key in ("name", "message", "size", "mailbox", "storage")
+        if key in result
+    )
+
+
+def compare(baseline: dict, current: dict, file=sys.stdout) -> None:
+    """Affiche dans `file` le rapport des médianes courantes sur celles de la référence."""
+    reference = {_result_key(result): result for result in baseline["results"]}
+    for result in current["results"]:
+        previous = reference.get(_result_key(result))
+        if previous is None:
+            continue
+        ratio = result["median"] / previous["median"] if previous["median"] else float("inf")
+        label = " ".join(f"{key}={value}" for key, value in _result_key(result))
+        print(f"{label:<70} {ratio:>7.2f}x", file=file)
+
+
+def _parse_sizes(sizes: str) -> list[int]:
+    return [int(size) for size in sizes.split(",") if size]
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--message-sizes", default=DEFAULT_MESSAGE_SIZES,
+                        help="Tailles des messages transmis, en octets.")
+    parser.add_argument("--mailbox-sizes", default=DEFAULT_MAILBOX_SIZES,
+                        help="Nombres de courriels des boîtes synthétiques.")
+    parser.add_argument("--storage", choices=tuple(glostore.MAIL_STORES),
+                        action="append", help="Stockages des boîtes synthétiques.")
+    parser.add_argument("--only", choices=("framing", "serialization", "mailbox"),
+                        action="append", help="Ne lancer que ces suites.")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Fichier où écrire les résultats au format JSON.")
+    parser.add_argument("--compare", default=None,
+                        help="Résultats JSON de référence à comparer.")
+    args = parser.parse_args(sys.argv[1:])
+
+    # La reference est lue avant les mesures: une erreur de chemin ne les gaspille pas.
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    suites = args.only or ["framing", "serialization", "mailbox"]
+    results: list[dict] = []
+    if "framing" in suites:
+        results += bench_framing(_parse_sizes(args.message_sizes))
+    if "serialization" in suites:
+        results += bench_serialization()
+    if "mailbox" in suites:
+        for storage in args.storage or [glostore.FileMailStore.name]:
+            results += bench_mailbox(_parse_sizes(args.mailbox_sizes), storage)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "results": results,
+    }
+
+    data = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(data)
+    else:
+        print(data)
+
+    # Sans -o, la sortie standard porte le JSON: la comparaison passe sur l'erreur standard
+    if baseline is not None:
+        compare(baseline, report, sys.stdout if args.output else sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
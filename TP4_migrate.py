@@ -0,0 +1,52 @@
+"""\
+GLO-2000 Travail pratique 4 - Migration des boîtes de réception 2025
+Noms et numéros étudiants:
+- Samuel Blanchette 111 159 329
+- Wiseley Paul Enzer Petiton 537 047 716
+- Jacob Provencher 111 272 785
+"""
+
+import argparse
+import sys
+
+from pathlib import Path
+
+import glostore
+import gloutils
+
+
+# Stockages en fichiers entre lesquels les boites peuvent etre converties.
+LAYOUTS = (glostore.FileMailStore.name, glostore.ShardedFileMailStore.name)
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Convertit sur place les boîtes de réception, serveur arrêté."
+    )
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        required=True,
+        help="Disposition visée: courriels à plat ou en sous-dossiers.",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=gloutils.SERVER_DATA_DIR,
+        help="Dossier des données du serveur.",
+    )
+    args = parser.parse_args(sys.argv[1:])
+
+    data_dir = Path(args.data_dir)
+    if not data_dir.is_dir():
+        print(f"Le dossier {data_dir} n'existe pas.")
+        return 1
+
+    store = glostore.MAIL_STORES[args.layout](data_dir)
+    moved = store.migrate()
+    store.close()
+    print(f"{moved} courriel(s) déplacé(s) vers la disposition `{args.layout}`.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -6,19 +6,29 @@ Noms et numéros étudiants:
 - Jacob Provencher 111 272 785
 """
 
+import bisect
+import collections
+import functools
 import hashlib
 import hmac
 import json
-import select
+import os
+import selectors
 import socket
 import sys
 import re
+import secrets
+import time
 import logging
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from typing import Callable
 
+import glocodec
 import glosocket
+import glostore
 import gloutils
 
 
@@ -28,54 +38,405 @@ logging.basicConfig(
 logger = logging.getLogger()
 logger.disabled = True
 
+# Format des dates produites par `gloutils.get_current_utc_time`.
+_EMAIL_DATE_FORMAT = "%a, %d %b %Y %H:%M:%S %z"
+
+# Nombre maximal d'octets lus d'un coup sur un socket client.
+_RECV_SIZE = 65536
+
+# Taille du tampon d'envoi d'un client au-dela de laquelle le serveur cesse de
+# lire ses requetes, jusqu'a ce que le client ait consomme ses reponses.
+SEND_HIGH_WATER_MARK = 1 << 20
+
+# Taille du tampon d'envoi d'un client au-dela de laquelle il est deconnecte.
+SEND_BUFFER_LIMIT = 8 << 20
+
+# Duree de validite, en secondes, d'un jeton de reprise de session, et nombre
+# maximal de jetons conserves: au-dela, les plus anciens sont oublies.
+RESUMPTION_TOKEN_TTL = 15 * 60
+RESUMPTION_TOKEN_LIMIT = 100_000
+
+# Parametres de scrypt pour le hachage des mots de passe: environ 16 Mio de memoire
+# et quelques dizaines de millisecondes par hachage.
+SCRYPT_N = 1 << 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Nombre de fils hachant les mots de passe, et nombre maximal de hachages en cours
+# ou en attente: au-dela, les demandes d'authentification sont refusees.
+PASSWORD_WORKERS = 4
+PASSWORD_MAX_PENDING = 64
+
+# Variable d'environnement designant le moteur de stockage, a defaut de l'argument
+# `storage`. Sans elle, le stockage en fichiers est utilise.
+STORAGE_ENV_VAR = "GLO_STORAGE"
+
+# Entetes des requetes reservees aux clients authentifies.
+_AUTHENTICATED_HEADERS = frozenset({
+    gloutils.Headers.INBOX_READING_REQUEST,
+    gloutils.Headers.INBOX_READING_CHOICE,
+    gloutils.Headers.STATS_REQUEST,
+    gloutils.Headers.EMAIL_SENDING,
+    gloutils.Headers.EMAIL_BATCH_SENDING,
+})
+
+# Forme des identifiants de courriels (empreinte sha256 en hexadecimal). Ceux des
+# courriels livres avant `encode_email` sont l'empreinte de l'expediteur et de la date:
+# ils ont la meme forme, mais ne disent rien du contenu.
+_EMAIL_ID_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+# Formes des adresses de destination acceptees, et de celles de ce domaine.
+_VALID_ADDRESS_PATTERN = re.compile(
+    r"^([a-zA-Z0-9_\.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-\.]+$)"
+)
+_INTERNAL_ADDRESS_PATTERN = re.compile(
+    rf"^[a-zA-Z0-9_\.+-]+@{re.escape(gloutils.SERVER_DOMAIN)}$"
+)
+
+# Entree du registre des comptes: (nom canonique du dossier, mot de passe hache).
+AccountEntry = tuple[str, str]
+
+# Entree de l'index d'une boite de reception:
+# (horodatage, identifiant, expediteur, sujet, date).
+InboxEntry = tuple[float, str, str, str, str]
+
+
+def encode_email(payload: gloutils.EmailContentPayload) -> tuple[str, bytes]:
+    """
+    Retourne l'identifiant du courriel et les octets conservés par le
+    stockage. L'identifiant est l'empreinte de ces octets: deux courriels
+    envoyés dans la même seconde par le même expéditeur, par exemple dans
+    un même lot, ne s'écrasent pas.
+    """
+    email_data = json.dumps(payload, indent=4).encode("utf-8")
+    return hashlib.sha256(email_data).hexdigest(), email_data
+
+
+def hash_password(password: str) -> str:
+    """
+    Hache le mot de passe avec scrypt et un sel aléatoire. Retourne la
+    chaîne à conserver, qui porte les paramètres et le sel.
+    """
+    salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(
+        password.encode("utf-8"), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P
+    )
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password: str, stored_hash: str) -> tuple[bool, str | None]:
+    """
+    Vérifie le mot de passe contre le haché conservé.
+
+    Les hachés `sha3_512` des comptes créés avant scrypt sont acceptés: si
+    le mot de passe est valide, le second élément est alors le haché scrypt
+    qui doit les remplacer.
+    """
+    if not stored_hash.startswith("scrypt$"):
+        provided_hash = hashlib.sha3_512(password.encode("utf-8")).hexdigest()
+        if hmac.compare_digest(provided_hash, stored_hash):
+            return True, hash_password(password)
+        return False, None
+
+    try:
+        _, n, r, p, salt, digest = stored_hash.split("$")
+        provided_digest = hashlib.scrypt(
+            password.encode("utf-8"),
+            salt=bytes.fromhex(salt),
+            n=int(n),
+            r=int(r),
+            p=int(p),
+            dklen=len(digest) // 2,
+        )
+    except ValueError:
+        return False, None
+    return hmac.compare_digest(provided_digest.hex(), digest), None
+
 
 class Server:
     """Serveur mail @glo2000.ca 2025."""
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        send_high_water_mark: int = SEND_HIGH_WATER_MARK,
+        send_buffer_limit: int = SEND_BUFFER_LIMIT,
+        resumption_token_ttl: float = RESUMPTION_TOKEN_TTL,
+        resumption_token_limit: int = RESUMPTION_TOKEN_LIMIT,
+        password_workers: int = PASSWORD_WORKERS,
+        password_max_pending: int = PASSWORD_MAX_PENDING,
+        storage: str | None = None,
+        data_dir: str = gloutils.SERVER_DATA_DIR,
+        listen: bool = True,
+    ) -> None:
         """
         Prépare le socket du serveur `_server_socket`
         et le met en mode écoute.
 
+        Si `listen` est faux, aucun port n'est ouvert et `_server_socket`
+        vaut None: les traitements du serveur peuvent être appelés
+        directement, par les mesures et les tests, mais `run` ne peut être
+        lancée.
+
+        `send_high_water_mark` et `send_buffer_limit` bornent le tampon
+        d'envoi de chaque client: au-delà du premier, ses requêtes ne sont
+        plus lues; au-delà du second, il est déconnecté.
+
+        `resumption_token_ttl` et `resumption_token_limit` bornent la durée
+        de validité et le nombre des jetons de reprise de session.
+
+        `password_workers` et `password_max_pending` fixent le nombre de fils
+        hachant les mots de passe et le nombre de hachages admis à la fois.
+
+        `storage` désigne le moteur de `glostore.MAIL_STORES` conservant les
+        comptes, les statistiques et les courriels, dans le dossier `data_dir`.
+        À défaut, il est lu dans la variable d'environnement STORAGE_ENV_VAR.
+
         Prépare les attributs suivants:
-        - `_client_socs` une liste des sockets clients.
+        - `_selector` le sélecteur surveillant les sockets.
+        - `_recv_buffers` un dictionnaire associant chaque socket
+            client connecté à son tampon de réception.
+        - `_pending` un dictionnaire associant chaque socket client aux
+            messages reçus en rafale qui n'ont pas encore été traités.
+        - `_codecs` un dictionnaire associant chaque socket client au codec
+            négocié avec l'entête HELLO. JSON est utilisé à défaut.
+        - `_compressing` l'ensemble des sockets clients ayant négocié la
+            compression des messages.
+        - `_notified` l'ensemble des sockets clients ayant demandé d'être
+            avertis des courriels livrés à leur utilisateur.
+        - `_send_buffers` un dictionnaire associant chaque socket
+            client connecté aux octets qu'il reste à lui transmettre.
+        - `_closing` l'ensemble des clients à déconnecter une fois leur
+            tampon d'envoi vidé.
+        - `_corked` l'ensemble des clients dont les réponses sont retenues
+            pendant le traitement d'une rafale, puis transmises ensemble.
         - `_logged_users` un dictionnaire associant chaque
             socket client à un nom d'utilisateur.
-
-        S'assure que les dossiers de données du serveur existent.
+        - `_user_sessions` l'index inverse de `_logged_users`, associant
+            chaque nom d'utilisateur (en minuscules) à l'ensemble des
+            sockets de ses sessions.
+        - `_resumption_tokens` la table des jetons de reprise de session,
+            associant chaque jeton au nom d'utilisateur et à l'échéance de
+            la session, du plus ancien au plus récent.
+        - `_session_tokens` un dictionnaire associant chaque socket client
+            authentifié au dernier jeton de reprise émis pour sa session.
+        - `_password_pool` le bassin de fils hachant les mots de passe, hors
+            de la boucle principale.
+        - `_password_jobs` un dictionnaire associant chaque socket client
+            dont le mot de passe est en cours de hachage au Future du
+            hachage et à la fonction qui complète sa requête.
+        - `_password_done` la file des sockets clients dont le hachage est
+            terminé, remplie par les fils du bassin et vidée par la boucle
+            principale, réveillée par la paire de sockets `_wake_recv` et
+            `_wake_send`.
+        - `_accounts` un registre associant chaque nom d'utilisateur (en
+            minuscules) à son nom canonique et à son mot de passe haché.
+        - `_mailbox_stats` un dictionnaire associant chaque nom d'utilisateur
+            (en minuscules) au nombre et à la taille de ses courriels.
+        - `_inboxes` un dictionnaire associant chaque nom d'utilisateur
+            (en minuscules) à l'index trié de sa boîte de réception.
+        - `_mailbox_versions` un dictionnaire associant chaque nom
+            d'utilisateur (en minuscules) à la version de sa boîte,
+            incrémentée à chaque livraison.
+        - `_store` le moteur de stockage des comptes et des boîtes de
+            réception.
+        - `_awaiting_commit` l'ensemble des clients dont les réponses sont
+            retenues jusqu'à ce que le lot de livraisons en cours soit
+            durable.
+        - `_touched_users` l'ensemble des utilisateurs dont les statistiques
+            ont changé depuis le dernier lot.
         """
         self._localhost = "127.0.0.1"
-        self._email_subfolder_name = "emails"
 
-        # Cree le socket en mode IPv4 et TCP et mets en ecoute sur le port `APP_PORT`
-        try:
-            self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self._server_socket.bind((self._localhost, gloutils.APP_PORT))
-            self._server_socket.listen()
-        except OSError:
-            self._server_socket.close()
-            sys.exit(1)
+        # Choisit le moteur de stockage avant d'ouvrir le port: un nom inconnu arrete le serveur
+        if storage is None:
+            storage = os.environ.get(STORAGE_ENV_VAR, glostore.FileMailStore.name)
+        if storage not in glostore.MAIL_STORES:
+            sys.exit(
+                f"Stockage inconnu: {storage}. Choix possibles: "
+                f"{', '.join(glostore.MAIL_STORES)}."
+            )
 
-        # Prepare une liste vide pour les sockets clients connectes
-        self._client_socs: list[socket.socket] = []
+        # Cree le socket en mode IPv4 et TCP et mets en ecoute sur le port `APP_PORT`
+        self._server_socket: socket.socket | None = None
+        if listen:
+            try:
+                self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self._server_socket.bind((self._localhost, gloutils.APP_PORT))
+                self._server_socket.listen()
+                self._server_socket.setblocking(False)
+            except OSError:
+                self._server_socket.close()
+                sys.exit(1)
+
+        # Prepare le selecteur (epoll sous Linux) qui surveille le socket du serveur
+        # et ceux des clients
+        self._selector = selectors.DefaultSelector()
+        if self._server_socket is not None:
+            self._selector.register(self._server_socket, selectors.EVENT_READ)
+
+        # Prepare un dictionnaire vide qui associe les sockets clients connectes a leur
+        # tampon de reception, ou s'accumulent les messages partiellement recus
+        self._recv_buffers: dict[socket.socket, bytearray] = {}
+
+        # Prepare les files des requetes pipelinees, traitees dans l'ordre de reception
+        self._pending: dict[socket.socket, collections.deque[bytes]] = {}
+
+        # Prepare un dictionnaire vide des codecs negocies par les clients
+        self._codecs: dict[socket.socket, glocodec.Codec] = {}
+        self._compressing: set[socket.socket] = set()
+        self._notified: set[socket.socket] = set()
+
+        # Prepare un tampon de lecture reutilise pour tous les clients
+        self._recv_chunk = memoryview(bytearray(_RECV_SIZE))
+
+        # Prepare les tampons d'envoi, vides tant que le socket accepte les donnees, et
+        # l'ensemble des clients qui attendent leur vidange avant d'etre deconnectes
+        self._send_buffers: dict[socket.socket, bytearray] = {}
+        self._closing: set[socket.socket] = set()
+        self._corked: set[socket.socket] = set()
+        self._send_high_water_mark = send_high_water_mark
+        self._send_buffer_limit = send_buffer_limit
 
         # Prepare un dictionnaire vide qui associe les sockets clients authentifies a leur nom d'utilisateur
         self._logged_users: dict[socket.socket, str] = {}
+        self._user_sessions: dict[str, set[socket.socket]] = {}
 
-        # S'assurer que le dossier SERVER_DATA_DIR existe et qu'il contient le SERVER_LOST_DIR. Les creer sinon.
-        self._server_data_dir_path = Path(gloutils.SERVER_DATA_DIR)
+        # Prepare la table des jetons de reprise, survivant a la fermeture des connexions.
+        # Tous les jetons ont la meme duree de vie: l'ordre d'insertion est celui des echeances.
+        self._resumption_tokens: collections.OrderedDict[str, tuple[str, float]] = (
+            collections.OrderedDict()
+        )
+        self._session_tokens: dict[socket.socket, str] = {}
+        self._resumption_token_ttl = resumption_token_ttl
+        self._resumption_token_limit = resumption_token_limit
+
+        # Prepare le bassin de hachage des mots de passe. scrypt libere le GIL: les fils
+        # hachent en parallele sans ralentir la boucle, qui complete les requetes.
+        self._password_pool = ThreadPoolExecutor(
+            max_workers=password_workers, thread_name_prefix="password"
+        )
+        self._password_max_pending = password_max_pending
+        self._password_jobs: dict[
+            socket.socket, tuple[Future, Callable[[object], None]]
+        ] = {}
+        self._password_done: collections.deque[socket.socket] = collections.deque()
+
+        # Le bassin reveille le selecteur en ecrivant un octet sur cette paire de sockets
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+        self._selector.register(self._wake_recv, selectors.EVENT_READ)
+
+        # Prepare l'index des boites de reception, construit paresseusement au premier acces
+        # et tenu trie du plus ancien au plus recent.
+        self._inboxes: dict[str, list[InboxEntry]] = {}
+
+        # Prepare les versions des boites. Une boite non modifiee depuis le demarrage a la
+        # version initiale, tiree de l'horloge: elle depasse toute version attribuee lors
+        # d'une execution precedente du serveur.
+        self._initial_version = time.time_ns()
+        self._mailbox_versions: dict[str, int] = {}
+
+        # Prepare le moteur de stockage. Ceux en dossiers s'assurent que `data_dir`
+        # existe et qu'il contient le SERVER_LOST_DIR.
+        self._server_data_dir_path = Path(data_dir)
         self._server_lost_dir_path = gloutils.SERVER_LOST_DIR
-        fullpath = self._server_data_dir_path / self._server_lost_dir_path
-        fullpath.mkdir(parents=True, exist_ok=True)
+        self._store: glostore.MailStore = glostore.MAIL_STORES[storage](
+            self._server_data_dir_path
+        )
+
+        logger.info(f"Le serveur utilise le stockage `{storage}`.")
+
+        # Prepare le lot de livraisons: les courriels sont ecrits au fil des requetes, mais
+        # rendus durables ensemble, avant que les reponses de leurs clients ne partent.
+        self._awaiting_commit: set[socket.socket] = set()
+        self._touched_users: set[str] = set()
+
+        # Charge une seule fois le registre des comptes existants et leurs statistiques,
+        # puis rend durables celles qui ont ete reconstruites
+        self._accounts: dict[str, AccountEntry] = {}
+        self._mailbox_stats: dict[str, gloutils.StatsPayload] = {}
+        self._load_accounts()
+        self._store.commit()
+
+    def _load_accounts(self) -> None:
+        """
+        Remplit le registre des comptes à partir de ceux du stockage.
+
+        Les statistiques que le stockage signale comme douteuses, après un
+        arrêt brutal, sont reconstruites plutôt que chargées.
+        """
+        stale = {username.lower() for username in self._store.recover()}
+        for username, stored_hash in self._store.load_accounts():
+            self._accounts[username.lower()] = (username, stored_hash)
+            if username.lower() in stale:
+                self._rebuild_stats(username)
+            else:
+                self._load_stats(username)
+
+        logger.info(f"Le serveur a charge {len(self._accounts)} comptes.")
+
+    def _load_stats(self, username: str) -> None:
+        """
+        Charge les statistiques conservées par le stockage, ou les
+        reconstruit si elles sont absentes ou illisibles.
+        """
+        stats = self._store.load_stats(username)
+        if stats is None:
+            self._rebuild_stats(username)
+            return
+
+        self._mailbox_stats[username.lower()] = stats
+
+    def _rebuild_stats(self, username: str) -> None:
+        """
+        Recompte le nombre et la taille des courriels de l'utilisateur à
+        partir de sa boîte et conserve le résultat.
+        """
+        logger.info(f"Le serveur reconstruit les statistiques de {username}.")
+
+        count, size = self._store.usage(username)
+        self._mailbox_stats[username.lower()] = gloutils.StatsPayload(
+            count=count, size=size
+        )
+        self._save_stats(username)
+
+    def _save_stats(self, username: str) -> None:
+        """Confie les statistiques de l'utilisateur au stockage."""
+        self._store.save_stats(username, self._mailbox_stats[username.lower()])
+
+    def _update_stats(self, username: str, count_delta: int, size_delta: int) -> None:
+        """
+        Ajuste les statistiques de l'utilisateur lors de l'ajout (deltas
+        positifs) ou du retrait (deltas négatifs) d'un courriel. Elles sont
+        écrites une fois par lot, par `_commit_deliveries`.
+        """
+        stats = self._mailbox_stats[username.lower()]
+        stats["count"] += count_delta
+        stats["size"] += size_delta
+        self._touched_users.add(username)
 
-        logger.info("On s'assure que le dossier `SERVER_DATA_DIR`.")
+    def _find_account(self, username: str) -> AccountEntry | None:
+        """Retourne l'entrée du registre associée au nom, sans égard à la casse."""
+        return self._accounts.get(username.lower())
 
     def cleanup(self) -> None:
-        """Ferme toutes les connexions résiduelles."""
-        for client_soc in self._client_socs:
+        """
+        Ferme toutes les connexions résiduelles, arrête le bassin de hachage
+        et ferme le stockage, qui rend durable le dernier lot de livraisons.
+        """
+        self._password_pool.shutdown(wait=False, cancel_futures=True)
+        for username in self._touched_users:
+            self._save_stats(username)
+        self._store.close()
+        for client_soc in self._recv_buffers:
             client_soc.close()
-        self._server_socket.close()
+        self._selector.close()
+        self._wake_recv.close()
+        self._wake_send.close()
+        if self._server_socket is not None:
+            self._server_socket.close()
 
     def _accept_client(self) -> None:
         """Accepte un nouveau client."""
@@ -85,22 +446,36 @@ class Server:
         except OSError:
             return
 
-        # Le serveur ajoute le client a la liste des sockets connectes
-        self._client_socs.append(client_socket)
+        # Le serveur ajoute le client aux sockets connectes et le fait surveiller
+        client_socket.setblocking(False)
+        self._recv_buffers[client_socket] = bytearray()
+        self._pending[client_socket] = collections.deque()
+        self._send_buffers[client_socket] = bytearray()
+        self._selector.register(client_socket, selectors.EVENT_READ)
 
         logger.info(
             f"""
             Le serveur a accepte un nouveau client et l'a 
             ajoute a sa liste de sockets connectes. Le serveur
-            compte maintenant {len(self._client_socs)} connectes."""
+            compte maintenant {len(self._recv_buffers)} connectes."""
         )
 
     def _remove_client(self, client_soc: socket.socket) -> None:
         """Retire le client des structures de données et ferme sa connexion."""
 
-        if client_soc in self._client_socs:
-            self._client_socs.remove(client_soc)
-            
+        if self._recv_buffers.pop(client_soc, None) is not None:
+            self._selector.unregister(client_soc)
+        self._pending.pop(client_soc, None)
+        self._send_buffers.pop(client_soc, None)
+        self._codecs.pop(client_soc, None)
+        self._compressing.discard(client_soc)
+        self._notified.discard(client_soc)
+        self._closing.discard(client_soc)
+        self._corked.discard(client_soc)
+        self._end_session(client_soc)
+        # Le jeton reste valide: le client peut reprendre sa session en se reconnectant
+        self._session_tokens.pop(client_soc, None)
+
         try:
             client_soc.close()
         except OSError:
@@ -109,24 +484,112 @@ class Server:
         logger.info(
             f"""Un client a quitte. Le serveur a retire le socket associe a
             ce client de sa liste de sockets connectes. Le serveur
-            compte maintenant {len(self._client_socs)} connectes."""
+            compte maintenant {len(self._recv_buffers)} connectes."""
         )
 
-    def _try_send_message(self, destination_socket: socket.socket, message: str) -> None:
+    def _close_client(self, client_soc: socket.socket) -> None:
+        """
+        Déconnecte le client une fois ses réponses en attente transmises.
+
+        Ses requêtes suivantes ne sont plus lues.
+        """
+        if not self._send_buffers.get(client_soc):
+            self._remove_client(client_soc)
+            return
+
+        self._closing.add(client_soc)
+        self._update_events(client_soc)
+
+    def _update_events(self, client_soc: socket.socket) -> None:
+        """
+        Ajuste les événements surveillés pour le client selon son tampon
+        d'envoi: l'écriture tant qu'il reste des octets à transmettre, la
+        lecture tant que le tampon n'a pas atteint le seuil haut.
+        """
+        send_buffer = self._send_buffers[client_soc]
+
+        events = 0
+        if len(send_buffer) < self._send_high_water_mark and client_soc not in self._closing:
+            events |= selectors.EVENT_READ
+        if send_buffer:
+            events |= selectors.EVENT_WRITE
+
+        if events != self._selector.get_key(client_soc).events:
+            self._selector.modify(client_soc, events)
+
+    def _flush_client(self, client_soc: socket.socket) -> None:
+        """
+        Transmet sans bloquer autant d'octets du tampon d'envoi que possible.
+
+        Rien n'est transmis au client tant que le lot de livraisons dont
+        dépendent ses réponses n'est pas durable.
+        """
+        if client_soc in self._awaiting_commit:
+            return
+
+        send_buffer = self._send_buffers[client_soc]
         try:
-            glosocket.send_mesg(destination_socket, message)
-        except glosocket.GLOSocketError:
+            sent = client_soc.send(send_buffer)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._remove_client(client_soc)
+            return
+
+        del send_buffer[:sent]
+
+        if not send_buffer and client_soc in self._closing:
+            self._remove_client(client_soc)
+        else:
+            self._update_events(client_soc)
+
+    def _encode_message(self, client_soc: socket.socket, message: gloutils.GloMessage) -> bytes:
+        """Encode le message avec le codec du client, prêt à être transmis."""
+        codec = self._codecs.get(client_soc, glocodec.JSON_CODEC)
+        return glosocket.encode_frame(
+            codec.encode(message), compress=client_soc in self._compressing
+        )
+
+    def _decode_message(self, client_soc: socket.socket, data: bytes) -> gloutils.GloMessage:
+        """Décode un message reçu avec le codec du client."""
+        codec = self._codecs.get(client_soc, glocodec.JSON_CODEC)
+        return codec.decode(data)
+
+    def _try_send_message(
+        self, destination_socket: socket.socket, message: gloutils.GloMessage
+    ) -> None:
+        """
+        Ajoute le message au tampon d'envoi du client et en transmet ce qui
+        peut l'être sans bloquer. Le reste est transmis quand le socket
+        redevient disponible en écriture.
+
+        Pendant le traitement d'une rafale de requêtes du client, la
+        transmission est reportée à la fin de la rafale.
+        """
+        send_buffer = self._send_buffers.get(destination_socket)
+        if send_buffer is None:
+            return
+
+        send_buffer += self._encode_message(destination_socket, message)
+
+        # Un client qui ne consomme plus ses reponses est deconnecte
+        if len(send_buffer) > self._send_buffer_limit:
+            logger.info("Un client ne lit plus ses reponses, le serveur le deconnecte.")
             self._remove_client(destination_socket)
+            return
+
+        if destination_socket not in self._corked:
+            self._flush_client(destination_socket)
 
     def _create_account(
         self, client_soc: socket.socket, payload: gloutils.AuthPayload
-    ) -> gloutils.GloMessage:
+    ) -> gloutils.GloMessage | None:
         """
         Crée un compte à partir des données du payload.
 
-        Si les identifiants sont valides, créee le dossier de l'utilisateur,
-        associe le socket au nouvel l'utilisateur et retourne un succès,
-        sinon retourne un message d'erreur.
+        Si les identifiants sont valides, confie le hachage du mot de passe
+        au bassin et retourne None: `_finish_create_account` complète la
+        création. Sinon, retourne un message d'erreur.
         """
 
         # Variables
@@ -149,14 +612,7 @@ class Server:
 
         # Le serveur s'assure que le nom d'utilisateur n'est pas deja pris et qu'il
         # n'est pas `gloutils.SERVER_LOST_DIR` *Note : les noms sont insensibles a la casse (BOB == bob)
-        is_not_taken_username = True
-        for repo in self._server_data_dir_path.iterdir():
-            if username.lower() in [
-                repo.name.lower(),
-                self._server_lost_dir_path.lower(),
-            ]:
-                is_not_taken_username = False
-                break
+        is_not_taken_username = not self._is_taken_username(username)
 
         is_valid_username = is_valid_username_syntax and is_not_taken_username
 
@@ -174,37 +630,15 @@ class Server:
 
         is_secure_password = is_long_enough_password and is_password_complex_enough
 
-        # Si user infos sont valides --> ajouter les donnees du client dans dossier de donnees du serveur
+        # Si user infos sont valides --> hacher le mot de passe avec scrypt, hors de la boucle
         if is_valid_username and is_secure_password:
-            logger.info("Le serveur ajoute les donnees du client dans le serveur.")
-
-            # Le serveur cree un dossier au nom de l'utilisateur dans le dossier SERVER_DATA_DIR
-            user_mail_dir_path = (
-                self._server_data_dir_path / username / self._email_subfolder_name
+            self._start_password_job(
+                client_soc,
+                hash_password,
+                (password,),
+                functools.partial(self._finish_create_account, client_soc, username),
             )
-            user_mail_dir_path.mkdir(parents=True)
-
-            # Le serveur hache le mode de passe de l'utilisateur avec l'algorithme `sha3_512`.
-            hash_password = hashlib.sha3_512(password.encode("utf_8")).hexdigest()
-
-            # Le serveur ecrit le mot de passe hache dans un fichier nomme PASSWORD_FILENAME
-            user_dir_path = (
-                self._server_data_dir_path
-                / username
-                / f"{gloutils.PASSWORD_FILENAME}.json"
-            )
-            with open(user_dir_path, "w", encoding="utf-8") as file:
-                content = {"password": hash_password}
-                json.dump(content, file, indent=4)
-
-            # Le serveur previent le client du succes avec l'entete OK
-            header = gloutils.Headers.OK
-            message = gloutils.GloMessage(header=header)
-            data = json.dumps(message)
-            self._try_send_message(client_soc, data)
-
-            # Le serveur associe le socket du client à ce nom d’utilisateur
-            self._logged_users[client_soc] = username
+            return None
 
         # Si les identifiants sont invalides ou que le nom d’utilisateur est indisponible,
         # le serveur répond avec l’entete ERROR et un message décrivant le problème
@@ -234,19 +668,90 @@ class Server:
 
             content = gloutils.ErrorPayload(error_message=error_message)
             message = gloutils.GloMessage(header=header, payload=content)
-            data = json.dumps(message)
-            self._try_send_message(client_soc, data)
+            self._try_send_message(client_soc, message)
+
+        return message
+
+    def _is_taken_username(self, username: str) -> bool:
+        """
+        Indique si le nom, sans égard à la casse, est celui d'un compte, de
+        SERVER_LOST_DIR ou d'une boîte déjà conservée par le stockage. Une
+        boîte dont le mot de passe est illisible n'est jamais cédée à un
+        nouveau compte.
+        """
+        if (
+            self._find_account(username) is not None
+            or username.lower() == self._server_lost_dir_path.lower()
+        ):
+            return True
+
+        if self._store.mailbox_exists(username):
+            logger.warning(
+                f"Le nom {username} designe une boite sans mot de passe lisible: "
+                "le serveur refuse de la ceder a un nouveau compte."
+            )
+            return True
+        return False
+
+    def _finish_create_account(
+        self, client_soc: socket.socket, username: str, password_hash: str
+    ) -> gloutils.GloMessage:
+        """
+        Complète la création du compte une fois le mot de passe haché: crée
+        le dossier de l'utilisateur, associe le socket au nouvel utilisateur
+        et retourne un succès, transmis une fois le lot en cours durable.
+
+        Le nom a pu être pris par un autre client pendant le hachage: un
+        message d'erreur est alors retourné.
+        """
+        if self._is_taken_username(username):
+            content = gloutils.ErrorPayload(
+                error_message="La création a échoué:\n - Ce nom d'utilisateur est déjà utilisé."
+            )
+            message = gloutils.GloMessage(header=gloutils.Headers.ERROR, payload=content)
+            self._try_send_message(client_soc, message)
+            return message
+
+        logger.info("Le serveur ajoute les donnees du client dans le serveur.")
+
+        # Le serveur cree la boite de l'utilisateur
+        self._store.create_mailbox(username)
+
+        # Le serveur conserve le mot de passe hache du compte
+        self._save_password(username, password_hash)
 
+        # Le serveur inscrit le nouveau compte au registre, avec une boite vide
+        self._mailbox_stats[username.lower()] = gloutils.StatsPayload(count=0, size=0)
+        self._save_stats(username)
+
+        # Le serveur associe le socket du client à ce nom d’utilisateur
+        self._start_session(client_soc, username)
+
+        # Le serveur previent le client du succes avec l'entete OK et son jeton de reprise,
+        # une fois le compte rendu durable avec le lot en cours
+        header = gloutils.Headers.OK
+        content = gloutils.ResumptionPayload(
+            token=self._issue_token(client_soc, username)
+        )
+        message = gloutils.GloMessage(header=header, payload=content)
+        self._await_commit(client_soc)
+        self._try_send_message(client_soc, message)
         return message
 
+    def _save_password(self, username: str, password_hash: str) -> None:
+        """Conserve le mot de passe haché de l'utilisateur et l'inscrit au registre."""
+        self._store.save_account(username, password_hash)
+        self._accounts[username.lower()] = (username, password_hash)
+
     def _login(
         self, client_soc: socket.socket, payload: gloutils.AuthPayload
-    ) -> gloutils.GloMessage:
+    ) -> gloutils.GloMessage | None:
         """
         Vérifie que les données fournies correspondent à un compte existant.
 
-        Si les identifiants sont valides, associe le socket à l'utilisateur et
-        retourne un succès, sinon retourne un message d'erreur.
+        Si le compte existe, confie la vérification du mot de passe au
+        bassin et retourne None: `_finish_login` complète la connexion.
+        Sinon, retourne un message d'erreur.
         """
 
         username = payload["username"]
@@ -261,176 +766,549 @@ class Server:
         # VALIDER LES INFORMATIONS DU CLIENT
         logger.info("Le serveur valide les informations du client.")
 
-        is_username_exists = False
-        is_valid_password = False
-
         # Le serveur s’assure que le nom d’utilisateur existe.
-        for repo in self._server_data_dir_path.iterdir():
-            if repo.name == self._server_lost_dir_path:
-                continue
-            elif username.lower() == repo.name.lower():
-                is_username_exists = True
-                break
-
-        # Le serveur hache le mot de passe et s’assure qu’il correspond à celui stocké dans le
-        # dossier de l’utilisateur.
-        if is_username_exists:
-            password_file_path = (
-                self._server_data_dir_path
-                / username
-                / f"{gloutils.PASSWORD_FILENAME}.json"
+        account = self._find_account(username)
+
+        # Le serveur hache le mot de passe, hors de la boucle, et s’assure qu’il
+        # correspond à celui conserve dans le registre des comptes.
+        if account is not None:
+            username, stored_hash = account
+            self._start_password_job(
+                client_soc,
+                verify_password,
+                (password, stored_hash),
+                functools.partial(self._finish_login, client_soc, username),
             )
+            return None
+
+        return self._send_login_error(client_soc, is_username_exists=False)
 
-            with open(password_file_path, "r", encoding="utf-8") as file:
-                stored_hash = json.load(file)["password"]
-            provided_hash = hashlib.sha3_512(password.encode("utf-8")).hexdigest()
+    def _finish_login(
+        self,
+        client_soc: socket.socket,
+        username: str,
+        verification: tuple[bool, str | None],
+    ) -> gloutils.GloMessage:
+        """
+        Complète la connexion une fois le mot de passe vérifié. Si les
+        identifiants sont valides, associe le socket à l'utilisateur et
+        retourne un succès, sinon retourne un message d'erreur.
 
-            is_valid_password = hmac.compare_digest(provided_hash, stored_hash)
+        Le haché d'un compte antérieur à scrypt est remplacé au passage.
+        """
+        is_valid_password, upgraded_hash = verification
+        if not is_valid_password:
+            return self._send_login_error(client_soc, is_username_exists=True)
+
+        if upgraded_hash is not None and self._find_account(username) is not None:
+            self._save_password(username, upgraded_hash)
+            self._await_commit(client_soc)
+
+        # Le serveur associe le socket du client à ce nom d’utilisateur
+        self._start_session(client_soc, username)
 
         # Le serveur previent le client du succes avec l'entete OK
-        if is_valid_password:
-            header = gloutils.Headers.OK
-            message = gloutils.GloMessage(header=header)
-            data = json.dumps(message)
-            self._try_send_message(client_soc, data)
+        header = gloutils.Headers.OK
+        content = gloutils.ResumptionPayload(
+            token=self._issue_token(client_soc, username)
+        )
+        message = gloutils.GloMessage(header=header, payload=content)
+        self._try_send_message(client_soc, message)
+        return message
 
-            # Le serveur associe le socket du client à ce nom d’utilisateur
-            self._logged_users[client_soc] = username
+    def _send_login_error(
+        self, client_soc: socket.socket, is_username_exists: bool
+    ) -> gloutils.GloMessage:
+        """
+        Répond à une connexion refusée avec l’entete ERROR et un message
+        l’accompagnant.
+        """
+        header = gloutils.Headers.ERROR
 
-        # Si les identifiants sont invalides, le serveur répond avec l’entete ERROR et un message
-        # l’accompagnant.
-        else:
-            header = gloutils.Headers.ERROR
+        username_exists_msg = (
+            " - Ce nom d'utilisateur n'existe pas."
+            if not is_username_exists
+            else ""
+        )
+        password_security_msg = " - Le mot de passe est incorrecte."
+        messages = [username_exists_msg, password_security_msg]
+        error_message = "La création a échoué:\n" + "\n".join(
+            [msg for msg in messages if msg]
+        )
 
-            username_exists_msg = (
-                " - Ce nom d'utilisateur n'existe pas."
-                if not is_username_exists
-                else ""
-            )
-            password_security_msg = (
-                " - Le mot de passe est incorrecte." if not is_valid_password else ""
+        content = gloutils.ErrorPayload(error_message=error_message)
+        message = gloutils.GloMessage(header=header, payload=content)
+        self._try_send_message(client_soc, message)
+        return message
+
+    def _start_password_job(
+        self,
+        client_soc: socket.socket,
+        function: Callable[..., object],
+        args: tuple,
+        on_done: Callable[[object], None],
+    ) -> None:
+        """
+        Confie au bassin le hachage `function(*args)` pour le client;
+        `on_done` sera appelée avec son résultat par la boucle principale.
+        Les requêtes suivantes du client sont lues mais attendent la fin du
+        hachage pour être traitées.
+
+        Si trop de hachages sont déjà en cours, la requête est refusée avec
+        l'entête ERROR plutôt que d'allonger l'attente de tous.
+        """
+        if len(self._password_jobs) >= self._password_max_pending:
+            content = gloutils.ErrorPayload(
+                error_message="Le serveur est occupé, veuillez réessayer plus tard."
             )
-            messages = [username_exists_msg, password_security_msg]
-            error_message = "La création a échoué:\n" + "\n".join(
-                [msg for msg in messages if msg]
+            message = gloutils.GloMessage(header=gloutils.Headers.ERROR, payload=content)
+            self._try_send_message(client_soc, message)
+            return
+
+        future = self._password_pool.submit(function, *args)
+        self._password_jobs[client_soc] = (future, on_done)
+        future.add_done_callback(functools.partial(self._password_job_done, client_soc))
+
+    def _password_job_done(self, client_soc: socket.socket, _future: Future) -> None:
+        """
+        Appelée par un fil du bassin à la fin d'un hachage: le signale à la
+        boucle principale et la réveille.
+        """
+        self._password_done.append(client_soc)
+        try:
+            self._wake_send.send(b"\0")
+        except BlockingIOError:
+            # La paire est pleine: la boucle a deja de quoi se reveiller
+            pass
+
+    def _finish_password_job(self, client_soc: socket.socket) -> None:
+        """
+        Complète la requête du client dont le hachage est terminé. Un
+        hachage annulé ou en erreur est répondu avec l'entête ERROR.
+        """
+        future, on_done = self._password_jobs.pop(client_soc)
+        try:
+            result = future.result()
+        except Exception:
+            logger.exception("Le hachage d'un mot de passe a echoue.")
+            content = gloutils.ErrorPayload(
+                error_message="L'authentification a échoué, veuillez réessayer."
             )
+            message = gloutils.GloMessage(header=gloutils.Headers.ERROR, payload=content)
+            self._try_send_message(client_soc, message)
+            return
+        on_done(result)
 
-            content = gloutils.ErrorPayload(error_message=error_message)
+    def _complete_password_jobs(self) -> None:
+        """
+        Complète les requêtes dont le hachage est terminé, puis reprend la
+        lecture et le traitement des requêtes suivantes de ces clients.
+        """
+        try:
+            while self._wake_recv.recv(_RECV_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self._password_done:
+            client_soc = self._password_done.popleft()
+            # Le client a pu se deconnecter pendant le hachage
+            if client_soc not in self._recv_buffers:
+                self._password_jobs.pop(client_soc, None)
+                continue
+
+            self._finish_password_job(client_soc)
+            if self._pending.get(client_soc):
+                self._process_pending(client_soc)
+
+    def _negotiate(
+        self, client_soc: socket.socket, payload: gloutils.HelloPayload
+    ) -> gloutils.GloMessage:
+        """
+        Retient le codec préféré du client parmi ceux qu'il propose, la
+        compression des messages s'il l'accepte et les notifications de
+        nouveaux courriels s'il les demande.
+
+        La réponse est encodée avec le codec courant, sans compression; les
+        messages suivants, dans les deux sens, le sont avec les options
+        retenues. Une nouvelle négociation remplace toutes les options de
+        la précédente.
+        """
+        codec = glocodec.choose_codec(payload.get("codecs", []))
+        compression = [
+            name for name in payload.get("compression", [])
+            if name == glosocket.COMPRESSION
+        ]
+        features = [
+            name for name in payload.get("features", [])
+            if name == gloutils.NEW_MAIL_FEATURE
+        ]
+
+        header = gloutils.Headers.OK
+        content = gloutils.HelloPayload(
+            codecs=[codec.name], compression=compression, features=features
+        )
+        message = gloutils.GloMessage(header=header, payload=content)
+        self._try_send_message(client_soc, message)
+
+        # Une nouvelle negociation remplace la precedente: une option non retenue est retiree
+        self._codecs[client_soc] = codec
+        if compression:
+            self._compressing.add(client_soc)
+        else:
+            self._compressing.discard(client_soc)
+        if features:
+            self._notified.add(client_soc)
+        else:
+            self._notified.discard(client_soc)
+        logger.info(
+            f"Un client a negocie le codec {codec.name}, compression {compression}, "
+            f"fonctionnalites {features}."
+        )
+
+        return message
+
+    def _start_session(self, client_soc: socket.socket, username: str) -> None:
+        """
+        Associe le socket à l'utilisateur dans la table des sessions, en
+        remplaçant la session qu'il avait, le cas échéant.
+        """
+        self._end_session(client_soc)
+        self._logged_users[client_soc] = username
+        self._user_sessions.setdefault(username.lower(), set()).add(client_soc)
+
+    def _end_session(self, client_soc: socket.socket) -> None:
+        """Retire le socket de la table des sessions, s'il y figure."""
+        username = self._logged_users.pop(client_soc, None)
+        if username is None:
+            return
+
+        sessions = self._user_sessions[username.lower()]
+        sessions.discard(client_soc)
+        if not sessions:
+            del self._user_sessions[username.lower()]
+
+    def _issue_token(self, client_soc: socket.socket, username: str) -> str:
+        """
+        Émet un nouveau jeton de reprise pour la session du client, en
+        révoquant celui qu'elle détenait.
+
+        Avant l'insertion, les jetons expirés et, au-delà de la limite, les
+        plus anciens sont retirés de la tête de la table.
+        """
+        self._revoke_token(client_soc)
+
+        now = time.monotonic()
+        tokens = self._resumption_tokens
+        while tokens:
+            _, expiry = next(iter(tokens.values()))
+            if expiry > now and len(tokens) < self._resumption_token_limit:
+                break
+            tokens.popitem(last=False)
+
+        token = secrets.token_urlsafe(32)
+        tokens[token] = (username, now + self._resumption_token_ttl)
+        self._session_tokens[client_soc] = token
+        return token
+
+    def _revoke_token(self, client_soc: socket.socket) -> None:
+        """Révoque le jeton de reprise de la session du client, s'il en a un."""
+        token = self._session_tokens.pop(client_soc, None)
+        if token is not None:
+            self._resumption_tokens.pop(token, None)
+
+    def _resume(
+        self, client_soc: socket.socket, payload: gloutils.ResumptionPayload
+    ) -> gloutils.GloMessage:
+        """
+        Restaure la session désignée par le jeton de reprise, sans
+        vérification du mot de passe.
+
+        Le jeton n'est utilisable qu'une fois: la réponse OK en porte un
+        nouveau. Un jeton inconnu, révoqué ou expiré est refusé avec
+        l'entête ERROR.
+        """
+        entry = self._resumption_tokens.pop(payload.get("token", ""), None)
+
+        if entry is not None and entry[1] > time.monotonic():
+            username = entry[0]
+            self._start_session(client_soc, username)
+
+            header = gloutils.Headers.OK
+            content = gloutils.ResumptionPayload(
+                token=self._issue_token(client_soc, username)
+            )
+            message = gloutils.GloMessage(header=header, payload=content)
+            logger.info(f"Le serveur a repris la session de {username}.")
+        else:
+            header = gloutils.Headers.ERROR
+            content = gloutils.ErrorPayload(
+                error_message="La session a expiré, veuillez vous reconnecter."
+            )
             message = gloutils.GloMessage(header=header, payload=content)
-            data = json.dumps(message)
-            self._try_send_message(client_soc, data)
 
+        self._try_send_message(client_soc, message)
         return message
 
     def _logout(self, client_soc: socket.socket) -> None:
-        """Déconnecte un utilisateur."""
+        """Déconnecte un utilisateur et révoque son jeton de reprise."""
 
-        # Le serveur retire le socket du dictionnaire des utilisateurs connectés
-        del self._logged_users[client_soc]
+        # Le serveur retire le socket de la table des sessions
+        self._end_session(client_soc)
+        self._revoke_token(client_soc)
 
-    def _get_email_list(self, client_soc: socket.socket) -> gloutils.GloMessage:
+    @staticmethod
+    def _email_timestamp(payload: gloutils.EmailContentPayload) -> float:
+        """
+        Retourne l'horodatage de la date du courriel, ou 0 si elle n'est pas
+        au format de `gloutils.get_current_utc_time`.
+        """
+        try:
+            return datetime.strptime(payload["date"], _EMAIL_DATE_FORMAT).timestamp()
+        except (ValueError, TypeError):
+            return 0.0
+
+    @staticmethod
+    def _make_inbox_entry(
+        email_id: str, payload: gloutils.EmailContentPayload
+    ) -> InboxEntry:
+        """Construit l'entrée d'index d'un courriel à partir de son contenu."""
+        return (
+            Server._email_timestamp(payload),
+            email_id,
+            payload["sender"],
+            payload["subject"],
+            payload["date"],
+        )
+
+    def _get_inbox(self, username: str) -> list[InboxEntry]:
+        """
+        Retourne l'index de la boîte de réception de l'utilisateur.
+
+        L'index est construit au premier accès en lisant la boîte de
+        l'utilisateur, puis maintenu à jour par `_deliver_email`.
+        """
+        inbox = self._inboxes.get(username.lower())
+        if inbox is not None:
+            return inbox
+
+        inbox = self._build_inbox(username)
+        self._inboxes[username.lower()] = inbox
+        return inbox
+
+    def _build_inbox(self, username: str) -> list[InboxEntry]:
+        """Construit l'index trié de la boîte en lisant ses courriels, sans le retenir."""
+        logger.info(f"Le serveur construit l'index de la boite de {username}.")
+
+        inbox = [
+            self._make_inbox_entry(email_id, json.loads(data))
+            for email_id, data in self._store.iter_emails(username)
+        ]
+        inbox.sort()
+        return inbox
+
+    def _index_email(
+        self, username: str, email_id: str, payload: gloutils.EmailContentPayload
+    ) -> None:
+        """
+        Ajoute un courriel livré à l'index de son destinataire, s'il est
+        chargé, par une recherche dichotomique.
+
+        Les identifiants sont traités comme opaques: ceux des courriels
+        conservés par le serveur d'origine, tirés de l'expéditeur et de la
+        date, ne sont pas l'empreinte de leur contenu. L'index ne tient donc
+        deux courriels pour identiques que si leurs entrées complètes le
+        sont, pas sur la seule égalité de leurs identifiants.
+        """
+        inbox = self._inboxes.get(username.lower())
+        if inbox is None:
+            return
+
+        # Seule une entree identique, identifiant, date, expediteur et sujet compris, est
+        # deja a sa place dans l'index.
+        entry = self._make_inbox_entry(email_id, payload)
+        index = bisect.bisect_left(inbox, entry)
+        if index < len(inbox) and inbox[index] == entry:
+            return
+        inbox.insert(index, entry)
+
+    def _get_mailbox_version(self, username: str) -> int:
+        """Retourne la version courante de la boîte de l'utilisateur."""
+        return self._mailbox_versions.get(username.lower(), self._initial_version)
+
+    def _bump_mailbox_version(self, username: str) -> None:
+        """Marque la boîte de l'utilisateur comme modifiée."""
+        self._mailbox_versions[username.lower()] = self._get_mailbox_version(username) + 1
+
+    def _notify_new_mail(
+        self, username: str, email_id: str, payload: gloutils.EmailContentPayload
+    ) -> None:
+        """
+        Avertit d'un courriel livré, avec l'entête NEW_MAIL, les sessions de
+        son destinataire qui l'ont demandé lors de la négociation.
+        """
+        sessions = self._user_sessions.get(username.lower())
+        if not sessions or not self._notified:
+            return
+
+        header = gloutils.Headers.NEW_MAIL
+        content = gloutils.NewMailPayload(
+            email_id=email_id,
+            sender=payload["sender"],
+            subject=payload["subject"],
+            date=payload["date"],
+        )
+        message = gloutils.GloMessage(header=header, payload=content)
+
+        # L'envoi peut deconnecter une session qui ne lit plus: l'ensemble est copie.
+        # L'avis part avec le lot, une fois le courriel durable.
+        for client_soc in list(sessions):
+            if client_soc in self._notified:
+                self._await_commit(client_soc)
+                self._try_send_message(client_soc, message)
+
+    def _get_email_list(
+        self,
+        client_soc: socket.socket,
+        payload: gloutils.EmailListRequestPayload | None = None,
+    ) -> gloutils.GloMessage:
         """
         Récupère la liste des courriels de l'utilisateur associé au socket.
         Les éléments de la liste sont construits à l'aide du gabarit
         SUBJECT_DISPLAY et sont ordonnés du plus récent au plus ancien.
 
+        Le payload optionnel restreint la liste à la page de `limit`
+        courriels débutant au rang `offset`. Le nombre total de courriels
+        et la version de la boîte accompagnent toujours la liste.
+
+        Si le payload donne dans `since_version` la version courante de la
+        boîte, la liste n'a pas changé: seule l'entête NOT_MODIFIED est
+        transmise.
+
         Une absence de courriel n'est pas une erreur, mais une liste vide.
         """
         # Le serveur récupère la liste des courriels depuis le dossier de l’utilisateur.
         logger.info("Le serveur recupere la liste de courriels...")
 
+        payload = payload or gloutils.EmailListRequestPayload()
+        offset = payload.get("offset", 0)
+        limit = payload.get("limit")
+
+        # bool est un sous-type d'int: True et False ne sont pas des rangs valides
+        if (
+            not isinstance(offset, int)
+            or isinstance(offset, bool)
+            or offset < 0
+            or (limit is not None and (
+                not isinstance(limit, int) or isinstance(limit, bool) or limit < 0
+            ))
+        ):
+            header = gloutils.Headers.ERROR
+            content = gloutils.ErrorPayload(
+                error_message="La page de courriels demandée est invalide."
+            )
+            message = gloutils.GloMessage(header=header, payload=content)
+            self._try_send_message(client_soc, message)
+            return message
+
         client_username = self._logged_users[client_soc]
-        dir_path = (
-            self._server_data_dir_path / client_username / self._email_subfolder_name
-        )
+        version = self._get_mailbox_version(client_username)
 
-        email_list = []
-        for email in dir_path.iterdir():
-            with open(email, "r", encoding="utf-8") as file:
-                email_content_payload = json.load(file)
-                email_list.append(
-                    (
-                        email_content_payload["sender"],
-                        email_content_payload["subject"],
-                        email_content_payload["date"],
-                    )
-                )
+        # Le client a deja cette liste: ni l'index ni la liste ne sont reconstruits
+        if payload.get("since_version") == version:
+            message = gloutils.GloMessage(header=gloutils.Headers.NOT_MODIFIED)
+            self._try_send_message(client_soc, message)
+            return message
+
+        inbox = self._get_inbox(client_username)
+
+        # L'index est trie du plus ancien au plus recent: la page se lit a rebours
+        # depuis la fin de l'index.
+        stop = max(len(inbox) - offset, 0)
+        start = 0 if limit is None else max(stop - limit, 0)
 
         # Si l’utilisateur n’a pas de courriel, le serveur transmet une liste vide.
         list_to_send: list[str] = []
+        ids_to_send: list[str] = []
 
-        if email_list:
-            for index, email in enumerate(
-                sorted(
-                    email_list,
-                    key=lambda time: datetime.strptime(
-                        time[-1], "%a, %d %b %Y %H:%M:%S %z"
-                    ),
-                    reverse=True,
-                ),
-                start=1,
-            ):
-                sender, subject, date = email
-                string_to_display = gloutils.SUBJECT_DISPLAY.format(
-                    number=index, sender=sender, subject=subject, date=date
-                )
-                list_to_send.append(string_to_display)
+        for index, (_, email_id, sender, subject, date) in enumerate(
+            reversed(inbox[start:stop]), start=offset + 1
+        ):
+            string_to_display = gloutils.SUBJECT_DISPLAY.format(
+                number=index, sender=sender, subject=subject, date=date
+            )
+            list_to_send.append(string_to_display)
+            ids_to_send.append(email_id)
 
         # Le serveur transmet la liste au client avec l’entete OK.
         header = gloutils.Headers.OK
-        content = gloutils.EmailListPayload(email_list=list_to_send)
+        content = gloutils.EmailListPayload(
+            email_list=list_to_send,
+            email_ids=ids_to_send,
+            total=len(inbox),
+            version=version,
+        )
         message = gloutils.GloMessage(header=header, payload=content)
-        data = json.dumps(message)
-        self._try_send_message(client_soc, data)
+        self._try_send_message(client_soc, message)
 
         return message
 
+    def _read_email_file(
+        self, username: str, email_id: str
+    ) -> gloutils.EmailContentPayload | None:
+        """
+        Lit directement le courriel `email_id` dans la boîte de
+        l'utilisateur. Retourne None s'il n'existe pas.
+        """
+        if not _EMAIL_ID_PATTERN.fullmatch(email_id):
+            return None
+
+        data = self._store.read(username, email_id)
+        if data is None:
+            return None
+        return gloutils.EmailContentPayload(**json.loads(data))
+
     def _get_email(
-        self, client_soc: socket.socket, payload: gloutils.EmailChoicePayload
+        self,
+        client_soc: socket.socket,
+        payload: gloutils.EmailChoicePayload | gloutils.EmailIdChoicePayload,
     ) -> gloutils.GloMessage:
         """
         Récupère le contenu de l'email dans le dossier de l'utilisateur associé
         au socket.
-        """
 
-        choice = payload["choice"]
+        Le courriel est désigné par son identifiant stable (`email_id`) ou
+        par son rang dans la liste (`choice`).
+        """
 
         # Le serveur récupère le username associé au choix de l’utilisateur.
         client_username = self._logged_users[client_soc]
-        dir_path = (
-            self._server_data_dir_path / client_username / self._email_subfolder_name
-        )
 
-        # get email list
-        emails = []
-        for email in dir_path.iterdir():
-            with open(email, "r", encoding="utf-8") as file:
-                email_content_payload = json.load(file)
-                emails.append((email_content_payload, email_content_payload["date"]))
-
-        # loop through sorted(emails) to get email at index `choice`
-        # (pas du clean code mais fonctionnel pour la remise...)
-        for index, email_payload in enumerate(
-            sorted(
-                emails,
-                key=lambda time: datetime.strptime(
-                    time[-1], "%a, %d %b %Y %H:%M:%S %z"
-                ),
-                reverse=True,
-            ),
-            start=1,
-        ):
-            if index == choice:
-                email_infos = gloutils.EmailContentPayload(**email_payload[0])
-                break
+        if "email_id" in payload:
+            # Le courriel est lu directement, sans consulter l'index
+            email_id = str(payload["email_id"])
+            error_message = "Ce courriel n'existe pas."
+        else:
+            # Le choix #1 correspond au courriel le plus recent, soit la fin de l'index.
+            choice = payload["choice"]
+            inbox = self._get_inbox(client_username)
+            email_id = inbox[-choice][1] if 1 <= choice <= len(inbox) else ""
+            error_message = f"Aucun courriel ne correspond au choix #{choice}."
+
+        email_infos = self._read_email_file(client_username, email_id)
+        if email_infos is None:
+            header = gloutils.Headers.ERROR
+            content = gloutils.ErrorPayload(error_message=error_message)
+            message = gloutils.GloMessage(header=header, payload=content)
+            self._try_send_message(client_soc, message)
+            return message
 
-        logger.info(f"Le serveur recupere le courriel associe au choix #{choice}.")
+        logger.info(f"Le serveur recupere le courriel {email_id}.")
 
         # Le serveur le transmet au client avec l’entete OK.
         header = gloutils.Headers.OK
         message = gloutils.GloMessage(header=header, payload=email_infos)
-        data = json.dumps(message)
-        self._try_send_message(client_soc, data)
+        self._try_send_message(client_soc, message)
 
         return message
 
@@ -440,17 +1318,10 @@ class Server:
         de l'utilisateur associé au socket.
         """
 
-        user_dir_path = (
-            self._server_data_dir_path
-            / self._logged_users[client_soc]
-            / self._email_subfolder_name
-        )
-
-        # Le serveur compte le nombre de courriels et poids total du dossier
-        count = sum(1 for file in user_dir_path.iterdir() if file.is_file())
-        size = sum(
-            file.stat().st_size for file in user_dir_path.iterdir() if file.is_file()
-        )  # [waiting for...] asked if we include password file
+        # Le serveur consulte les compteurs tenus a jour a chaque livraison
+        stats = self._mailbox_stats[self._logged_users[client_soc].lower()]
+        count = stats["count"]
+        size = stats["size"]
 
         logger.info(
             f"Le serveur a compte {count} courriels et {size} comme poids total du dossier"
@@ -460,125 +1331,282 @@ class Server:
         header = gloutils.Headers.OK
         payload = gloutils.StatsPayload(count=count, size=size)
         message = gloutils.GloMessage(header=header, payload=payload)
-        data = json.dumps(message)
-        self._try_send_message(client_soc, data)
+        self._try_send_message(client_soc, message)
 
         return message
 
-    def _send_email(self, payload: gloutils.EmailContentPayload) -> gloutils.GloMessage:
+    def _send_email(
+        self, client_soc: socket.socket, payload: gloutils.EmailContentPayload
+    ) -> gloutils.GloMessage:
         """
-        Détermine si l'envoi est interne ou externe et:
-        - Si l'envoi est interne, écris le message tel quel dans le dossier
-        du destinataire.
-        - Si le destinataire n'existe pas, place le message dans le dossier
-        SERVER_LOST_DIR et considère l'envoi comme un échec.
-        - Si le destinataire est externe, considère l'envoi comme un échec.
+        Livre le courriel du payload avec `_deliver_email` et transmet le
+        résultat au client qui l'a envoyé, une fois le lot durable.
 
         Retourne un messange indiquant le succès ou l'échec de l'opération.
         """
+        message = self._deliver_email(payload)
+        self._await_commit(client_soc)
+        self._try_send_message(client_soc, message)
+        return message
 
-        logger.info(
-            "Le serveur verifie que le destinataire existe avant "
-            "avant d'ecrire le contenu du payload dans le dossier de ce destinataire"
-        )
+    def _send_email_batch(
+        self, client_soc: socket.socket, payload: gloutils.EmailBatchPayload
+    ) -> gloutils.GloMessage:
+        """
+        Livre chaque courriel du lot avec `_deliver_email` et retourne au
+        client, en une seule réponse, le résultat de chacun dans l'ordre,
+        une fois le lot de livraisons durable.
 
-        # Variables
-        sender_address = payload["sender"]
-        dest_address = payload["destination"]
-        date = payload["date"]
+        Les courriels d'un lot ont des identifiants distincts dès que leur
+        contenu diffère; un courriel répété à l'identique n'est livré
+        qu'une fois.
+        """
+        logger.info(f"Le serveur livre un lot de {len(payload['emails'])} courriels.")
 
-        # re patterns
-        valid_address_pattern = re.compile(
-            r"^([a-zA-Z0-9_\.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-\.]+$)"
-        )
-        internal_address_pattern = re.compile(
-            rf"^[a-zA-Z0-9_\.+-]+@{re.escape(gloutils.SERVER_DOMAIN)}$"
-        )
+        results = [
+            self._deliver_email(email) for email in payload["emails"]
+        ]
+
+        header = gloutils.Headers.OK
+        content = gloutils.EmailBatchResultPayload(results=results)
+        message = gloutils.GloMessage(header=header, payload=content)
+        self._await_commit(client_soc)
+        self._try_send_message(client_soc, message)
+        return message
+
+    def _await_commit(self, client_soc: socket.socket) -> None:
+        """
+        Retient les réponses du client jusqu'à ce que le lot de livraisons
+        en cours soit durable.
+        """
+        self._awaiting_commit.add(client_soc)
+
+    def _commit_deliveries(self) -> None:
+        """
+        Rend durable le lot de livraisons en cours, avec les comptes et les
+        statistiques qu'il modifie, d'une seule synchronisation du
+        stockage, puis transmet les réponses retenues.
+        """
+        for username in self._touched_users:
+            self._save_stats(username)
+        self._touched_users.clear()
+        self._store.commit()
+        self._release_batch()
+
+    def _release_batch(self) -> None:
+        """Clôt le lot durable et transmet les réponses qu'il retenait."""
+        released, self._awaiting_commit = self._awaiting_commit, set()
+        for client_soc in released:
+            self._release_replies(client_soc)
+
+    def _release_replies(self, client_soc: socket.socket) -> None:
+        """
+        Transmet les réponses du client retenues jusqu'à la fin du lot, puis
+        reprend ses requêtes en file.
+        """
+        # Le client a pu etre retire pendant le lot
+        if client_soc not in self._send_buffers:
+            return
+
+        self._flush_client(client_soc)
+        if self._pending.get(client_soc):
+            self._process_pending(client_soc)
+
+    def _deliver_email(self, payload: gloutils.EmailContentPayload) -> gloutils.GloMessage:
+        """
+        Valide en une passe l'adresse de destination, ou chacune de la liste
+        des destinataires, puis:
+        - Si une adresse est invalide ou externe, refuse l'envoi au complet.
+        - Si un destinataire n'existe pas, refuse l'envoi au complet: le
+        message n'est livré à aucun destinataire, seulement placé dans le
+        dossier SERVER_LOST_DIR.
+        - Sinon, livre le courriel une seule fois pour tous les destinataires:
+        le stockage en garde une référence dans chaque dossier.
+
+        Un courriel identique à un courriel déjà présent dans une boîte n'y
+        est ni recopié, ni annoncé.
 
-        # Get client_socket by matching sender with logged_users
-        sender_username = re.sub(
-            f"@{re.escape(gloutils.SERVER_DOMAIN)}", "", sender_address
+        Retourne un messange indiquant le succès ou l'échec de l'opération.
+        """
+
+        logger.info(
+            "Le serveur verifie que les destinataires existent avant "
+            "avant d'ecrire le contenu du payload dans les dossiers de ces destinataires"
         )
-        for client_socket, logged_username in self._logged_users.items():
-            if sender_username == logged_username:
-                client_soc = client_socket
+
+        # Variables
+        destination = payload["destination"]
+        dest_addresses = [destination] if isinstance(destination, str) else list(destination)
 
         error_message = ""
 
-        # Verifier si dest_address est une adresse courriel valide
-        if re.fullmatch(valid_address_pattern, dest_address):
+        # Verifier que chaque adresse est une adresse courriel valide
+        invalid_addresses = [
+            str(address) for address in dest_addresses
+            if not isinstance(address, str) or not _VALID_ADDRESS_PATTERN.fullmatch(address)
+        ]
+        if not dest_addresses or invalid_addresses:
+            if len(dest_addresses) <= 1:
+                error_message = "Le courriel de destination est invalide."
+            else:
+                error_message = (
+                    "Ces courriels de destination sont invalides: "
+                    f"{', '.join(invalid_addresses)}."
+                )
 
-            # Verifier si c'est une adresse interne
-            if re.fullmatch(internal_address_pattern, dest_address):
+        # Verifier que ce sont toutes des adresses internes
+        elif not all(
+            _INTERNAL_ADDRESS_PATTERN.fullmatch(address) for address in dest_addresses
+        ):
+            error_message = f"Ce système ne fait l'envoi que de courriels destinés à ce domaine {gloutils.SERVER_DOMAIN}."
 
-                # Prep email_id using (sender and sent datetime)
-                email_id = hashlib.sha256(
-                    f"{sender_username}_{date}".encode("utf-8")
-                ).hexdigest()
-                filename = f"{email_id}.json"
+        else:
+            email_id, email_data = encode_email(payload)
 
-                # Le serveur vérifie que le destinataire existe.
-                is_receiver_exists = False
+            # Le serveur vérifie que les destinataires existent. Une adresse repetee
+            # n'est livree qu'une fois.
+            receivers: dict[str, str] = {}
+            unknown_addresses = []
+            for dest_address in dest_addresses:
                 receiver_username = re.sub(
                     f"@{re.escape(gloutils.SERVER_DOMAIN)}", "", dest_address
                 )
-                for repo in self._server_data_dir_path.iterdir():
-                    if repo.name == self._server_lost_dir_path:
-                        continue
-                    elif receiver_username.lower() == repo.name.lower():
-                        is_receiver_exists = True
-                        receiver_username = repo.name
-                        break
-
-                if is_receiver_exists:
-
-                    dest_file = (
-                        self._server_data_dir_path
-                        / receiver_username
-                        / self._email_subfolder_name
-                        / filename
-                    )
-
-                    # Le serveur indique au client le succès de l’opération avec un entete OK.
-                    header = gloutils.Headers.OK
-                    message = gloutils.GloMessage(header=header)
-                    data = json.dumps(message)
-                    self._try_send_message(client_soc, data)
-
+                receiver_account = self._find_account(receiver_username)
+                if receiver_account is None:
+                    unknown_addresses.append(dest_address)
                 else:
-
-                    dest_file = (
-                        self._server_data_dir_path
-                        / self._server_lost_dir_path
-                        / filename
-                    )
+                    receivers[receiver_account[0].lower()] = receiver_account[0]
+
+            # Un envoi dont un destinataire n'existe pas est refuse au complet: aucun
+            # destinataire ne le recoit, il est seulement range dans SERVER_LOST_DIR.
+            # Une reponse ERROR signifie ainsi toujours que personne ne l'a recu.
+            if unknown_addresses:
+                receivers.clear()
+                mailboxes = [self._server_lost_dir_path]
+                if len(dest_addresses) == 1:
                     error_message = "La personne à qui vous souhaitez envoyer un courriel n'existe pas."
-
-                # Placer le courriel dans `dest_file`
-                with open(dest_file, "w", encoding="utf-8") as file:
-                    json.dump(payload, file, indent=4)
-
+                else:
+                    error_message = (
+                        "Ces destinataires n'existent pas: "
+                        f"{', '.join(unknown_addresses)}. Le courriel n'a été livré "
+                        "à aucun destinataire."
+                    )
             else:
-                error_message = f"Ce système ne fait l'envoi que de courriels destinés à ce domaine {gloutils.SERVER_DOMAIN}."
+                mailboxes = list(receivers.values())
 
-        else:
-            error_message = "Le courriel de destination est invalide."
+            # Placer le courriel, une seule fois, dans les boites des destinataires. Un
+            # courriel deja present sous le meme identifiant n'est pas recopie.
+            previous_sizes = self._store.deliver(
+                mailboxes, email_id, email_data, self._email_timestamp(payload)
+            )
+
+            # Tenir a jour l'index et les statistiques de la boite de chaque destinataire.
+            # Un courriel identique deja present ne change rien a sa boite: ni avis, ni
+            # nouvelle version.
+            for receiver_username, previous_size in zip(receivers.values(), previous_sizes):
+                if previous_size is not None:
+                    continue
+                self._index_email(receiver_username, email_id, payload)
+                self._bump_mailbox_version(receiver_username)
+                self._notify_new_mail(receiver_username, email_id, payload)
+                self._update_stats(receiver_username, 1, len(email_data))
 
         if error_message:
             header = gloutils.Headers.ERROR
             content = gloutils.ErrorPayload(error_message=error_message)
-            message = gloutils.GloMessage(header=header, payload=content)
-            data = json.dumps(message)
-            self._try_send_message(client_soc, data)
+            return gloutils.GloMessage(header=header, payload=content)
 
-        return message
+        # Le serveur indique au client le succès de l’opération avec un entete OK.
+        return gloutils.GloMessage(header=gloutils.Headers.OK)
 
     def _process_client(self, client_socket: socket.socket) -> None:
+        """
+        Lit les octets disponibles sur le socket client sans bloquer et traite
+        chaque message complet reçu, dans l'ordre.
+
+        Un client peut envoyer plusieurs requêtes sans attendre les réponses:
+        elles sont mises en file et répondues dans l'ordre de réception.
+        """
+        try:
+            nbytes = client_socket.recv_into(self._recv_chunk)
+        except BlockingIOError:
+            return
+        except OSError:
+            nbytes = 0
+
+        # Une lecture vide signifie que le client a ferme la connexion
+        if not nbytes:
+            self._remove_client(client_socket)
+            return
+
+        buffer = self._recv_buffers[client_socket]
+        buffer += self._recv_chunk[:nbytes]
         try:
-            data = glosocket.recv_mesg(client_socket)
-            reply = json.loads(data)
+            frames = glosocket.decode_frames(buffer)
         except glosocket.GLOSocketError:
-            self._client_socs.remove(client_socket)
+            self._remove_client(client_socket)
+            return
+
+        self._pending[client_socket].extend(frames)
+        self._process_pending(client_socket)
+
+    def _process_pending(self, client_socket: socket.socket) -> None:
+        """
+        Traite les requêtes en file du client tant que son tampon d'envoi
+        reste sous le seuil haut, puis transmet leurs réponses d'un bloc.
+
+        Les requêtes restantes sont reprises quand le tampon s'est vidé.
+        """
+        pending = self._pending[client_socket]
+        send_buffer = self._send_buffers[client_socket]
+
+        self._corked.add(client_socket)
+        while pending:
+            # Le client a pu etre retire par un message precedent (BYE, erreur d'envoi)
+            if client_socket not in self._recv_buffers or client_socket in self._closing:
+                break
+            # Les requetes suivant une authentification attendent la fin du hachage
+            if client_socket in self._password_jobs:
+                break
+            # Au seuil haut, les reponses accumulees sont transmises; si le socket
+            # n'en accepte pas assez, la suite attend qu'il redevienne disponible
+            if len(send_buffer) >= self._send_high_water_mark:
+                self._flush_client(client_socket)
+                if (client_socket not in self._send_buffers
+                        or len(send_buffer) >= self._send_high_water_mark):
+                    break
+                continue
+            # Le codec est choisi a chaque message: HELLO peut le changer en cours de route
+            try:
+                reply = self._decode_message(client_socket, pending.popleft())
+            except glocodec.CodecError:
+                self._remove_client(client_socket)
+                break
+            self._process_message(client_socket, reply)
+        self._corked.discard(client_socket)
+
+        # Un client en cours d'authentification recoit les reponses precedentes. Sinon,
+        # l'ecriture est deja surveillee et la file reprise a la vidange
+        if (
+            not pending or client_socket in self._password_jobs
+        ) and self._send_buffers.get(client_socket):
+            self._flush_client(client_socket)
+
+    def _process_message(
+        self, client_socket: socket.socket, reply: gloutils.GloMessage
+    ) -> None:
+        """Traite un message reçu d'un client selon son entête."""
+        # Le serveur refuse les requetes d'un client non authentifie, par exemple
+        # apres l'echec de la reprise de sa session
+        if (
+            reply["header"] in _AUTHENTICATED_HEADERS
+            and client_socket not in self._logged_users
+        ):
+            content = gloutils.ErrorPayload(
+                error_message="Vous devez être connecté pour effectuer cette opération."
+            )
+            message = gloutils.GloMessage(header=gloutils.Headers.ERROR, payload=content)
+            self._try_send_message(client_socket, message)
             return
 
         match reply["header"]:
@@ -590,11 +1618,17 @@ class Server:
                 payload = reply["payload"]
                 self._login(client_socket, payload)
 
+            case gloutils.Headers.AUTH_RESUME:
+                payload = reply["payload"]
+                self._resume(client_socket, payload)
+
             case gloutils.Headers.BYE:
-                self._remove_client(client_socket)
+                self._revoke_token(client_socket)
+                self._close_client(client_socket)
 
             case gloutils.Headers.INBOX_READING_REQUEST:
-                self._get_email_list(client_socket)
+                payload = reply.get("payload")
+                self._get_email_list(client_socket, payload)
 
             case gloutils.Headers.INBOX_READING_CHOICE:
                 payload = reply["payload"]
@@ -605,22 +1639,42 @@ class Server:
 
             case gloutils.Headers.EMAIL_SENDING:
                 payload = reply["payload"]
-                self._send_email(payload)
+                self._send_email(client_socket, payload)
+
+            case gloutils.Headers.EMAIL_BATCH_SENDING:
+                payload = reply["payload"]
+                self._send_email_batch(client_socket, payload)
 
             case gloutils.Headers.AUTH_LOGOUT:
                 self._logout(client_socket)
 
+            case gloutils.Headers.HELLO:
+                payload = reply.get("payload", {})
+                self._negotiate(client_socket, payload)
+
     def run(self):
         """Point d'entrée du serveur."""
         while True:
-            waiters = select.select([self._server_socket] + self._client_socs, [], [])[
-                0
-            ]
-            for waiter in waiters:
-                if waiter == self._server_socket:
+            for key, events in self._selector.select():
+                if key.fileobj is self._server_socket:
                     self._accept_client()
-                else:
-                    self._process_client(waiter)
+                    continue
+                if key.fileobj is self._wake_recv:
+                    self._complete_password_jobs()
+                    continue
+
+                if events & selectors.EVENT_WRITE:
+                    self._flush_client(key.fileobj)
+                    # Reprend les requetes pipelinees suspendues par le seuil haut
+                    if self._pending.get(key.fileobj):
+                        self._process_pending(key.fileobj)
+                if events & selectors.EVENT_READ and key.fileobj in self._recv_buffers:
+                    self._process_client(key.fileobj)
+
+            # Les livraisons de ce tour forment un lot, rendu durable d'un coup. Les
+            # requetes reprises ensuite peuvent en commencer un autre.
+            while self._awaiting_commit:
+                self._commit_deliveries()
 
 
 # NE PAS ÉDITER PASSÉ CE POINT
@@ -0,0 +1,937 @@
+"""\
+Module fournissant une interface programmatique, non interactive, au
+serveur mail @glo2000.ca: une connexion synchrone, son équivalent asyncio
+et des bassins de connexions authentifiées pour chacune.
+
+Les requêtes d'une connexion sont pipelinées: plusieurs peuvent être en
+vol à la fois, le serveur y répondant dans l'ordre de leur envoi. Les
+avis de nouveaux courriels, transmis par le serveur sans requête, sont
+remis à la fonction fournie à l'ouverture de la connexion.
+
+Une connexion perdue est rétablie à la requête suivante, et la session de
+l'utilisateur reprise avec le jeton de reprise reçu à l'authentification.
+Les requêtes en vol au moment de la perte échouent avec GLOSocketError.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import random
+import socket
+import threading
+import time
+
+from typing import Callable
+
+import glocodec
+import glosocket
+import gloutils
+
+
+# Entetes auxquelles le serveur ne repond pas.
+_NO_REPLY = frozenset({gloutils.Headers.AUTH_LOGOUT, gloutils.Headers.BYE})
+
+# Nombre de connexions par defaut d'un bassin.
+DEFAULT_POOL_SIZE = 4
+
+# Delai maximal, en secondes, avant une reconnexion. Le delai est tire au hasard pour
+# que les connexions perdues ensemble ne se reconnectent pas toutes a la fois.
+RECONNECT_DELAY = 1.0
+
+# Delai, en secondes, accorde au serveur pour repondre a HELLO. Un serveur qui ne
+# connait pas cette entete n'y repond pas: la connexion est alors retablie sans negocier.
+NEGOTIATION_TIMEOUT = 2.0
+
+# Fonction appelee avec le payload de chaque avis de nouveau courriel.
+NewMailCallback = Callable[[gloutils.NewMailPayload], None]
+
+logger = logging.getLogger(__name__)
+
+
+class GLOClientError(Exception):
+    """Erreur levée lorsque le serveur répond à une requête par l'entête ERROR."""
+
+
+def _deliver_new_mail(callback: NewMailCallback, payload: gloutils.NewMailPayload) -> None:
+    """
+    Remet l'avis de nouveau courriel à la fonction de l'utilisateur. Une
+    exception qu'elle lève est journalisée: elle n'interrompt pas la
+    lecture des réponses de la connexion.
+    """
+    try:
+        callback(payload)
+    except Exception:
+        logger.exception("La fonction recevant les avis de nouveaux courriels a echoue.")
+
+
+def _negotiated_options(reply: gloutils.GloMessage) -> tuple[glocodec.Codec, bool]:
+    """
+    Retourne le codec et la compression retenus par le serveur dans sa
+    réponse à HELLO. Lève GLOSocketError si la réponse est inutilisable.
+    """
+    if (
+        not isinstance(reply, dict)
+        or reply.get("header") != gloutils.Headers.OK
+        or not isinstance(reply.get("payload"), dict)
+    ):
+        raise glosocket.GLOSocketError("The server refused the negotiation.")
+
+    payload = reply["payload"]
+    codecs = payload.get("codecs")
+    compression = payload.get("compression", [])
+    if (
+        not isinstance(codecs, list)
+        or len(codecs) != 1
+        or codecs[0] not in glocodec.CODECS
+        or not isinstance(compression, list)
+        or any(name != glosocket.COMPRESSION for name in compression)
+    ):
+        raise glosocket.GLOSocketError("The server's negotiation reply is invalid.")
+    return glocodec.CODECS[codecs[0]], bool(compression)
+
+
+def _make_message(
+    header: gloutils.Headers, payload: dict | None = None
+) -> gloutils.GloMessage:
+    message = gloutils.GloMessage(header=header)
+    if payload is not None:
+        message["payload"] = payload
+    return message
+
+
+def _hello_payload(notify: bool) -> gloutils.HelloPayload:
+    """
+    Propose les codecs connus, par ordre de préférence, la compression et,
+    avec `notify`, les avis de nouveaux courriels.
+    """
+    return gloutils.HelloPayload(
+        codecs=list(glocodec.CODECS),
+        compression=[glosocket.COMPRESSION],
+        features=[gloutils.NEW_MAIL_FEATURE] if notify else [],
+    )
+
+
+def _check(reply: gloutils.GloMessage) -> gloutils.GloMessage:
+    """Retourne la réponse, ou lève GLOClientError si c'est une erreur."""
+    if reply["header"] == gloutils.Headers.ERROR:
+        raise GLOClientError(reply["payload"]["error_message"])
+    return reply
+
+
+def make_email(
+    username: str, destination: str | list[str], subject: str, content: str
+) -> gloutils.EmailContentPayload:
+    """Construit le courriel envoyé par `username`, daté de l'heure courante."""
+    return gloutils.EmailContentPayload(
+        sender=f"{username}@{gloutils.SERVER_DOMAIN}",
+        destination=destination,
+        subject=subject,
+        date=gloutils.get_current_utc_time(),
+        content=content,
+    )
+
+
+# Pages de courriels recues, par (offset, limit).
+EmailPages = dict[tuple[int, int | None], gloutils.EmailListPayload]
+
+
+def _list_request(
+    pages: EmailPages, offset: int, limit: int | None
+) -> gloutils.EmailListRequestPayload:
+    """Prépare la demande de la page, conditionnelle si elle est en cache."""
+    payload = gloutils.EmailListRequestPayload(offset=offset)
+    if limit is not None:
+        payload["limit"] = limit
+    cached_page = pages.get((offset, limit))
+    if cached_page is not None:
+        payload["since_version"] = cached_page["version"]
+    return payload
+
+
+def _list_reply(
+    pages: EmailPages,
+    payload: gloutils.EmailListRequestPayload,
+    reply: gloutils.GloMessage,
+) -> gloutils.EmailListPayload:
+    """Retourne la page reçue et la met en cache, ou la page en cache si inchangée."""
+    key = (payload["offset"], payload.get("limit"))
+    if reply["header"] == gloutils.Headers.NOT_MODIFIED:
+        return pages[key]
+    pages[key] = reply["payload"]
+    return reply["payload"]
+
+
+def _split(items: list, parts: int) -> list[list]:
+    """Découpe la liste en au plus `parts` tranches contiguës et non vides."""
+    size = -(-len(items) // max(parts, 1))
+    return [items[start:start + size] for start in range(0, len(items), size or 1)]
+
+
+class Connection:
+    """
+    Connexion synchrone au serveur. Ses méthodes peuvent être appelées de
+    plusieurs fils d'exécution à la fois: un fil dédié lit les réponses et
+    les remet, dans l'ordre, aux requêtes en attente.
+    """
+
+    def __init__(
+        self,
+        destination: str,
+        port: int = gloutils.APP_PORT,
+        negotiate: bool = True,
+        on_new_mail: NewMailCallback | None = None,
+        reconnect: bool = True,
+    ) -> None:
+        """
+        Connecte le socket `_socket` au serveur et démarre le fil de lecture
+        des réponses. Avec `negotiate`, le codec et la compression sont
+        négociés avec l'entête HELLO; sans réponse du serveur dans le délai
+        NEGOTIATION_TIMEOUT, la connexion est rétablie sans négociation.
+
+        Si `on_new_mail` est fourni, les avis de nouveaux courriels sont
+        aussi demandés: le fil de lecture l'appelle avec chacun d'eux.
+
+        Avec `reconnect`, une connexion perdue est rétablie à la requête
+        suivante.
+
+        Lève GLOSocketError si la connexion est impossible.
+        """
+        self.username = ""
+        self._address = (destination, port)
+        self._negotiate = negotiate or on_new_mail is not None
+        self._on_new_mail = on_new_mail
+        self._reconnect = reconnect
+        self._resumption_token = ""
+
+        # Les pages de courriels recues, par (offset, limit), reutilisees tant
+        # que la boite n'a pas change
+        self._email_pages: EmailPages = {}
+
+        # Les requetes en attente de reponse, dans l'ordre de leur envoi
+        self._waiters: collections.deque[concurrent.futures.Future] = collections.deque()
+        self._send_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._closed = True
+        self._open()
+
+    def _open(self) -> None:
+        """
+        Connecte le socket, négocie les options de la connexion et reprend
+        la session s'il y a un jeton de reprise, puis démarre le fil de
+        lecture. Ces échanges le précèdent: aucune requête ne peut
+        s'intercaler avant que la connexion soit prête.
+
+        Lève GLOClientError si le serveur refuse de reprendre la session.
+        """
+        try:
+            self._socket = socket.create_connection(self._address)
+        except OSError as ex:
+            raise glosocket.GLOSocketError("Unable to reach the server.") from ex
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self._codec: glocodec.Codec = glocodec.JSON_CODEC
+        self._compress = False
+        resumed = None
+        try:
+            if self._negotiate:
+                self._socket.settimeout(NEGOTIATION_TIMEOUT)
+                try:
+                    reply = self._exchange(
+                        gloutils.Headers.HELLO, _hello_payload(self._on_new_mail is not None)
+                    )
+                except glosocket.GLOSocketError as ex:
+                    if not isinstance(ex.__cause__, TimeoutError):
+                        raise
+                    # Une reponse tardive ne doit pas etre prise pour celle d'une autre
+                    # requete: la connexion est remplacee par une autre, sans negociation
+                    self._socket.close()
+                    self._negotiate = False
+                    self._open()
+                    return
+                self._socket.settimeout(None)
+                self._codec, self._compress = _negotiated_options(reply)
+            if self._resumption_token:
+                resumed = self._exchange(
+                    gloutils.Headers.AUTH_RESUME,
+                    gloutils.ResumptionPayload(token=self._resumption_token),
+                )
+        except (glosocket.GLOSocketError, glocodec.CodecError):
+            self._socket.close()
+            raise
+
+        self._closed = False
+        self._reader = threading.Thread(
+            target=self._read_replies, args=(self._socket,), daemon=True
+        )
+        self._reader.start()
+
+        if resumed is not None:
+            self._resumed(resumed)
+
+    def _exchange(
+        self, header: gloutils.Headers, payload: dict
+    ) -> gloutils.GloMessage:
+        """Envoie une requête et lit sa réponse sur le socket, sans le fil de lecture."""
+        data = self._codec.encode(_make_message(header, payload))
+        glosocket.send_frame(self._socket, data, self._compress)
+        return self._codec.decode(glosocket.recv_frame(self._socket))
+
+    def _resumed(self, reply: gloutils.GloMessage) -> None:
+        """
+        Retient le nouveau jeton de la session reprise. Si la reprise est
+        refusée, la session est déconnectée et GLOClientError levée.
+        """
+        if reply["header"] == gloutils.Headers.OK:
+            self._resumption_token = reply["payload"]["token"]
+            return
+        self.username = ""
+        self._resumption_token = ""
+        self._email_pages.clear()
+        _check(reply)
+
+    def _reopen(self) -> None:
+        """
+        Rétablit la connexion perdue après un court délai aléatoire. Un seul
+        fil s'en charge; les autres attendent la nouvelle connexion.
+        """
+        with self._connect_lock:
+            if not self._closed:
+                return
+            self._reader.join()
+            self._socket.close()
+            time.sleep(random.uniform(0, RECONNECT_DELAY))
+            self._open()
+
+    def __enter__(self) -> "Connection":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    @property
+    def in_flight(self) -> int:
+        """Nombre de requêtes envoyées qui attendent leur réponse."""
+        return len(self._waiters)
+
+    def _read_replies(self, connection: socket.socket) -> None:
+        error: Exception = glosocket.GLOSocketError("The connection is closed.")
+        try:
+            while True:
+                data = glosocket.recv_frame(connection)
+                message = self._codec.decode(data)
+                if message["header"] == gloutils.Headers.NEW_MAIL:
+                    _deliver_new_mail(self._on_new_mail, message["payload"])
+                else:
+                    self._waiters.popleft().set_result(message)
+        except (glosocket.GLOSocketError, glocodec.CodecError) as ex:
+            error = ex
+        except IndexError:
+            error = glosocket.GLOSocketError("Received an unexpected message.")
+        finally:
+            with self._send_lock:
+                self._closed = True
+                while self._waiters:
+                    self._waiters.popleft().set_exception(error)
+
+    def submit(
+        self, header: gloutils.Headers, payload: dict | None = None
+    ) -> concurrent.futures.Future:
+        """
+        Envoie une requête sans attendre sa réponse et retourne le Future
+        qui la recevra. Les requêtes sans réponse sont résolues à l'envoi.
+        """
+        if self._closed and self._reconnect:
+            self._reopen()
+        data = self._codec.encode(_make_message(header, payload))
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._send_lock:
+            if self._closed:
+                raise glosocket.GLOSocketError("The connection is closed.")
+            if header in _NO_REPLY:
+                future.set_result(None)
+            else:
+                self._waiters.append(future)
+            glosocket.send_frame(self._socket, data, self._compress)
+        return future
+
+    def request(
+        self, header: gloutils.Headers, payload: dict | None = None
+    ) -> gloutils.GloMessage:
+        """Envoie une requête et retourne sa réponse, ou lève GLOClientError."""
+        return _check(self.submit(header, payload).result())
+
+    def register(self, username: str, password: str) -> None:
+        """Crée un compte et connecte la session à ce compte."""
+        reply = self.request(
+            gloutils.Headers.AUTH_REGISTER,
+            gloutils.AuthPayload(username=username, password=password),
+        )
+        self.username = username
+        self._resumption_token = reply.get("payload", {}).get("token", "")
+        self._email_pages.clear()
+
+    def login(self, username: str, password: str) -> None:
+        """Connecte la session au compte."""
+        reply = self.request(
+            gloutils.Headers.AUTH_LOGIN,
+            gloutils.AuthPayload(username=username, password=password),
+        )
+        self.username = username
+        self._resumption_token = reply.get("payload", {}).get("token", "")
+        self._email_pages.clear()
+
+    def logout(self) -> None:
+        """Déconnecte la session de son compte."""
+        self.submit(gloutils.Headers.AUTH_LOGOUT)
+        self.username = ""
+        self._resumption_token = ""
+        self._email_pages.clear()
+
+    def send_email(
+        self, destination: str | list[str], subject: str, content: str
+    ) -> None:
+        """Envoie un courriel au nom de l'utilisateur connecté."""
+        self.request(
+            gloutils.Headers.EMAIL_SENDING,
+            make_email(self.username, destination, subject, content),
+        )
+
+    def send_batch(
+        self, emails: list[gloutils.EmailContentPayload]
+    ) -> list[gloutils.GloMessage]:
+        """Envoie un lot de courriels et retourne le résultat de chacun."""
+        reply = self.request(
+            gloutils.Headers.EMAIL_BATCH_SENDING, gloutils.EmailBatchPayload(emails=emails)
+        )
+        return reply["payload"]["results"]
+
+    def list_emails(
+        self, offset: int = 0, limit: int | None = None
+    ) -> gloutils.EmailListPayload:
+        """
+        Retourne la page de la liste des courriels, la liste entière sans
+        `limit`. Une page déjà reçue n'est retransmise que si la boîte a
+        changé depuis.
+        """
+        payload = _list_request(self._email_pages, offset, limit)
+        reply = self.request(gloutils.Headers.INBOX_READING_REQUEST, payload)
+        return _list_reply(self._email_pages, payload, reply)
+
+    def fetch_email(self, email_id: str) -> gloutils.EmailContentPayload:
+        """Retourne le courriel d'identifiant `email_id`."""
+        return self.request(
+            gloutils.Headers.INBOX_READING_CHOICE,
+            gloutils.EmailIdChoicePayload(email_id=email_id),
+        )["payload"]
+
+    def stats(self) -> gloutils.StatsPayload:
+        """Retourne les statistiques de la boîte de l'utilisateur."""
+        return self.request(gloutils.Headers.STATS_REQUEST)["payload"]
+
+    def close(self) -> None:
+        """Quitte le serveur et ferme la connexion."""
+        self._reconnect = False
+        try:
+            self.submit(gloutils.Headers.BYE)
+        except glosocket.GLOSocketError:
+            pass
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        self._reader.join()
+
+
+class ConnectionPool:
+    """
+    Bassin de connexions synchrones authentifiées au même compte. Chaque
+    requête est confiée à la connexion qui en a le moins en vol.
+    """
+
+    def __init__(
+        self,
+        destination: str,
+        username: str,
+        password: str,
+        size: int = DEFAULT_POOL_SIZE,
+        port: int = gloutils.APP_PORT,
+        on_new_mail: NewMailCallback | None = None,
+    ) -> None:
+        """
+        Ouvre `size` connexions et les authentifie. Seule la première
+        demande les avis de nouveaux courriels, pour `on_new_mail`.
+        """
+        self.username = username
+        self._connections: list[Connection] = []
+        try:
+            for index in range(size):
+                connection = Connection(
+                    destination, port, on_new_mail=None if index else on_new_mail
+                )
+                self._connections.append(connection)
+                connection.login(username, password)
+        except (glosocket.GLOSocketError, GLOClientError):
+            self.close()
+            raise
+
+    def __enter__(self) -> "ConnectionPool":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def _pick(self) -> Connection:
+        return min(self._connections, key=lambda connection: connection.in_flight)
+
+    def submit(
+        self, header: gloutils.Headers, payload: dict | None = None
+    ) -> concurrent.futures.Future:
+        """Envoie une requête sur la connexion la moins chargée sans l'attendre."""
+        return self._pick().submit(header, payload)
+
+    def request(
+        self, header: gloutils.Headers, payload: dict | None = None
+    ) -> gloutils.GloMessage:
+        """Envoie une requête et retourne sa réponse, ou lève GLOClientError."""
+        return self._pick().request(header, payload)
+
+    def send_email(
+        self, destination: str | list[str], subject: str, content: str
+    ) -> None:
+        """Envoie un courriel au nom de l'utilisateur du bassin."""
+        self.request(
+            gloutils.Headers.EMAIL_SENDING,
+            make_email(self.username, destination, subject, content),
+        )
+
+    def send_batch(
+        self, emails: list[gloutils.EmailContentPayload]
+    ) -> list[gloutils.GloMessage]:
+        """
+        Répartit le lot entre les connexions, envoyées en parallèle, et
+        retourne le résultat de chaque courriel dans l'ordre du lot.
+        """
+        futures = [
+            connection.submit(
+                gloutils.Headers.EMAIL_BATCH_SENDING,
+                gloutils.EmailBatchPayload(emails=part),
+            )
+            for connection, part in zip(
+                self._connections, _split(emails, len(self._connections))
+            )
+        ]
+        results = []
+        for future in futures:
+            results += _check(future.result())["payload"]["results"]
+        return results
+
+    def list_emails(
+        self, offset: int = 0, limit: int | None = None
+    ) -> gloutils.EmailListPayload:
+        return self._pick().list_emails(offset, limit)
+
+    def fetch_email(self, email_id: str) -> gloutils.EmailContentPayload:
+        return self._pick().fetch_email(email_id)
+
+    def stats(self) -> gloutils.StatsPayload:
+        return self._pick().stats()
+
+    def close(self) -> None:
+        """Ferme toutes les connexions du bassin."""
+        for connection in self._connections:
+            connection.close()
+        self._connections.clear()
+
+
+class AsyncConnection:
+    """
+    Équivalent asyncio de Connection. Une tâche dédiée lit les réponses et
+    les remet, dans l'ordre, aux requêtes en attente.
+
+    Une connexion s'ouvre avec `await AsyncConnection.open(destination)`.
+    """
+
+    def __init__(
+        self,
+        destination: str,
+        port: int = gloutils.APP_PORT,
+        negotiate: bool = True,
+        on_new_mail: NewMailCallback | None = None,
+        reconnect: bool = True,
+    ) -> None:
+        self.username = ""
+        self._address = (destination, port)
+        self._negotiate = negotiate or on_new_mail is not None
+        self._on_new_mail = on_new_mail
+        self._reconnect = reconnect
+        self._resumption_token = ""
+        self._email_pages: EmailPages = {}
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        self._connect_lock = asyncio.Lock()
+        self._closed = True
+
+    @classmethod
+    async def open(
+        cls,
+        destination: str,
+        port: int = gloutils.APP_PORT,
+        negotiate: bool = True,
+        on_new_mail: NewMailCallback | None = None,
+        reconnect: bool = True,
+    ) -> "AsyncConnection":
+        """
+        Ouvre une connexion au serveur. Avec `negotiate`, le codec et la
+        compression sont négociés avec l'entête HELLO; sans réponse du
+        serveur dans le délai NEGOTIATION_TIMEOUT, la connexion est
+        rétablie sans négociation.
+
+        Si `on_new_mail` est fourni, les avis de nouveaux courriels sont
+        aussi demandés: la tâche de lecture l'appelle avec chacun d'eux.
+
+        Avec `reconnect`, une connexion perdue est rétablie à la requête
+        suivante.
+
+        Lève GLOSocketError si la connexion est impossible.
+        """
+        connection = cls(destination, port, negotiate, on_new_mail, reconnect)
+        await connection._open()
+        return connection
+
+    async def _open(self) -> None:
+        """
+        Équivalent de `Connection._open`: connecte, négocie et reprend la
+        session avant de démarrer la tâche de lecture.
+        """
+        try:
+            self._reader, self._writer = await asyncio.open_connection(*self._address)
+        except OSError as ex:
+            raise glosocket.GLOSocketError("Unable to reach the server.") from ex
+        self._writer.get_extra_info("socket").setsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+        )
+
+        self._codec: glocodec.Codec = glocodec.JSON_CODEC
+        self._compress = False
+        resumed = None
+        try:
+            if self._negotiate:
+                try:
+                    reply = await asyncio.wait_for(
+                        self._exchange(
+                            gloutils.Headers.HELLO,
+                            _hello_payload(self._on_new_mail is not None),
+                        ),
+                        NEGOTIATION_TIMEOUT,
+                    )
+                except TimeoutError:
+                    # Une reponse tardive ne doit pas etre prise pour celle d'une autre
+                    # requete: la connexion est remplacee par une autre, sans negociation
+                    self._writer.close()
+                    self._negotiate = False
+                    await self._open()
+                    return
+                self._codec, self._compress = _negotiated_options(reply)
+            if self._resumption_token:
+                resumed = await self._exchange(
+                    gloutils.Headers.AUTH_RESUME,
+                    gloutils.ResumptionPayload(token=self._resumption_token),
+                )
+        except (glosocket.GLOSocketError, glocodec.CodecError, ConnectionError):
+            self._writer.close()
+            raise
+
+        self._closed = False
+        self._reader_task = asyncio.get_running_loop().create_task(
+            self._read_replies(self._reader)
+        )
+
+        if resumed is not None:
+            self._resumed(resumed)
+
+    async def _exchange(
+        self, header: gloutils.Headers, payload: dict
+    ) -> gloutils.GloMessage:
+        """Envoie une requête et lit sa réponse, sans la tâche de lecture."""
+        data = self._codec.encode(_make_message(header, payload))
+        self._writer.write(glosocket.encode_frame(data, self._compress))
+        await self._writer.drain()
+        return self._codec.decode(await glosocket.recv_frame_async(self._reader))
+
+    def _resumed(self, reply: gloutils.GloMessage) -> None:
+        """
+        Retient le nouveau jeton de la session reprise. Si la reprise est
+        refusée, la session est déconnectée et GLOClientError levée.
+        """
+        if reply["header"] == gloutils.Headers.OK:
+            self._resumption_token = reply["payload"]["token"]
+            return
+        self.username = ""
+        self._resumption_token = ""
+        self._email_pages.clear()
+        _check(reply)
+
+    async def _reopen(self) -> None:
+        """
+        Rétablit la connexion perdue après un court délai aléatoire. Une
+        seule tâche s'en charge; les autres attendent la nouvelle connexion.
+        """
+        async with self._connect_lock:
+            if not self._closed:
+                return
+            await self._reader_task
+            self._writer.close()
+            await asyncio.sleep(random.uniform(0, RECONNECT_DELAY))
+            await self._open()
+
+    async def __aenter__(self) -> "AsyncConnection":
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    @property
+    def in_flight(self) -> int:
+        """Nombre de requêtes envoyées qui attendent leur réponse."""
+        return len(self._waiters)
+
+    async def _read_replies(self, reader: asyncio.StreamReader) -> None:
+        error: Exception = glosocket.GLOSocketError("The connection is closed.")
+        try:
+            while True:
+                data = await glosocket.recv_frame_async(reader)
+                message = self._codec.decode(data)
+                if message["header"] == gloutils.Headers.NEW_MAIL:
+                    _deliver_new_mail(self._on_new_mail, message["payload"])
+                else:
+                    self._waiters.popleft().set_result(message)
+        except (glosocket.GLOSocketError, glocodec.CodecError) as ex:
+            error = ex
+        except IndexError:
+            error = glosocket.GLOSocketError("Received an unexpected message.")
+        finally:
+            self._closed = True
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_exception(error)
+
+    def submit(
+        self, header: gloutils.Headers, payload: dict | None = None
+    ) -> asyncio.Future:
+        """
+        Envoie une requête sans attendre sa réponse et retourne le Future
+        qui la recevra. Les requêtes sans réponse sont résolues à l'envoi.
+        """
+        if self._closed:
+            raise glosocket.GLOSocketError("The connection is closed.")
+        data = self._codec.encode(_make_message(header, payload))
+        future = asyncio.get_running_loop().create_future()
+        if header in _NO_REPLY:
+            future.set_result(None)
+        else:
+            self._waiters.append(future)
+        self._writer.write(glosocket.encode_frame(data, self._compress))
+        return future
+
+    async def request(
+        self, header: gloutils.Headers, payload: dict | None = None
+    ) -> gloutils.GloMessage:
+        """Envoie une requête et retourne sa réponse, ou lève GLOClientError."""
+        if self._closed and self._reconnect:
+            await self._reopen()
+        future = self.submit(header, payload)
+        try:
+            await self._writer.drain()
+        except ConnectionError as ex:
+            raise glosocket.GLOSocketError("The connection is closed.") from ex
+        return _check(await future)
+
+    async def register(self, username: str, password: str) -> None:
+        """Crée un compte et connecte la session à ce compte."""
+        reply = await self.request(
+            gloutils.Headers.AUTH_REGISTER,
+            gloutils.AuthPayload(username=username, password=password),
+        )
+        self.username = username
+        self._resumption_token = reply.get("payload", {}).get("token", "")
+        self._email_pages.clear()
+
+    async def login(self, username: str, password: str) -> None:
+        """Connecte la session au compte."""
+        reply = await self.request(
+            gloutils.Headers.AUTH_LOGIN,
+            gloutils.AuthPayload(username=username, password=password),
+        )
+        self.username = username
+        self._resumption_token = reply.get("payload", {}).get("token", "")
+        self._email_pages.clear()
+
+    async def logout(self) -> None:
+        """Déconnecte la session de son compte."""
+        if self._closed and self._reconnect:
+            await self._reopen()
+        self.submit(gloutils.Headers.AUTH_LOGOUT)
+        self.username = ""
+        self._resumption_token = ""
+        self._email_pages.clear()
+
+    async def send_email(
+        self, destination: str | list[str], subject: str, content: str
+    ) -> None:
+        """Envoie un courriel au nom de l'utilisateur connecté."""
+        await self.request(
+            gloutils.Headers.EMAIL_SENDING,
+            make_email(self.username, destination, subject, content),
+        )
+
+    async def send_batch(
+        self, emails: list[gloutils.EmailContentPayload]
+    ) -> list[gloutils.GloMessage]:
+        """Envoie un lot de courriels et retourne le résultat de chacun."""
+        reply = await self.request(
+            gloutils.Headers.EMAIL_BATCH_SENDING, gloutils.EmailBatchPayload(emails=emails)
+        )
+        return reply["payload"]["results"]
+
+    async def list_emails(
+        self, offset: int = 0, limit: int | None = None
+    ) -> gloutils.EmailListPayload:
+        """
+        Retourne la page de la liste des courriels, la liste entière sans
+        `limit`. Une page déjà reçue n'est retransmise que si la boîte a
+        changé depuis.
+        """
+        payload = _list_request(self._email_pages, offset, limit)
+        reply = await self.request(gloutils.Headers.INBOX_READING_REQUEST, payload)
+        return _list_reply(self._email_pages, payload, reply)
+
+    async def fetch_email(self, email_id: str) -> gloutils.EmailContentPayload:
+        """Retourne le courriel d'identifiant `email_id`."""
+        reply = await self.request(
+            gloutils.Headers.INBOX_READING_CHOICE,
+            gloutils.EmailIdChoicePayload(email_id=email_id),
+        )
+        return reply["payload"]
+
+    async def stats(self) -> gloutils.StatsPayload:
+        """Retourne les statistiques de la boîte de l'utilisateur."""
+        return (await self.request(gloutils.Headers.STATS_REQUEST))["payload"]
+
+    async def close(self) -> None:
+        """Quitte le serveur et ferme la connexion."""
+        self._reconnect = False
+        if not self._closed:
+            self.submit(gloutils.Headers.BYE)
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self._reader_task
+
+
+class AsyncConnectionPool:
+    """
+    Équivalent asyncio de ConnectionPool.
+
+    Un bassin s'ouvre avec `await AsyncConnectionPool.open(...)`.
+    """
+
+    def __init__(self, username: str, connections: list[AsyncConnection]) -> None:
+        self.username = username
+        self._connections = connections
+
+    @classmethod
+    async def open(
+        cls,
+        destination: str,
+        username: str,
+        password: str,
+        size: int = DEFAULT_POOL_SIZE,
+        port: int = gloutils.APP_PORT,
+        on_new_mail: NewMailCallback | None = None,
+    ) -> "AsyncConnectionPool":
+        """
+        Ouvre `size` connexions en parallèle et les authentifie. Seule la
+        première demande les avis de nouveaux courriels, pour `on_new_mail`.
+        """
+        pool = cls(username, [])
+        opened = await asyncio.gather(
+            *(
+                AsyncConnection.open(
+                    destination, port, on_new_mail=None if index else on_new_mail
+                )
+                for index in range(size)
+            ),
+            return_exceptions=True,
+        )
+        pool._connections = [
+            connection for connection in opened if isinstance(connection, AsyncConnection)
+        ]
+        try:
+            for result in opened:
+                if isinstance(result, BaseException):
+                    raise result
+            await asyncio.gather(
+                *(connection.login(username, password) for connection in pool._connections)
+            )
+        except (glosocket.GLOSocketError, GLOClientError):
+            await pool.close()
+            raise
+        return pool
+
+    async def __aenter__(self) -> "AsyncConnectionPool":
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    def _pick(self) -> AsyncConnection:
+        return min(self._connections, key=lambda connection: connection.in_flight)
+
+    async def request(
+        self, header: gloutils.Headers, payload: dict | None = None
+    ) -> gloutils.GloMessage:
+        """Envoie une requête et retourne sa réponse, ou lève GLOClientError."""
+        return await self._pick().request(header, payload)
+
+    async def send_email(
+        self, destination: str | list[str], subject: str, content: str
+    ) -> None:
+        """Envoie un courriel au nom de l'utilisateur du bassin."""
+        await self.request(
+            gloutils.Headers.EMAIL_SENDING,
+            make_email(self.username, destination, subject, content),
+        )
+
+    async def send_batch(
+        self, emails: list[gloutils.EmailContentPayload]
+    ) -> list[gloutils.GloMessage]:
+        """
+        Répartit le lot entre les connexions, envoyées en parallèle, et
+        retourne le résultat de chaque courriel dans l'ordre du lot.
+        """
+        parts = await asyncio.gather(*(
+            connection.send_batch(part)
+            for connection, part in zip(
+                self._connections, _split(emails, len(self._connections))
+            )
+        ))
+        return [result for part in parts for result in part]
+
+    async def list_emails(
+        self, offset: int = 0, limit: int | None = None
+    ) -> gloutils.EmailListPayload:
+        return await self._pick().list_emails(offset, limit)
+
+    async def fetch_email(self, email_id: str) -> gloutils.EmailContentPayload:
+        return await self._pick().fetch_email(email_id)
+
+    async def stats(self) -> gloutils.StatsPayload:
+        return await self._pick().stats()
+
+    async def close(self) -> None:
+        """Ferme toutes les connexions du bassin."""
+        await asyncio.gather(*(connection.close() for connection in self._connections))
+        self._connections.clear()
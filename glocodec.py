@@ -0,0 +1,229 @@
+"""\
+Module fournissant les codecs de sérialisation des messages GloMessage
+échangés avec glosocket: JSON, par défaut et pour la compatibilité, et
+un encodage binaire compact négocié par l'entête HELLO.
+"""
+import json
+import struct
+
+import gloutils
+
+
+class CodecError(Exception):
+    """
+    Erreur levée par les codecs lorsqu'un message ne peut
+    être encodé ou décodé.
+    """
+
+
+class JsonCodec:
+    """Codec JSON, utilisé par défaut et tant qu'aucun autre n'est négocié."""
+
+    name = "json"
+
+    def encode(self, message: gloutils.GloMessage) -> bytes:
+        """Sérialise le message en JSON encodé en utf-8."""
+        return json.dumps(message).encode("utf-8")
+
+    def decode(self, data: bytes | memoryview) -> gloutils.GloMessage:
+        """Désérialise un message JSON."""
+        try:
+            message = json.loads(str(data, "utf-8"))
+        except ValueError as ex:
+            raise CodecError("The received data was not valid JSON") from ex
+        if not isinstance(message, dict) or "header" not in message:
+            raise CodecError("The received data was not a GloMessage")
+        return message
+
+
+# Noms de champs connus, encodés sur un octet par leur rang. Ajouter les
+# nouveaux champs à la fin seulement: le rang fait partie du format.
+_FIELD_NAMES = (
+    "error_message", "username", "password", "sender", "destination",
+    "subject", "date", "content", "offset", "limit", "email_list",
+    "email_ids", "total", "choice", "email_id", "count", "size", "codecs",
+    "compression", "header", "emails", "results", "since_version", "version",
+    "features", "token",
+)
+_FIELD_INDEX = {name: index for index, name in enumerate(_FIELD_NAMES)}
+_INLINE_FIELD = 0xFF
+
+# Etiquettes des valeurs encodees. Une liste de chaines est encodee d'un bloc:
+# le tableau de leurs longueurs, puis leurs octets mis bout a bout.
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _LIST, _DICT, _STR_LIST = range(9)
+
+_HEADER = struct.Struct("!B")
+_TAG = struct.Struct("!B")
+_INT64 = struct.Struct("!q")
+_FLOAT64 = struct.Struct("!d")
+_LENGTH = struct.Struct("!I")
+_SHORT_LENGTH = struct.Struct("!H")
+
+
+class BinaryCodec:
+    """
+    Codec binaire compact: l'entête tient sur un octet, suivi du payload
+    encodé champ par champ. Chaque valeur est précédée d'une étiquette de
+    type, les chaînes et les listes de leur longueur, et les noms de champs
+    connus sont remplacés par leur rang dans `_FIELD_NAMES`.
+    """
+
+    name = "binary"
+
+    def encode(self, message: gloutils.GloMessage) -> bytes:
+        """Sérialise le message dans l'encodage binaire."""
+        try:
+            parts = [_HEADER.pack(message["header"])]
+            if "payload" in message:
+                self._encode_value(message["payload"], parts)
+        except struct.error as ex:
+            raise CodecError("The message could not be encoded") from ex
+        return b"".join(parts)
+
+    def decode(self, data: bytes | memoryview) -> gloutils.GloMessage:
+        """Désérialise un message de l'encodage binaire."""
+        view = memoryview(data)
+        try:
+            header, = _HEADER.unpack_from(view, 0)
+            message = gloutils.GloMessage(header=header)
+            if len(view) > _HEADER.size:
+                payload, offset = self._decode_value(view, _HEADER.size)
+                if offset != len(view):
+                    raise CodecError("Trailing data after the payload")
+                message["payload"] = payload
+        except (struct.error, IndexError, UnicodeDecodeError) as ex:
+            raise CodecError("The received data was not a binary GloMessage") from ex
+        return message
+
+    def _encode_value(self, value: object, parts: list[bytes]) -> None:
+        if value is None:
+            parts.append(_TAG.pack(_NONE))
+        elif isinstance(value, bool):
+            parts.append(_TAG.pack(_TRUE if value else _FALSE))
+        elif isinstance(value, int):
+            parts.append(_TAG.pack(_INT) + _INT64.pack(value))
+        elif isinstance(value, float):
+            parts.append(_TAG.pack(_FLOAT) + _FLOAT64.pack(value))
+        elif isinstance(value, str):
+            data = value.encode("utf-8")
+            parts.append(_TAG.pack(_STR) + _LENGTH.pack(len(data)))
+            parts.append(data)
+        elif isinstance(value, (list, tuple)) and value and all(
+            type(item) is str for item in value
+        ):
+            encoded = [item.encode("utf-8") for item in value]
+            parts.append(_TAG.pack(_STR_LIST) + _LENGTH.pack(len(encoded)))
+            parts.append(struct.pack(f"!{len(encoded)}I", *map(len, encoded)))
+            parts.append(b"".join(encoded))
+        elif isinstance(value, (list, tuple)):
+            parts.append(_TAG.pack(_LIST) + _LENGTH.pack(len(value)))
+            for item in value:
+                self._encode_value(item, parts)
+        elif isinstance(value, dict):
+            parts.append(_TAG.pack(_DICT) + _SHORT_LENGTH.pack(len(value)))
+            for key, item in value.items():
+                self._encode_field(key, parts)
+                self._encode_value(item, parts)
+        else:
+            raise CodecError(f"Cannot encode a value of type {type(value).__name__}")
+
+    @staticmethod
+    def _encode_field(name: str, parts: list[bytes]) -> None:
+        index = _FIELD_INDEX.get(name)
+        if index is not None:
+            parts.append(_TAG.pack(index))
+        else:
+            data = name.encode("utf-8")
+            parts.append(_TAG.pack(_INLINE_FIELD) + _SHORT_LENGTH.pack(len(data)))
+            parts.append(data)
+
+    def _decode_value(self, view: memoryview, offset: int) -> tuple[object, int]:
+        tag = view[offset]
+        offset += 1
+        if tag == _NONE:
+            return None, offset
+        if tag in (_FALSE, _TRUE):
+            return tag == _TRUE, offset
+        if tag == _INT:
+            return _INT64.unpack_from(view, offset)[0], offset + _INT64.size
+        if tag == _FLOAT:
+            return _FLOAT64.unpack_from(view, offset)[0], offset + _FLOAT64.size
+        if tag == _STR:
+            length, = _LENGTH.unpack_from(view, offset)
+            offset += _LENGTH.size
+            if offset + length > len(view):
+                raise CodecError("Truncated string")
+            return str(view[offset:offset + length], "utf-8"), offset + length
+        if tag == _LIST:
+            length, = _LENGTH.unpack_from(view, offset)
+            offset += _LENGTH.size
+            items = []
+            for _ in range(length):
+                item, offset = self._decode_value(view, offset)
+                items.append(item)
+            return items, offset
+        if tag == _STR_LIST:
+            count, = _LENGTH.unpack_from(view, offset)
+            offset += _LENGTH.size
+            lengths = struct.unpack_from(f"!{count}I", view, offset)
+            offset += 4 * count
+            end = offset + sum(lengths)
+            if end > len(view):
+                raise CodecError("Truncated string list")
+            blob = bytes(view[offset:end])
+            text = blob.decode("utf-8")
+            # En ASCII, les positions en octets et en caracteres coincident:
+            # le bloc est decode une seule fois puis decoupe.
+            source = text if len(text) == len(blob) else blob
+            items = []
+            start = 0
+            for length in lengths:
+                items.append(source[start:start + length])
+                start += length
+            if source is blob:
+                items = [item.decode("utf-8") for item in items]
+            return items, end
+        if tag == _DICT:
+            length, = _SHORT_LENGTH.unpack_from(view, offset)
+            offset += _SHORT_LENGTH.size
+            fields = {}
+            for _ in range(length):
+                name, offset = self._decode_field(view, offset)
+                fields[name], offset = self._decode_value(view, offset)
+            return fields, offset
+        raise CodecError(f"Unknown value tag {tag}")
+
+    @staticmethod
+    def _decode_field(view: memoryview, offset: int) -> tuple[str, int]:
+        index = view[offset]
+        offset += 1
+        if index != _INLINE_FIELD:
+            if index >= len(_FIELD_NAMES):
+                raise CodecError(f"Unknown field index {index}")
+            return _FIELD_NAMES[index], offset
+        length, = _SHORT_LENGTH.unpack_from(view, offset)
+        offset += _SHORT_LENGTH.size
+        return str(view[offset:offset + length], "utf-8"), offset + length
+
+
+Codec = JsonCodec | BinaryCodec
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+
+# Codecs disponibles, par ordre de preference.
+CODECS: dict[str, Codec] = {
+    BINARY_CODEC.name: BINARY_CODEC,
+    JSON_CODEC.name: JSON_CODEC,
+}
+
+
+def choose_codec(offered: list[str]) -> Codec:
+    """
+    Retourne le premier codec proposé qui est pris en charge, selon
+    l'ordre de préférence du client, ou JSON à défaut.
+    """
+    for name in offered:
+        if name in CODECS:
+            return CODECS[name]
+    return JSON_CODEC
@@ -1,9 +1,32 @@
 """\
 Module fournissant les fonctions d'envoi et de réception
 de messages de taille arbitraire pour les sockets Python.
+
+Chaque message est précédé de sa longueur sur 4 octets. Le bit de
+poids fort de la longueur indique des données compressées avec zlib;
+seuls les pairs l'ayant négocié en envoient.
 """
+import asyncio
 import socket
 import struct
+import zlib
+
+# Taille maximale par défaut d'un message, en octets. Un préfixe de
+# longueur plus grand est rejeté avant toute allocation.
+MAX_MESG_SIZE = 64 * 1024 * 1024
+
+# Taille maximale d'une lecture avec socket.recv_into.
+_RECV_CHUNK_SIZE = 1024 * 1024
+
+# Nom de la compression à négocier pour utiliser l'indicateur.
+COMPRESSION = "zlib"
+
+# Taille à partir de laquelle un message est compressé, quand la
+# compression est demandée, et niveau de compression de zlib.
+COMPRESSION_THRESHOLD = 1024
+COMPRESSION_LEVEL = 1
+
+_COMPRESSED_FLAG = 0x80000000
 
 
 class GLOSocketError(Exception):
@@ -13,45 +36,133 @@ class GLOSocketError(Exception):
     """
 
 
-def _recvall(source: socket.socket, size: int) -> bytes:
+def _recvall(source: socket.socket, size: int,
+             buffer: bytearray | None = None) -> memoryview:
     """
     Fonction utilitaire pour recv_mesg.
 
-    Applique socket.recv en boucle pour jusqu'à la
-    réception d'un message de la taille voulue.
+    Applique socket.recv_into en boucle, directement dans le
+    tampon, jusqu'à la réception d'un message de la taille voulue.
+    Le tampon fourni est agrandi au besoin et réutilisé, sinon un
+    tampon de la taille exacte est alloué.
     """
-    msg = b""
-    while size > 0:
-        chunk_size = min(size, 4096)
+    if buffer is None:
+        buffer = bytearray(size)
+    elif len(buffer) < size:
+        buffer.extend(bytes(size - len(buffer)))
+
+    view = memoryview(buffer)[:size]
+    received = 0
+    while received < size:
         try:
-            buffer = source.recv(chunk_size)
+            nbytes = source.recv_into(view[received:],
+                                      min(size - received, _RECV_CHUNK_SIZE))
         except OSError as ex:
             raise GLOSocketError("The source socket is closed.") from ex
-        if not buffer:
+        if not nbytes:
             raise GLOSocketError("The other socket is closed.")
-        msg += buffer
-        size -= len(buffer)
-    return msg
+        received += nbytes
+    return view
 
 
-def send_mesg(dest_soc: socket.socket, message: str) -> None:
+def _check_length(length: int, max_size: int) -> tuple[int, bool]:
     """
-    Encode le message puis le transmet à la destination.
+    Sépare le préfixe de longueur en longueur et indicateur de
+    compression, et rejette une longueur dépassant la taille maximale.
+    """
+    compressed = bool(length & _COMPRESSED_FLAG)
+    length &= ~_COMPRESSED_FLAG
+    if length > max_size:
+        raise GLOSocketError(f"The announced message size ({length} bytes)"
+                             f" exceeds the maximum of {max_size} bytes")
+    return length, compressed
+
+
+def _decompress(data: bytes | memoryview, max_size: int) -> bytes:
+    """
+    Décompresse les données d'un message sans jamais produire plus
+    de `max_size` octets.
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        result = decompressor.decompress(data, max_size)
+    except zlib.error as ex:
+        raise GLOSocketError("The received data could not"
+                             " be decompressed") from ex
+    if decompressor.unconsumed_tail:
+        raise GLOSocketError("The decompressed message exceeds"
+                             f" the maximum of {max_size} bytes")
+    if not decompressor.eof:
+        raise GLOSocketError("The compressed message is truncated")
+    return result
+
+
+def encode_frame(data: bytes, compress: bool = False) -> bytes:
+    """
+    Préfixe les données de leur longueur, prêtes à être
+    écrites sur un socket.
+
+    Avec `compress`, les données d'au moins COMPRESSION_THRESHOLD
+    octets sont compressées, si cela les raccourcit.
+    """
+    if compress and len(data) >= COMPRESSION_THRESHOLD:
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        if len(compressed) < len(data):
+            return struct.pack("!I", len(compressed) | _COMPRESSED_FLAG) + compressed
+    return struct.pack("!I", len(data)) + data
+
+
+def encode_mesg(message: str) -> bytes:
+    """
+    Encode le message et le préfixe de sa longueur, prêt
+    à être écrit sur un socket.
+    """
+    return encode_frame(message.encode(encoding='utf-8'))
+
+
+def _decode_utf8(data: bytes | memoryview) -> str:
+    try:
+        return str(data, 'utf-8')
+    except UnicodeDecodeError as ex:
+        raise GLOSocketError("The received data was"
+                             " not valid utf-8") from ex
+
+
+def send_frame(dest_soc: socket.socket, data: bytes,
+               compress: bool = False) -> None:
+    """
+    Transmet des données binaires à la destination, compressées
+    au besoin (voir encode_frame).
 
     Lève une exception GLOSocketError en cas de problème
     de communication.
     """
-    data = message.encode(encoding='utf-8')
-    data_length = struct.pack("!I", len(data))
     try:
-        dest_soc.sendall(data_length + data)
+        dest_soc.sendall(encode_frame(data, compress))
     except OSError as ex:
         raise GLOSocketError("Cannot send data with socket") from ex
 
 
-def recv_mesg(source_soc: socket.socket) -> str:
+def send_mesg(dest_soc: socket.socket, message: str) -> None:
     """
-    Récupère un message de la source et le décode.
+    Encode le message puis le transmet à la destination.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    send_frame(dest_soc, message.encode(encoding='utf-8'))
+
+
+def recv_frame(source_soc: socket.socket, max_size: int = MAX_MESG_SIZE,
+               buffer: bytearray | None = None) -> memoryview:
+    """
+    Récupère les données binaires d'un message de la source.
+
+    `buffer` permet de réutiliser le même tampon de réception d'un
+    message à l'autre; la vue retournée n'est alors valide que jusqu'à
+    la prochaine réception. Un message annonçant plus de `max_size`
+    octets, compressés ou non, est rejeté. Les données compressées
+    sont décompressées.
 
     Lève une exception GLOSocketError en cas de problème
     de communication.
@@ -62,6 +173,100 @@ def recv_mesg(source_soc: socket.socket) -> str:
     except struct.error as ex:
         raise GLOSocketError("The received data was"
                              " not the message's length") from ex
+    length, compressed = _check_length(length, max_size)
+
+    data = _recvall(source_soc, length, buffer)
+    if compressed:
+        return memoryview(_decompress(data, max_size))
+    return data
+
+
+def recv_mesg(source_soc: socket.socket, max_size: int = MAX_MESG_SIZE,
+              buffer: bytearray | None = None) -> str:
+    """
+    Récupère un message de la source et le décode.
+
+    Voir recv_frame pour `max_size` et `buffer`.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    return _decode_utf8(recv_frame(source_soc, max_size, buffer))
+
+
+async def send_frame_async(writer: asyncio.StreamWriter, data: bytes,
+                           compress: bool = False) -> None:
+    """
+    Équivalent de send_frame pour un flux asyncio.
+
+    Attend que le tampon d'écriture du flux se soit vidé.
+    """
+    writer.write(encode_frame(data, compress))
+    try:
+        await writer.drain()
+    except ConnectionError as ex:
+        raise GLOSocketError("Cannot send data with stream") from ex
+
+
+async def send_mesg_async(writer: asyncio.StreamWriter, message: str) -> None:
+    """Équivalent de send_mesg pour un flux asyncio."""
+    await send_frame_async(writer, message.encode(encoding='utf-8'))
+
+
+async def recv_frame_async(reader: asyncio.StreamReader,
+                           max_size: int = MAX_MESG_SIZE) -> bytes:
+    """
+    Équivalent de recv_frame pour un flux asyncio.
+
+    Lève une exception GLOSocketError si le flux se ferme
+    avant la fin du message.
+    """
+    try:
+        data_length = await reader.readexactly(4)
+        length, = struct.unpack("!I", data_length)
+        length, compressed = _check_length(length, max_size)
+        data = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError) as ex:
+        raise GLOSocketError("The other stream is closed.") from ex
+    if compressed:
+        return _decompress(data, max_size)
+    return data
+
+
+async def recv_mesg_async(reader: asyncio.StreamReader,
+                          max_size: int = MAX_MESG_SIZE) -> str:
+    """Équivalent de recv_mesg pour un flux asyncio."""
+    return _decode_utf8(await recv_frame_async(reader, max_size))
+
+
+def decode_frames(buffer: bytearray,
+                  max_size: int = MAX_MESG_SIZE) -> list[bytes]:
+    """
+    Extrait les données des messages complets accumulés dans le tampon.
+
+    Les octets consommés sont retirés du tampon, un message incomplet
+    y reste jusqu'à la réception de la suite. Permet de lire un socket
+    non bloquant au rythme où les données arrivent.
+    """
+    frames = []
+    offset = 0
+    while len(buffer) - offset >= 4:
+        length, = struct.unpack_from("!I", buffer, offset)
+        length, compressed = _check_length(length, max_size)
+        if len(buffer) - offset - 4 < length:
+            break
+        start = offset + 4
+        if compressed:
+            with memoryview(buffer) as view:
+                frames.append(_decompress(view[start:start + length], max_size))
+        else:
+            frames.append(bytes(buffer[start:start + length]))
+        offset = start + length
+    del buffer[:offset]
+    return frames
+
 
-    data = _recvall(source_soc, length)
-    return data.decode('utf-8')
+def decode_mesgs(buffer: bytearray,
+                 max_size: int = MAX_MESG_SIZE) -> list[str]:
+    """Équivalent de decode_frames qui décode chaque message en texte."""
+    return [_decode_utf8(frame) for frame in decode_frames(buffer, max_size)]
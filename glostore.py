@@ -0,0 +1,1122 @@
+"""\
+Module fournissant les moteurs de stockage du serveur: comptes,
+statistiques et boîtes de réception.
+
+- `files`, par défaut: un dossier par utilisateur, contenant son mot de
+passe, ses statistiques et un fichier JSON par courriel.
+- `sharded`: la même disposition, mais les courriels de chaque boîte sont
+répartis en sous-dossiers selon le début de leur identifiant.
+- `segments`: les mêmes dossiers, mais les courriels sont ajoutés bout à
+bout dans des segments, lus par mmap au travers d'un index.
+- `sqlite`: une base sqlite3 en mode WAL, indexée par destinataire et date.
+- `memory`: des dictionnaires, sans persistance, pour les tests et mesures.
+
+Chaque moteur respecte l'interface `MailStore` et s'inscrit dans
+`MAIL_STORES` sous son nom.
+
+Une boîte est désignée par le nom canonique de son utilisateur, ou par
+`gloutils.SERVER_LOST_DIR` pour les courriels sans destinataire. Un
+courriel livré à plusieurs boîtes n'est conservé qu'une fois: chacune en
+garde une référence.
+"""
+import collections
+import json
+import mmap
+import os
+import sqlite3
+import struct
+
+from pathlib import Path
+from typing import Iterator, Protocol, Sequence, runtime_checkable
+
+import gloutils
+
+
+# Taille au-dela de laquelle un segment est clos et le suivant commence.
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Nombre maximal de boites dont les fichiers et projections restent ouverts.
+MAX_OPEN_MAILBOXES = 256
+
+# Nombre de caracteres de l'identifiant nommant le sous-dossier d'un courriel dans
+# la disposition en sous-dossiers: 256 sous-dossiers par boite.
+SHARD_WIDTH = 2
+
+_SEGMENTS_DIRNAME = "segments"
+_SHARED_DIRNAME = "shared"
+_INDEX_FILENAME = "index"
+_SQLITE_FILENAME = "glo.sqlite3"
+
+# Marque laissee dans le dossier des donnees par un arret propre: en son absence, les
+# statistiques conservees peuvent ne pas compter le dernier lot.
+_CLEAN_SHUTDOWN_FILENAME = ".clean_shutdown"
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    username TEXT PRIMARY KEY COLLATE NOCASE,
+    password TEXT NOT NULL,
+    count INTEGER,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS bodies (
+    email_id TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mailboxes (
+    mailbox TEXT NOT NULL COLLATE NOCASE,
+    email_id TEXT NOT NULL REFERENCES bodies,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY (mailbox, email_id)
+);
+CREATE INDEX IF NOT EXISTS mailboxes_by_date ON mailboxes (mailbox, timestamp);
+"""
+
+# Reprise de la table `emails` d'une base anterieure, ou chaque boite avait sa copie.
+_SQLITE_MIGRATION = """
+INSERT OR IGNORE INTO bodies SELECT email_id, data FROM emails;
+INSERT OR IGNORE INTO mailboxes SELECT mailbox, email_id, timestamp FROM emails;
+DROP TABLE emails;
+"""
+
+# Entree de l'index d'une boite: empreinte sha256 du courriel, numero du segment,
+# position et longueur du courriel dans le segment, horodatage de sa date.
+_INDEX_ENTRY = struct.Struct("!32sIQId")
+
+# Position d'un courriel dans les segments: (segment, position, longueur, horodatage).
+SegmentEntry = tuple[int, int, int, float]
+
+# Bit du numero de segment marquant une reference a un courriel conserve dans les
+# segments partages par ses destinataires.
+_SHARED_SEGMENT = 1 << 31
+
+
+@runtime_checkable
+class MailStore(Protocol):
+    """
+    Interface des moteurs de stockage utilisés par le serveur. Un nouveau
+    moteur n'a qu'à fournir ces méthodes et à s'inscrire dans MAIL_STORES.
+
+    Le serveur n'appelle un stockage que depuis un fil à la fois. Les
+    livraisons, comptes et statistiques confiés au stockage ne sont
+    durables qu'après `commit`.
+    """
+
+    # Nom du moteur dans MAIL_STORES et sur la ligne de commande.
+    name: str
+
+    def load_accounts(self) -> Iterator[tuple[str, str]]:
+        """Parcourt les comptes: nom canonique et mot de passe haché."""
+        ...
+
+    def save_account(self, username: str, password_hash: str) -> None:
+        """Conserve le mot de passe haché de l'utilisateur, créant son compte au besoin."""
+        ...
+
+    def mailbox_exists(self, username: str) -> bool:
+        """Indique si un compte ou une boîte porte ce nom, sans égard à la casse."""
+        ...
+
+    def load_stats(self, username: str) -> gloutils.StatsPayload | None:
+        """Retourne les statistiques conservées, ou None si elles sont absentes."""
+        ...
+
+    def save_stats(self, username: str, stats: gloutils.StatsPayload) -> None:
+        """Conserve les statistiques de l'utilisateur."""
+        ...
+
+    def recover(self) -> list[str]:
+        """
+        Répare le stockage au démarrage et retourne les utilisateurs dont
+        les statistiques sont à reconstruire.
+        """
+        ...
+
+    def create_mailbox(self, username: str) -> None:
+        """Crée la boîte de l'utilisateur."""
+        ...
+
+    def deliver(
+        self, usernames: Sequence[str], email_id: str, data: bytes, timestamp: float
+    ) -> list[int | None]:
+        """
+        Ajoute le courriel aux boîtes et retourne, pour chacune, la taille
+        du courriel de même identifiant déjà présent, ou None s'il est
+        nouveau.
+        """
+        ...
+
+    def read(self, username: str, email_id: str) -> bytes | None:
+        """Retourne le courriel, ou None s'il n'est pas dans la boîte."""
+        ...
+
+    def iter_emails(self, username: str) -> Iterator[tuple[str, bytes]]:
+        """Parcourt les identifiants et contenus des courriels de la boîte."""
+        ...
+
+    def usage(self, username: str) -> tuple[int, int]:
+        """Retourne le nombre et la taille totale des courriels de la boîte."""
+        ...
+
+    def commit(self) -> None:
+        """Rend durable le lot de livraisons, comptes et statistiques en cours."""
+        ...
+
+    def close(self) -> None:
+        """Rend durable le dernier lot et libère le stockage."""
+        ...
+
+
+def _replace_file(path: Path, content: object) -> None:
+    """
+    Écrit le contenu en JSON dans un fichier temporaire, le synchronise,
+    puis le renomme en place: le fichier n'est jamais vide ni à moitié
+    écrit. Le dossier reste à synchroniser pour rendre le renommage durable.
+    """
+    temporary_path = path.with_suffix(".tmp")
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(content, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+def _fsync_directory(path: Path) -> None:
+    """Rend durables les créations et renommages de fichiers du dossier."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _DirectoryStore:
+    """
+    Comptes et statistiques des stockages en dossiers: chaque utilisateur a
+    un dossier à son nom dans `data_dir`, contenant les fichiers
+    PASSWORD_FILENAME et STATS_FILENAME.
+
+    Les mots de passe et les statistiques sont écrits par `commit`, après
+    les courriels du lot, chacun dans un fichier temporaire synchronisé puis
+    renommé en place. Un arrêt brutal entre les deux est détecté au
+    démarrage par `recover`.
+    """
+
+    def __init__(self, data_dir: Path) -> None:
+        self._data_dir = data_dir
+        (data_dir / gloutils.SERVER_LOST_DIR).mkdir(parents=True, exist_ok=True)
+        # Mots de passe et statistiques modifies depuis le dernier lot, par nom d'utilisateur
+        self._staged_accounts: dict[str, str] = {}
+        self._staged_stats: dict[str, gloutils.StatsPayload] = {}
+        # Vrai une fois `recover` appelee: la fermeture peut alors marquer un arret propre
+        self._recovered = False
+
+    def _user_dirs(self) -> Iterator[Path]:
+        """Parcourt les dossiers des utilisateurs."""
+        for repo in self._data_dir.iterdir():
+            if repo.is_dir() and repo.name != gloutils.SERVER_LOST_DIR:
+                yield repo
+
+    def load_accounts(self) -> Iterator[tuple[str, str]]:
+        """
+        Parcourt les comptes: nom canonique et mot de passe haché. Les
+        dossiers sans mot de passe lisible sont ignorés.
+        """
+        for repo in self._user_dirs():
+            password_file_path = repo / f"{gloutils.PASSWORD_FILENAME}.json"
+            try:
+                with open(password_file_path, "r", encoding="utf-8") as file:
+                    stored_hash = json.load(file)["password"]
+            except (OSError, ValueError, KeyError):
+                continue
+            yield repo.name, stored_hash
+
+    def save_account(self, username: str, password_hash: str) -> None:
+        """
+        Retient le mot de passe haché de l'utilisateur, écrit avec le lot par
+        `commit`, et crée son dossier au besoin.
+        """
+        (self._data_dir / username).mkdir(exist_ok=True)
+        self._staged_accounts[username] = password_hash
+
+    def mailbox_exists(self, username: str) -> bool:
+        """
+        Indique si un dossier d'utilisateur porte ce nom, sans égard à la
+        casse, même si son mot de passe est illisible.
+        """
+        if (self._data_dir / username).is_dir():
+            return True
+        key = username.lower()
+        return any(repo.name.lower() == key for repo in self._user_dirs())
+
+    def load_stats(self, username: str) -> gloutils.StatsPayload | None:
+        """Retourne les statistiques conservées, ou None si elles sont absentes ou illisibles."""
+        staged = self._staged_stats.get(username)
+        if staged is not None:
+            return gloutils.StatsPayload(**staged)
+
+        stats_file_path = self._data_dir / username / f"{gloutils.STATS_FILENAME}.json"
+        try:
+            with open(stats_file_path, "r", encoding="utf-8") as file:
+                content = json.load(file)
+            stats = gloutils.StatsPayload(
+                count=int(content["count"]), size=int(content["size"])
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if stats["count"] < 0 or stats["size"] < 0:
+            return None
+        return stats
+
+    def save_stats(self, username: str, stats: gloutils.StatsPayload) -> None:
+        """Retient les statistiques de l'utilisateur, écrites avec le lot par `commit`."""
+        self._staged_stats[username] = gloutils.StatsPayload(**stats)
+
+    def _write_staged(self) -> set[Path]:
+        """
+        Écrit les mots de passe et les statistiques retenus depuis le
+        dernier lot avec `_replace_file`. Retourne les dossiers à
+        synchroniser.
+        """
+        directories = set()
+        for username, password_hash in self._staged_accounts.items():
+            user_dir = self._data_dir / username
+            _replace_file(
+                user_dir / f"{gloutils.PASSWORD_FILENAME}.json", {"password": password_hash}
+            )
+            directories.add(user_dir)
+        self._staged_accounts.clear()
+        for username, stats in self._staged_stats.items():
+            user_dir = self._data_dir / username
+            _replace_file(user_dir / f"{gloutils.STATS_FILENAME}.json", stats)
+            directories.add(user_dir)
+        self._staged_stats.clear()
+        return directories
+
+    def recover(self) -> list[str]:
+        """
+        Supprime les fichiers temporaires laissés par un arrêt brutal et
+        retourne les utilisateurs dont les statistiques conservées peuvent
+        ne plus correspondre à leur boîte: tous, si la marque d'un arrêt
+        propre est absente.
+
+        La marque est retirée jusqu'à la prochaine fermeture: un arrêt
+        brutal pendant l'exécution sera détecté au prochain démarrage.
+        """
+        marker_path = self._data_dir / _CLEAN_SHUTDOWN_FILENAME
+        clean = marker_path.exists()
+        if clean:
+            marker_path.unlink()
+            _fsync_directory(self._data_dir)
+        self._recovered = True
+
+        stale = []
+        for repo in self._user_dirs():
+            (repo / f"{gloutils.PASSWORD_FILENAME}.tmp").unlink(missing_ok=True)
+            (repo / f"{gloutils.STATS_FILENAME}.tmp").unlink(missing_ok=True)
+            if not clean:
+                stale.append(repo.name)
+        return stale
+
+    def _mark_clean_shutdown(self) -> None:
+        """
+        Laisse la marque d'un arrêt propre, si `recover` a été appelée:
+        les statistiques écrites par le dernier `commit` sont exactes.
+        """
+        if self._recovered:
+            (self._data_dir / _CLEAN_SHUTDOWN_FILENAME).touch()
+            _fsync_directory(self._data_dir)
+
+
+class FileMailStore(_DirectoryStore):
+    """
+    Stockage d'origine: chaque courriel est un fichier `<identifiant>.json`
+    du dossier `emails` de son destinataire, ou du dossier SERVER_LOST_DIR.
+
+    Un courriel livré est d'abord écrit dans un fichier `<identifiant>.tmp`;
+    `commit` synchronise les fichiers du lot, les renomme en place, puis
+    synchronise une fois chaque dossier touché. Un fichier `.json` n'est
+    ainsi jamais incomplet. Les boîtes des autres destinataires d'un même
+    courriel en reçoivent un lien physique.
+
+    Les courriels sont cherchés dans les deux dispositions, à plat et en
+    sous-dossiers: une boîte en cours de migration reste lisible.
+    """
+
+    name = "files"
+    sharded = False
+
+    def __init__(self, data_dir: Path) -> None:
+        super().__init__(data_dir)
+        # Courriels livres depuis le dernier lot:
+        # (boite, identifiant) -> (fichier temporaire, taille)
+        self._staged: dict[tuple[Path, str], tuple[Path, int]] = {}
+
+    def _mailbox_path(self, username: str) -> Path:
+        if username == gloutils.SERVER_LOST_DIR:
+            return self._data_dir / gloutils.SERVER_LOST_DIR
+        return self._data_dir / username / "emails"
+
+    def _email_paths(self, mailbox_path: Path, email_id: str) -> tuple[Path, Path]:
+        """
+        Retourne le chemin du courriel dans la disposition de ce stockage,
+        puis dans l'autre.
+        """
+        flat_path = mailbox_path / f"{email_id}.json"
+        sharded_path = mailbox_path / email_id[:SHARD_WIDTH] / f"{email_id}.json"
+        if self.sharded:
+            return sharded_path, flat_path
+        return flat_path, sharded_path
+
+    def _find_email(self, mailbox_path: Path, email_id: str) -> Path | None:
+        """Retourne le chemin du courriel, fichier temporaire du lot compris, ou None."""
+        staged = self._staged.get((mailbox_path, email_id))
+        if staged is not None:
+            return staged[0]
+        for path in self._email_paths(mailbox_path, email_id):
+            if path.exists():
+                return path
+        return None
+
+    @staticmethod
+    def _scan_emails(mailbox_path: Path) -> Iterator[os.DirEntry]:
+        """
+        Parcourt les fichiers `.json` de la boîte et de ses sous-dossiers.
+        Les fichiers temporaires d'un lot interrompu par un arrêt sont
+        ignorés.
+        """
+        for entry in os.scandir(mailbox_path):
+            if entry.name.endswith(".json") and entry.is_file():
+                yield entry
+            elif len(entry.name) == SHARD_WIDTH and entry.is_dir():
+                for shard_entry in os.scandir(entry.path):
+                    if shard_entry.name.endswith(".json") and shard_entry.is_file():
+                        yield shard_entry
+
+    def create_mailbox(self, username: str) -> None:
+        """Crée la boîte, et le dossier de l'utilisateur au besoin."""
+        self._mailbox_path(username).mkdir(parents=True, exist_ok=True)
+
+    def deliver(
+        self, usernames: Sequence[str], email_id: str, data: bytes, timestamp: float
+    ) -> list[int | None]:
+        """
+        Écrit le courriel une seule fois, dans un fichier temporaire placé
+        dans chaque boîte par `commit`. Retourne, pour chaque boîte, la
+        taille du courriel de même identifiant déjà présent, ou None s'il
+        est nouveau.
+
+        L'identifiant étant l'empreinte du contenu, un courriel déjà
+        présent n'est pas écrit une seconde fois.
+        """
+        previous_sizes: list[int | None] = []
+        new_mailboxes = []
+        for username in usernames:
+            mailbox_path = self._mailbox_path(username)
+            path = self._find_email(mailbox_path, email_id)
+            if path is None:
+                previous_sizes.append(None)
+                new_mailboxes.append(mailbox_path)
+            else:
+                previous_sizes.append(path.stat().st_size)
+
+        if new_mailboxes:
+            temporary_path = new_mailboxes[0] / f"{email_id}.tmp"
+            with open(temporary_path, "wb") as file:
+                file.write(data)
+            for mailbox_path in new_mailboxes:
+                self._staged[(mailbox_path, email_id)] = (temporary_path, len(data))
+        return previous_sizes
+
+    def read(self, username: str, email_id: str) -> bytes | None:
+        """Retourne le courriel, ou None s'il n'est pas dans la boîte."""
+        path = self._find_email(self._mailbox_path(username), email_id)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def iter_emails(self, username: str) -> Iterator[tuple[str, bytes]]:
+        """Parcourt les identifiants et contenus des courriels de la boîte."""
+        mailbox_path = self._mailbox_path(username)
+        for entry in self._scan_emails(mailbox_path):
+            with open(entry.path, "rb") as file:
+                yield entry.name[:-len(".json")], file.read()
+        for (staged_mailbox, email_id), (temporary_path, _) in list(self._staged.items()):
+            if staged_mailbox == mailbox_path:
+                with open(temporary_path, "rb") as file:
+                    yield email_id, file.read()
+
+    def usage(self, username: str) -> tuple[int, int]:
+        """Retourne le nombre et la taille totale des courriels de la boîte."""
+        mailbox_path = self._mailbox_path(username)
+        count = 0
+        size = 0
+        for entry in self._scan_emails(mailbox_path):
+            count += 1
+            size += entry.stat().st_size
+        for (staged_mailbox, _), (_, staged_size) in self._staged.items():
+            if staged_mailbox == mailbox_path:
+                count += 1
+                size += staged_size
+        return count, size
+
+    def recover(self) -> list[str]:
+        """
+        Supprime aussi les courriels d'un lot interrompu avant d'être
+        renommés en place: ils n'ont jamais été confirmés. Les statistiques
+        de leurs destinataires sont à reconstruire.
+        """
+        stale = super().recover()
+        mailboxes = [(gloutils.SERVER_LOST_DIR, self._mailbox_path(gloutils.SERVER_LOST_DIR))]
+        mailboxes += [(repo.name, repo / "emails") for repo in self._user_dirs()]
+        for username, mailbox_path in mailboxes:
+            if not mailbox_path.is_dir():
+                continue
+            temporary_paths = [
+                entry.path for entry in os.scandir(mailbox_path)
+                if entry.name.endswith(".tmp") and entry.is_file()
+            ]
+            for temporary_path in temporary_paths:
+                os.unlink(temporary_path)
+            if temporary_paths and username not in (gloutils.SERVER_LOST_DIR, *stale):
+                stale.append(username)
+        return stale
+
+    def commit(self) -> None:
+        """
+        Rend durables les courriels livrés depuis le dernier lot, puis les
+        mots de passe et les statistiques qui les comptent. POSIX ne
+        permettant pas de synchroniser plusieurs fichiers d'un appel, ceux
+        du lot le sont à la suite, avant tout renommage.
+        """
+        if not self._staged:
+            for directory in self._write_staged():
+                _fsync_directory(directory)
+            return
+
+        targets: dict[Path, list[Path]] = {}
+        for (mailbox_path, email_id), (temporary_path, _) in self._staged.items():
+            path = self._email_paths(mailbox_path, email_id)[0]
+            targets.setdefault(temporary_path, []).append(path)
+        self._staged.clear()
+
+        for temporary_path in targets:
+            with open(temporary_path, "rb") as file:
+                os.fsync(file.fileno())
+
+        directories = set()
+        for temporary_path, paths in targets.items():
+            for path in paths:
+                if self.sharded and not path.parent.is_dir():
+                    path.parent.mkdir(exist_ok=True)
+                    directories.add(path.parent.parent)
+            # Les autres destinataires partagent le fichier du premier
+            for path in paths[1:]:
+                os.link(temporary_path, path)
+            os.replace(temporary_path, paths[0])
+            directories.update(path.parent for path in paths)
+            directories.add(temporary_path.parent)
+
+        directories.update(self._write_staged())
+        for directory in directories:
+            _fsync_directory(directory)
+
+    def migrate(self) -> int:
+        """
+        Déplace sur place les courriels de toutes les boîtes vers la
+        disposition de ce stockage et retourne le nombre de courriels
+        déplacés. Les sous-dossiers vidés sont supprimés.
+
+        À exécuter serveur arrêté. Chaque courriel est renommé d'un coup:
+        une migration interrompue peut être reprise.
+        """
+        mailbox_paths = [self._data_dir / gloutils.SERVER_LOST_DIR] + [
+            repo / "emails" for repo in self._user_dirs()
+        ]
+
+        moved = 0
+        directories = set()
+        for mailbox_path in mailbox_paths:
+            if not mailbox_path.is_dir():
+                continue
+            for entry in list(self._scan_emails(mailbox_path)):
+                path = self._email_paths(mailbox_path, entry.name[:-len(".json")])[0]
+                if entry.path == str(path):
+                    continue
+                path.parent.mkdir(exist_ok=True)
+                os.replace(entry.path, path)
+                directories.update((path.parent, Path(entry.path).parent))
+                moved += 1
+
+        for directory in list(directories):
+            if len(directory.name) == SHARD_WIDTH and not any(directory.iterdir()):
+                directory.rmdir()
+                directories.discard(directory)
+                directories.add(directory.parent)
+        for directory in directories:
+            if directory.is_dir():
+                _fsync_directory(directory)
+        return moved
+
+    def close(self) -> None:
+        """Rend durable le dernier lot et marque l'arrêt propre."""
+        self.commit()
+        self._mark_clean_shutdown()
+
+
+class ShardedFileMailStore(FileMailStore):
+    """
+    Stockage en fichiers dont les boîtes sont réparties en sous-dossiers
+    nommés par les SHARD_WIDTH premiers caractères de l'identifiant:
+    `emails/<préfixe>/<identifiant>.json`. Lister une boîte, ou y créer un
+    fichier, ne parcourt plus un seul dossier de centaines de milliers
+    d'entrées.
+
+    `TP4_migrate.py` convertit les boîtes existantes, dans un sens ou
+    dans l'autre.
+    """
+
+    name = "sharded"
+    sharded = True
+
+
+class _SegmentMailbox:
+    """
+    Boîte ouverte d'un SegmentMailStore: son index en mémoire, le segment
+    courant ouvert en ajout et les projections mmap des segments lus.
+    """
+
+    def __init__(self, directory: Path, segment_size: int) -> None:
+        self._directory = directory
+        self._segment_size = segment_size
+        self.entries: dict[str, SegmentEntry] = {}
+        self.size = 0
+        self._maps: dict[int, mmap.mmap] = {}
+
+        directory.mkdir(parents=True, exist_ok=True)
+        segment_sizes = {
+            int(path.stem): path.stat().st_size for path in directory.glob("*.seg")
+        }
+        self._segment = max(segment_sizes, default=0)
+        self._load_index(segment_sizes)
+
+        # Ajouts non synchronises, et fichiers crees dont l'entree du dossier ne l'est pas
+        self._dirty = False
+        self._directory_dirty = not segment_sizes
+
+        self._index_file = open(directory / _INDEX_FILENAME, "ab", buffering=0)
+        self._segment_file = open(self._segment_path(self._segment), "ab", buffering=0)
+        self._segment_end = self._segment_file.tell()
+
+    def _segment_path(self, segment: int) -> Path:
+        return self._directory / f"{segment:06d}.seg"
+
+    def _load_index(self, segment_sizes: dict[int, int]) -> None:
+        """
+        Charge l'index par mmap. Une entrée tronquée en fin de fichier, ou
+        désignant des octets absents de son segment, vient d'une écriture
+        interrompue: elle est ignorée, et l'index réécrit sans elle pour
+        qu'elle ne désigne pas plus tard des octets ajoutés depuis.
+        """
+        index_path = self._directory / _INDEX_FILENAME
+        try:
+            file = open(index_path, "rb")
+        except FileNotFoundError:
+            return
+
+        dropped = False
+        with file:
+            length = os.fstat(file.fileno()).st_size
+            usable = length - length % _INDEX_ENTRY.size
+            if usable:
+                with mmap.mmap(file.fileno(), usable, access=mmap.ACCESS_READ) as view:
+                    for digest, segment, offset, size, timestamp in _INDEX_ENTRY.iter_unpack(view):
+                        # Une reference designe les segments partages, verifies par leur propre index
+                        if (not segment & _SHARED_SEGMENT
+                                and offset + size > segment_sizes.get(segment, 0)):
+                            dropped = True
+                            continue
+                        email_id = digest.hex()
+                        if email_id not in self.entries:
+                            self.size += size
+                        self.entries[email_id] = (segment, offset, size, timestamp)
+
+        if dropped or usable != length:
+            temporary_path = index_path.with_suffix(".tmp")
+            with open(temporary_path, "wb") as file:
+                for email_id, (segment, offset, size, timestamp) in self.entries.items():
+                    file.write(
+                        _INDEX_ENTRY.pack(
+                            bytes.fromhex(email_id), segment, offset, size, timestamp
+                        )
+                    )
+            os.replace(temporary_path, index_path)
+
+    def append(self, email_id: str, data: bytes, timestamp: float) -> SegmentEntry:
+        """
+        Ajoute le courriel au segment courant, puis son entrée à l'index, et
+        retourne cette entrée. L'ajout n'est durable qu'après `sync`.
+        """
+        if self._segment_end and self._segment_end + len(data) > self._segment_size:
+            os.fsync(self._segment_file.fileno())
+            self._segment_file.close()
+            self._segment += 1
+            self._segment_file = open(self._segment_path(self._segment), "ab", buffering=0)
+            self._segment_end = 0
+            self._directory_dirty = True
+
+        offset = self._segment_end
+        self._segment_file.write(data)
+        self._segment_end += len(data)
+        entry = (self._segment, offset, len(data), timestamp)
+        self.add_entry(email_id, entry)
+        return entry
+
+    def add_entry(self, email_id: str, entry: SegmentEntry) -> None:
+        """
+        Ajoute l'entrée à l'index, sans écrire de courriel: directement pour
+        une référence aux segments partagés.
+        """
+        self._index_file.write(_INDEX_ENTRY.pack(bytes.fromhex(email_id), *entry))
+        self.entries[email_id] = entry
+        self.size += entry[2]
+        self._dirty = True
+
+    def sync(self) -> None:
+        """
+        Rend durables les ajouts depuis la dernière synchronisation: le
+        segment avant l'index, pour qu'une entrée durable ne désigne jamais
+        des octets perdus.
+        """
+        if not self._dirty:
+            return
+        os.fsync(self._segment_file.fileno())
+        os.fsync(self._index_file.fileno())
+        if self._directory_dirty:
+            _fsync_directory(self._directory)
+            self._directory_dirty = False
+        self._dirty = False
+
+    def read(self, entry: SegmentEntry) -> bytes:
+        """Découpe le courriel dans la projection de son segment."""
+        segment, offset, size, _ = entry
+        view = self._maps.get(segment)
+        # Le segment courant a pu grandir depuis sa projection
+        if view is None or offset + size > len(view):
+            if view is not None:
+                view.close()
+            with open(self._segment_path(segment), "rb") as file:
+                view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = view
+        return view[offset:offset + size]
+
+    def close(self) -> None:
+        self.sync()
+        for view in self._maps.values():
+            view.close()
+        self._maps.clear()
+        self._index_file.close()
+        self._segment_file.close()
+
+
+class SegmentMailStore(_DirectoryStore):
+    """
+    Stockage en segments: les courriels d'une boîte sont ajoutés bout à
+    bout dans des fichiers `segments/<numéro>.seg` d'au plus `segment_size`
+    octets, et un index d'entrées de taille fixe donne la position, la
+    longueur et l'horodatage de chacun.
+
+    La liste et les statistiques viennent de l'index; les courriels sont
+    découpés dans la projection mmap de leur segment, sans ouvrir de
+    fichier par courriel. `commit` synchronise une fois, par boîte
+    touchée, le segment courant et l'index.
+
+    Un courriel livré à plusieurs boîtes est ajouté aux segments partagés
+    du dossier SERVER_LOST_DIR; l'index de chaque destinataire n'en reçoit
+    qu'une référence.
+    """
+
+    name = "segments"
+
+    def __init__(self, data_dir: Path, segment_size: int = SEGMENT_SIZE) -> None:
+        super().__init__(data_dir)
+        self._segment_size = segment_size
+        self._mailboxes: collections.OrderedDict[str, _SegmentMailbox] = (
+            collections.OrderedDict()
+        )
+        # Les segments partages restent ouverts: toute boite peut y faire reference
+        self._shared: _SegmentMailbox | None = None
+
+    def _shared_mailbox(self) -> _SegmentMailbox:
+        """Retourne les segments partagés, ouverts au premier accès."""
+        if self._shared is None:
+            self._shared = _SegmentMailbox(
+                self._data_dir / gloutils.SERVER_LOST_DIR / _SHARED_DIRNAME,
+                self._segment_size,
+            )
+        return self._shared
+
+    def _read(self, mailbox: _SegmentMailbox, entry: SegmentEntry) -> bytes:
+        """Découpe le courriel de l'entrée, dans les segments partagés pour une référence."""
+        segment, offset, size, timestamp = entry
+        if segment & _SHARED_SEGMENT:
+            return self._shared_mailbox().read(
+                (segment & ~_SHARED_SEGMENT, offset, size, timestamp)
+            )
+        return mailbox.read(entry)
+
+    def _mailbox(self, username: str) -> _SegmentMailbox:
+        """Retourne la boîte ouverte, en fermant la moins récemment utilisée au besoin."""
+        key = username.lower()
+        mailbox = self._mailboxes.get(key)
+        if mailbox is not None:
+            self._mailboxes.move_to_end(key)
+            return mailbox
+
+        if len(self._mailboxes) >= MAX_OPEN_MAILBOXES:
+            # La boite fermee synchronise ses references: les segments partages d'abord
+            if self._shared is not None:
+                self._shared.sync()
+            self._mailboxes.popitem(last=False)[1].close()
+
+        if username == gloutils.SERVER_LOST_DIR:
+            directory = self._data_dir / gloutils.SERVER_LOST_DIR / _SEGMENTS_DIRNAME
+        else:
+            directory = self._data_dir / username / _SEGMENTS_DIRNAME
+        mailbox = _SegmentMailbox(directory, self._segment_size)
+        self._mailboxes[key] = mailbox
+        return mailbox
+
+    def create_mailbox(self, username: str) -> None:
+        """Crée la boîte, et le dossier de l'utilisateur au besoin."""
+        self._mailbox(username)
+
+    def deliver(
+        self, usernames: Sequence[str], email_id: str, data: bytes, timestamp: float
+    ) -> list[int | None]:
+        """
+        Ajoute le courriel aux boîtes: à ses segments pour une seule boîte,
+        aux segments partagés et par référence pour plusieurs. Retourne,
+        pour chaque boîte, la taille du courriel de même identifiant déjà
+        présent, ou None s'il est nouveau.
+
+        L'identifiant étant l'empreinte du contenu, un courriel déjà
+        présent n'est pas ajouté une seconde fois.
+        """
+        previous_sizes: list[int | None] = []
+        new_usernames = []
+        for username in usernames:
+            entry = self._mailbox(username).entries.get(email_id)
+            previous_sizes.append(None if entry is None else entry[2])
+            if entry is None:
+                new_usernames.append(username)
+
+        if len(new_usernames) == 1:
+            self._mailbox(new_usernames[0]).append(email_id, data, timestamp)
+        elif new_usernames:
+            shared = self._shared_mailbox()
+            segment, offset, size, _ = shared.entries.get(email_id) or shared.append(
+                email_id, data, timestamp
+            )
+            reference = (segment | _SHARED_SEGMENT, offset, size, timestamp)
+            for username in new_usernames:
+                self._mailbox(username).add_entry(email_id, reference)
+        return previous_sizes
+
+    def read(self, username: str, email_id: str) -> bytes | None:
+        """Retourne le courriel, ou None s'il n'est pas dans la boîte."""
+        mailbox = self._mailbox(username)
+        entry = mailbox.entries.get(email_id)
+        if entry is None:
+            return None
+        return self._read(mailbox, entry)
+
+    def iter_emails(self, username: str) -> Iterator[tuple[str, bytes]]:
+        """
+        Parcourt les identifiants et contenus des courriels de la boîte,
+        du plus ancien au plus récent selon l'horodatage de l'index.
+        """
+        mailbox = self._mailbox(username)
+        entries = sorted(mailbox.entries.items(), key=lambda item: item[1][3])
+        for email_id, entry in entries:
+            yield email_id, self._read(mailbox, entry)
+
+    def usage(self, username: str) -> tuple[int, int]:
+        """Retourne le nombre et la taille totale des courriels de la boîte."""
+        mailbox = self._mailbox(username)
+        return len(mailbox.entries), mailbox.size
+
+    def commit(self) -> None:
+        """
+        Rend durables les courriels livrés depuis le dernier lot: les
+        segments partagés d'abord, pour qu'une référence durable ne désigne
+        jamais un courriel perdu. Les mots de passe et les statistiques qui
+        les comptent sont écrits ensuite.
+        """
+        if self._shared is not None:
+            self._shared.sync()
+        for mailbox in self._mailboxes.values():
+            mailbox.sync()
+        for directory in self._write_staged():
+            _fsync_directory(directory)
+
+    def close(self) -> None:
+        """
+        Rend durable le dernier lot, ferme les fichiers et projections des
+        boîtes ouvertes et marque l'arrêt propre.
+        """
+        self.commit()
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+        for mailbox in self._mailboxes.values():
+            mailbox.close()
+        self._mailboxes.clear()
+        self._mark_clean_shutdown()
+
+
+class SqliteMailStore:
+    """
+    Stockage dans une base sqlite3 `<data_dir>/glo.sqlite3`, en mode WAL:
+    une table des comptes, avec leurs statistiques, une table des courriels
+    par identifiant, et une table des références de chaque boîte à ses
+    courriels, indexée par boîte et par date. Les courriels livrés depuis
+    le dernier lot, les comptes et les statistiques modifiés forment une
+    seule transaction, validée par `commit`.
+
+    La connexion est partagée entre les fils: le serveur n'y accède que
+    depuis un fil à la fois.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, data_dir: Path) -> None:
+        data_dir.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            data_dir / _SQLITE_FILENAME, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # En mode WAL, FULL synchronise le journal une fois par transaction validee
+        self._connection.execute("PRAGMA synchronous=FULL")
+        self._connection.executescript(_SQLITE_SCHEMA)
+        if self._connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'emails'"
+        ).fetchone():
+            self._connection.executescript(
+                f"BEGIN; {_SQLITE_MIGRATION} COMMIT;"
+            )
+
+    def load_accounts(self) -> Iterator[tuple[str, str]]:
+        """Parcourt les comptes: nom canonique et mot de passe haché."""
+        yield from self._connection.execute("SELECT username, password FROM accounts")
+
+    def save_account(self, username: str, password_hash: str) -> None:
+        """
+        Ajoute à la transaction du lot le mot de passe haché de
+        l'utilisateur, créant son compte au besoin.
+        """
+        self._connection.execute(
+            "INSERT INTO accounts (username, password) VALUES (?, ?) "
+            "ON CONFLICT (username) DO UPDATE SET password = excluded.password",
+            (username, password_hash),
+        )
+
+    def mailbox_exists(self, username: str) -> bool:
+        """Indique si un compte ou une boîte porte ce nom, sans égard à la casse."""
+        return self._connection.execute(
+            "SELECT 1 FROM accounts WHERE username = ? "
+            "UNION ALL SELECT 1 FROM mailboxes WHERE mailbox = ? LIMIT 1",
+            (username, username),
+        ).fetchone() is not None
+
+    def load_stats(self, username: str) -> gloutils.StatsPayload | None:
+        """Retourne les statistiques conservées, ou None si elles sont absentes."""
+        row = self._connection.execute(
+            "SELECT count, size FROM accounts WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None or row[0] is None or row[1] is None:
+            return None
+        return gloutils.StatsPayload(count=row[0], size=row[1])
+
+    def save_stats(self, username: str, stats: gloutils.StatsPayload) -> None:
+        """
+        Ajoute les statistiques de l'utilisateur à la transaction du lot:
+        elles sont validées avec les courriels qu'elles comptent.
+        """
+        self._connection.execute(
+            "UPDATE accounts SET count = ?, size = ? WHERE username = ?",
+            (stats["count"], stats["size"], username),
+        )
+
+    def recover(self) -> list[str]:
+        """Une transaction interrompue est annulée par sqlite: rien à reconstruire."""
+        return []
+
+    def create_mailbox(self, username: str) -> None:
+        """Les boîtes n'existent que par leurs courriels: rien à créer."""
+
+    def deliver(
+        self, usernames: Sequence[str], email_id: str, data: bytes, timestamp: float
+    ) -> list[int | None]:
+        """
+        Ajoute à la transaction du lot le courriel, une seule fois, et sa
+        référence dans chaque boîte. Retourne, pour chaque boîte, la taille
+        du courriel de même identifiant déjà présent, ou None s'il est
+        nouveau.
+
+        L'identifiant étant l'empreinte du contenu, un courriel déjà
+        présent n'est pas écrit une seconde fois.
+        """
+        self._connection.execute(
+            "INSERT OR IGNORE INTO bodies (email_id, data) VALUES (?, ?)",
+            (email_id, data),
+        )
+        previous_sizes: list[int | None] = []
+        for username in usernames:
+            row = self._connection.execute(
+                "SELECT 1 FROM mailboxes WHERE mailbox = ? AND email_id = ?",
+                (username, email_id),
+            ).fetchone()
+            if row is not None:
+                previous_sizes.append(len(data))
+                continue
+            self._connection.execute(
+                "INSERT INTO mailboxes (mailbox, email_id, timestamp) VALUES (?, ?, ?)",
+                (username, email_id, timestamp),
+            )
+            previous_sizes.append(None)
+        return previous_sizes
+
+    def read(self, username: str, email_id: str) -> bytes | None:
+        """Retourne le courriel, ou None s'il n'est pas dans la boîte."""
+        row = self._connection.execute(
+            "SELECT data FROM mailboxes JOIN bodies USING (email_id) "
+            "WHERE mailbox = ? AND email_id = ?",
+            (username, email_id),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def iter_emails(self, username: str) -> Iterator[tuple[str, bytes]]:
+        """
+        Parcourt les identifiants et contenus des courriels de la boîte,
+        du plus ancien au plus récent.
+        """
+        yield from self._connection.execute(
+            "SELECT email_id, data FROM mailboxes JOIN bodies USING (email_id) "
+            "WHERE mailbox = ? ORDER BY timestamp",
+            (username,),
+        ).fetchall()
+
+    def usage(self, username: str) -> tuple[int, int]:
+        """Retourne le nombre et la taille totale des courriels de la boîte."""
+        count, size = self._connection.execute(
+            "SELECT count(*), coalesce(sum(length(data)), 0) "
+            "FROM mailboxes JOIN bodies USING (email_id) WHERE mailbox = ?",
+            (username,),
+        ).fetchone()
+        return count, size
+
+    def commit(self) -> None:
+        """Valide la transaction des courriels livrés depuis le dernier lot."""
+        self._connection.commit()
+
+    def close(self) -> None:
+        """Valide le dernier lot et ferme la connexion à la base."""
+        self._connection.commit()
+        self._connection.close()
+
+
+class MemoryMailStore:
+    """
+    Stockage en mémoire, perdu à l'arrêt du serveur: pour les tests et les
+    mesures, sans coût d'entrée-sortie. `data_dir` est ignoré. Les boîtes
+    des destinataires d'un même courriel en partagent l'objet `bytes`.
+    """
+
+    name = "memory"
+
+    def __init__(self, data_dir: Path) -> None:
+        self._accounts: dict[str, tuple[str, str]] = {}
+        self._stats: dict[str, gloutils.StatsPayload] = {}
+        self._mailboxes: dict[str, dict[str, tuple[float, bytes]]] = {}
+
+    def load_accounts(self) -> Iterator[tuple[str, str]]:
+        """Parcourt les comptes: nom canonique et mot de passe haché."""
+        yield from list(self._accounts.values())
+
+    def save_account(self, username: str, password_hash: str) -> None:
+        """Conserve le mot de passe haché de l'utilisateur, créant son compte au besoin."""
+        self._accounts[username.lower()] = (username, password_hash)
+
+    def mailbox_exists(self, username: str) -> bool:
+        """Indique si un compte ou une boîte porte ce nom, sans égard à la casse."""
+        key = username.lower()
+        return key in self._accounts or key in self._mailboxes
+
+    def load_stats(self, username: str) -> gloutils.StatsPayload | None:
+        """Retourne une copie des statistiques conservées, ou None si elles sont absentes."""
+        stats = self._stats.get(username.lower())
+        return None if stats is None else gloutils.StatsPayload(**stats)
+
+    def save_stats(self, username: str, stats: gloutils.StatsPayload) -> None:
+        """Conserve une copie des statistiques de l'utilisateur."""
+        self._stats[username.lower()] = gloutils.StatsPayload(**stats)
+
+    def recover(self) -> list[str]:
+        """Rien ne survit à un arrêt: rien à reconstruire."""
+        return []
+
+    def create_mailbox(self, username: str) -> None:
+        """Crée la boîte vide de l'utilisateur."""
+        self._mailboxes.setdefault(username.lower(), {})
+
+    def deliver(
+        self, usernames: Sequence[str], email_id: str, data: bytes, timestamp: float
+    ) -> list[int | None]:
+        """
+        Ajoute le courriel aux boîtes. Retourne, pour chaque boîte, la
+        taille du courriel de même identifiant qu'il remplace, ou None s'il
+        est nouveau.
+        """
+        previous_sizes: list[int | None] = []
+        for username in usernames:
+            mailbox = self._mailboxes.setdefault(username.lower(), {})
+            previous = mailbox.get(email_id)
+            mailbox[email_id] = (timestamp, data)
+            previous_sizes.append(None if previous is None else len(previous[1]))
+        return previous_sizes
+
+    def read(self, username: str, email_id: str) -> bytes | None:
+        """Retourne le courriel, ou None s'il n'est pas dans la boîte."""
+        email = self._mailboxes.get(username.lower(), {}).get(email_id)
+        return None if email is None else email[1]
+
+    def iter_emails(self, username: str) -> Iterator[tuple[str, bytes]]:
+        """Parcourt les identifiants et contenus des courriels de la boîte."""
+        for email_id, (_, data) in list(self._mailboxes.get(username.lower(), {}).items()):
+            yield email_id, data
+
+    def usage(self, username: str) -> tuple[int, int]:
+        """Retourne le nombre et la taille totale des courriels de la boîte."""
+        mailbox = self._mailboxes.get(username.lower(), {})
+        return len(mailbox), sum(len(data) for _, data in mailbox.values())
+
+    def commit(self) -> None:
+        """Rien à synchroniser: les courriels sont conservés dès leur livraison."""
+
+    def close(self) -> None:
+        """Rien à libérer: le contenu est perdu avec le stockage."""
+
+
+
+# Moteurs de stockage disponibles, par nom.
+MAIL_STORES: dict[str, type[MailStore]] = {
+    FileMailStore.name: FileMailStore,
+    ShardedFileMailStore.name: ShardedFileMailStore,
+    SegmentMailStore.name: SegmentMailStore,
+    SqliteMailStore.name: SqliteMailStore,
+    MemoryMailStore.name: MemoryMailStore,
+}
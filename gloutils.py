@@ -11,6 +11,9 @@ SERVER_DATA_DIR = "glo_server_data"
 SERVER_LOST_DIR = "LOST"
 SERVER_DOMAIN = "glo2000.ca"
 PASSWORD_FILENAME = "pass"  # nosec:B105
+STATS_FILENAME = "stats"
+EMAIL_LIST_PAGE_SIZE = 20
+NEW_MAIL_FEATURE = "new_mail"
 
 CLIENT_AUTH_CHOICE = """Menu de connexion
 1. Créer un compte
@@ -32,6 +35,8 @@ Date : {date}
 {body}
 """
 
+NEW_MAIL_DISPLAY = "Nouveau courriel de {sender} : {subject}"
+
 STATS_DISPLAY = """Nombre de messages : {count}
 Taille du dossier : {size} octets"""
 
@@ -55,6 +60,16 @@ class Headers(enum.IntEnum):
 
     STATS_REQUEST = enum.auto()
 
+    HELLO = enum.auto()
+
+    EMAIL_BATCH_SENDING = enum.auto()
+
+    NOT_MODIFIED = enum.auto()
+
+    NEW_MAIL = enum.auto()
+
+    AUTH_RESUME = enum.auto()
+
 
 class ErrorPayload(TypedDict, total=True):
     """Payload pour les messages d'erreurs."""
@@ -68,17 +83,44 @@ class AuthPayload(TypedDict, total=True):
 
 
 class EmailContentPayload(TypedDict, total=True):
-    """Payload pour les transferts de courriels."""
+    """
+    Payload pour les transferts de courriels.
+
+    `destination` est une adresse, ou la liste des adresses des
+    destinataires d'un même envoi.
+    """
     sender: str
-    destination: str
+    destination: str | list[str]
     subject: str
     date: str
     content: str
 
 
+class EmailListRequestPayload(TypedDict, total=False):
+    """
+    Payload optionnel pour la demande de la liste de courriels.
+
+    Sans payload, la liste complète est demandée. `since_version` donne
+    la version de la dernière liste reçue: si la boîte n'a pas changé
+    depuis, le serveur répond par l'entête NOT_MODIFIED.
+    """
+    offset: int
+    limit: int
+    since_version: int
+
+
 class EmailListPayload(TypedDict, total=True):
-    """Payload pour les consulation de courriel."""
+    """
+    Payload pour les consulation de courriel.
+
+    `email_ids` donne, dans le même ordre que `email_list`,
+    l'identifiant stable de chaque courriel, et `version` la version
+    de la boîte au moment de la liste.
+    """
     email_list: list[str]
+    email_ids: list[str]
+    total: int
+    version: int
 
 
 class EmailChoicePayload(TypedDict, total=True):
@@ -86,12 +128,70 @@ class EmailChoicePayload(TypedDict, total=True):
     choice: int
 
 
+class EmailIdChoicePayload(TypedDict, total=True):
+    """Payload pour le choix du courriel à consulter par son identifiant."""
+    email_id: str
+
+
 class StatsPayload(TypedDict, total=True):
     """Payload pour les statistiques."""
     count: int
     size: int
 
 
+class HelloPayload(TypedDict, total=False):
+    """
+    Payload pour la négociation des options de connexion.
+
+    Le client énumère les codecs et les compressions qu'il accepte, par
+    ordre de préférence; le serveur répond avec ceux qu'il retient, seuls
+    dans leur liste (vide si aucune compression n'est retenue).
+
+    `features` énumère les fonctionnalités optionnelles demandées, comme
+    NEW_MAIL_FEATURE; le serveur répond avec celles qu'il active.
+    """
+    codecs: list[str]
+    compression: list[str]
+    features: list[str]
+
+
+class EmailBatchPayload(TypedDict, total=True):
+    """Payload pour l'envoi d'un lot de courriels en une seule requête."""
+    emails: list[EmailContentPayload]
+
+
+class EmailBatchResultPayload(TypedDict, total=True):
+    """
+    Payload de réponse à l'envoi d'un lot.
+
+    `results` donne, dans l'ordre du lot, le message qu'aurait retourné
+    l'envoi de chaque courriel avec l'entête EMAIL_SENDING.
+    """
+    results: list["GloMessage"]
+
+
+class NewMailPayload(TypedDict, total=True):
+    """
+    Payload de l'entête NEW_MAIL, transmis par le serveur sans requête
+    aux sessions ayant demandé NEW_MAIL_FEATURE lors d'une livraison.
+    """
+    email_id: str
+    sender: str
+    subject: str
+    date: str
+
+
+class ResumptionPayload(TypedDict, total=True):
+    """
+    Payload du jeton de reprise de session.
+
+    Le serveur le joint à la réponse OK d'une connexion, d'une création de
+    compte ou d'une reprise; le client le présente avec l'entête AUTH_RESUME
+    pour retrouver sa session sans s'authentifier à nouveau.
+    """
+    token: str
+
+
 class GloMessage(TypedDict, total=False):
     """
     Classe à utiliser pour générer des messages.
@@ -101,7 +201,11 @@ class GloMessage(TypedDict, total=False):
     """
     header: Headers
     payload: Union[ErrorPayload, AuthPayload, EmailContentPayload,
-                   EmailListPayload, EmailChoicePayload, StatsPayload]
+                   EmailListRequestPayload, EmailListPayload,
+                   EmailChoicePayload, EmailIdChoicePayload,
+                   StatsPayload, HelloPayload, EmailBatchPayload,
+                   EmailBatchResultPayload, NewMailPayload,
+                   ResumptionPayload]
 
 
 def get_current_utc_time() -> str:
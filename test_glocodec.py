@@ -0,0 +1,82 @@
+"""\
+GLO-2000 Travail pratique 4 - Tests des codecs 2025
+Noms et numéros étudiants:
+- Samuel Blanchette 111 159 329
+- Wiseley Paul Enzer Petiton 537 047 716
+- Jacob Provencher 111 272 785
+"""
+
+import pytest
+
+import glocodec
+import gloutils
+
+
+MESSAGES = [
+    gloutils.GloMessage(header=gloutils.Headers.NOT_MODIFIED),
+    gloutils.GloMessage(
+        header=gloutils.Headers.ERROR,
+        payload=gloutils.ErrorPayload(error_message="Échec: ça n'a pas marché."),
+    ),
+    gloutils.GloMessage(
+        header=gloutils.Headers.OK,
+        payload=gloutils.EmailListPayload(
+            email_list=["#1 bob - sujet", "#2 éloïse - été"],
+            email_ids=["a" * 64, "b" * 64],
+            total=2,
+            version=2**62,
+        ),
+    ),
+    gloutils.GloMessage(
+        header=gloutils.Headers.OK,
+        payload=gloutils.EmailListPayload(
+            email_list=[], email_ids=[], total=0, version=-1
+        ),
+    ),
+    gloutils.GloMessage(
+        header=gloutils.Headers.EMAIL_SENDING,
+        payload=gloutils.EmailContentPayload(
+            sender="bob@glo2000.ca",
+            destination=["alice@glo2000.ca", "carol@glo2000.ca"],
+            subject="sujet",
+            date="Mon, 06 Oct 2025 12:00:00 +0000",
+            content="x" * 100_000,
+        ),
+    ),
+    # Valeurs sans champ connu: nom inline, flottant, booleens et None
+    gloutils.GloMessage(
+        header=gloutils.Headers.OK,
+        payload={"inconnu": [1.5, True, False, None, ["imbriquée"]]},
+    ),
+]
+
+
+@pytest.mark.parametrize("codec", list(glocodec.CODECS.values()), ids=list(glocodec.CODECS))
+@pytest.mark.parametrize("message", MESSAGES)
+def test_round_trip(codec, message):
+    assert codec.decode(codec.encode(message)) == message
+
+
+@pytest.mark.parametrize("codec", list(glocodec.CODECS.values()), ids=list(glocodec.CODECS))
+def test_decode_accepts_memoryview(codec):
+    message = MESSAGES[2]
+    assert codec.decode(memoryview(codec.encode(message))) == message
+
+
+@pytest.mark.parametrize("codec", list(glocodec.CODECS.values()), ids=list(glocodec.CODECS))
+def test_truncated_message_is_rejected(codec):
+    data = codec.encode(MESSAGES[2])
+    with pytest.raises(glocodec.CodecError):
+        codec.decode(data[:len(data) // 2])
+
+
+def test_binary_rejects_trailing_data():
+    data = glocodec.BINARY_CODEC.encode(MESSAGES[1])
+    with pytest.raises(glocodec.CodecError):
+        glocodec.BINARY_CODEC.decode(data + b"\x00")
+
+
+def test_choose_codec():
+    assert glocodec.choose_codec(["inconnu", "json", "binary"]) is glocodec.JSON_CODEC
+    assert glocodec.choose_codec(["binary"]) is glocodec.BINARY_CODEC
+    assert glocodec.choose_codec([]) is glocodec.JSON_CODEC
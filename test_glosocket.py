@@ -0,0 +1,95 @@
+"""\
+GLO-2000 Travail pratique 4 - Tests du tramage des messages 2025
+Noms et numéros étudiants:
+- Samuel Blanchette 111 159 329
+- Wiseley Paul Enzer Petiton 537 047 716
+- Jacob Provencher 111 272 785
+"""
+
+import os
+import socket
+import struct
+import zlib
+
+import pytest
+
+import glosocket
+
+
+LARGE = b"courriel " * 1000
+
+
+def test_small_frame_is_not_compressed():
+    frame = glosocket.encode_frame(b"court", compress=True)
+    assert frame == struct.pack("!I", 5) + b"court"
+
+
+def test_compressed_frame_round_trip():
+    frame = glosocket.encode_frame(LARGE, compress=True)
+    length, = struct.unpack_from("!I", frame)
+    assert length & 0x80000000
+    assert len(frame) < len(LARGE)
+    assert glosocket.decode_frames(bytearray(frame)) == [LARGE]
+
+
+def test_incompressible_frame_is_sent_as_is():
+    # Des octets aleatoires ne sont pas raccourcis par zlib
+    data = os.urandom(2 * glosocket.COMPRESSION_THRESHOLD)
+    assert glosocket.encode_frame(data, compress=True) == glosocket.encode_frame(data)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_decode_frames_byte_by_byte(compress):
+    stream = b"".join(
+        glosocket.encode_frame(data, compress=compress)
+        for data in (b"un", LARGE, b"", b"trois")
+    )
+
+    buffer = bytearray()
+    frames = []
+    for index in range(len(stream)):
+        buffer += stream[index:index + 1]
+        frames += glosocket.decode_frames(buffer)
+
+    assert frames == [b"un", LARGE, b"", b"trois"]
+    assert buffer == bytearray()
+
+
+def test_decode_frames_keeps_partial_frame():
+    stream = glosocket.encode_frame(b"un") + glosocket.encode_frame(b"deux")
+    buffer = bytearray(stream[:-2])
+
+    assert glosocket.decode_frames(buffer) == [b"un"]
+    assert buffer == bytearray(stream[len(glosocket.encode_frame(b"un")):-2])
+
+    buffer += stream[-2:]
+    assert glosocket.decode_frames(buffer) == [b"deux"]
+    assert buffer == bytearray()
+
+
+def test_decode_frames_rejects_oversized_length():
+    buffer = bytearray(struct.pack("!I", 1000))
+    with pytest.raises(glosocket.GLOSocketError):
+        glosocket.decode_frames(buffer, max_size=999)
+
+
+def test_decompression_is_bounded():
+    frame = glosocket.encode_frame(bytes(100_000), compress=True)
+    with pytest.raises(glosocket.GLOSocketError):
+        glosocket.decode_frames(bytearray(frame), max_size=1000)
+
+
+def test_truncated_compressed_data_is_rejected():
+    compressed = zlib.compress(LARGE)[:-4]
+    buffer = bytearray(struct.pack("!I", len(compressed) | 0x80000000) + compressed)
+    with pytest.raises(glosocket.GLOSocketError):
+        glosocket.decode_frames(buffer)
+
+
+def test_send_and_recv_frame():
+    left, right = socket.socketpair()
+    with left, right:
+        glosocket.send_frame(left, LARGE, compress=True)
+        glosocket.send_mesg(left, "été")
+        assert bytes(glosocket.recv_frame(right)) == LARGE
+        assert glosocket.recv_mesg(right) == "été"
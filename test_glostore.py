@@ -0,0 +1,364 @@
+"""\
+GLO-2000 Travail pratique 4 - Tests des stockages 2025
+Noms et numéros étudiants:
+- Samuel Blanchette 111 159 329
+- Wiseley Paul Enzer Petiton 537 047 716
+- Jacob Provencher 111 272 785
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+
+import pytest
+
+import glostore
+import gloutils
+import TP4_migrate
+
+
+# Stockages dont le contenu survit a leur fermeture.
+PERSISTENT_STORES = [
+    name for name in glostore.MAIL_STORES if name != glostore.MemoryMailStore.name
+]
+
+# Stockages conservant comptes et statistiques dans un dossier par utilisateur.
+DIRECTORY_STORES = [
+    glostore.FileMailStore.name,
+    glostore.ShardedFileMailStore.name,
+    glostore.SegmentMailStore.name,
+]
+
+
+def make_email(text: str) -> tuple[str, bytes]:
+    """Retourne l'identifiant et le contenu d'un courriel de test."""
+    data = f'{{"subject": "{text}"}}'.encode("utf-8")
+    return hashlib.sha256(data).hexdigest(), data
+
+
+def open_store(name: str, data_dir, **kwargs) -> glostore.MailStore:
+    return glostore.MAIL_STORES[name](data_dir, **kwargs)
+
+
+@pytest.fixture(params=list(glostore.MAIL_STORES))
+def store(request, tmp_path):
+    store = open_store(request.param, tmp_path)
+    store.create_mailbox("alice")
+    store.create_mailbox("bob")
+    yield store
+    store.close()
+
+
+def test_store_implements_interface(store):
+    assert isinstance(store, glostore.MailStore)
+
+
+def test_deliver_and_read(store):
+    email_id, data = make_email("un")
+    assert store.deliver(["alice"], email_id, data, 1.0) == [None]
+    assert store.read("alice", email_id) == data
+    assert store.read("bob", email_id) is None
+    assert store.usage("alice") == (1, len(data))
+    assert list(store.iter_emails("alice")) == [(email_id, data)]
+
+
+def test_deliver_to_several_mailboxes(store):
+    email_id, data = make_email("un")
+    assert store.deliver(["alice", "bob"], email_id, data, 1.0) == [None, None]
+    store.commit()
+    assert store.read("alice", email_id) == data
+    assert store.read("bob", email_id) == data
+    assert store.usage("bob") == (1, len(data))
+
+
+def test_redelivery_reports_previous_size(store):
+    email_id, data = make_email("un")
+    store.deliver(["alice"], email_id, data, 1.0)
+    store.commit()
+    assert store.deliver(["alice", "bob"], email_id, data, 1.0) == [len(data), None]
+    assert store.usage("alice") == (1, len(data))
+
+
+def test_accounts_and_stats(store):
+    store.save_account("Alice", "hash")
+    store.save_stats("Alice", gloutils.StatsPayload(count=2, size=10))
+    store.commit()
+    assert ("Alice", "hash") in list(store.load_accounts())
+    assert store.load_stats("Alice") == {"count": 2, "size": 10}
+    assert store.load_stats("Carol") is None
+
+
+@pytest.mark.parametrize("name", PERSISTENT_STORES)
+def test_persistence_across_reopen(name, tmp_path):
+    first_id, first_data = make_email("un")
+    second_id, second_data = make_email("deux")
+    store = open_store(name, tmp_path)
+    for username in ("alice", "bob"):
+        store.save_account(username, f"hash-{username}")
+        store.create_mailbox(username)
+    store.deliver(["alice"], first_id, first_data, 1.0)
+    store.deliver(["alice", "bob"], second_id, second_data, 2.0)
+    store.save_stats(
+        "alice", gloutils.StatsPayload(count=2, size=len(first_data) + len(second_data))
+    )
+    store.commit()
+    store.close()
+
+    store = open_store(name, tmp_path)
+    assert sorted(store.load_accounts()) == [("alice", "hash-alice"), ("bob", "hash-bob")]
+    assert store.load_stats("alice") == {
+        "count": 2, "size": len(first_data) + len(second_data)
+    }
+    assert sorted(store.iter_emails("alice")) == sorted(
+        [(first_id, first_data), (second_id, second_data)]
+    )
+    assert store.read("bob", second_id) == second_data
+    store.close()
+
+
+@pytest.mark.parametrize("name", DIRECTORY_STORES)
+def test_accounts_and_stats_are_written_by_commit(name, tmp_path):
+    store = open_store(name, tmp_path)
+    store.save_account("alice", "hash")
+    store.save_stats("alice", gloutils.StatsPayload(count=1, size=5))
+    password_path = tmp_path / "alice" / f"{gloutils.PASSWORD_FILENAME}.json"
+    stats_path = tmp_path / "alice" / f"{gloutils.STATS_FILENAME}.json"
+    assert not password_path.exists()
+    assert not stats_path.exists()
+    assert store.load_stats("alice") == {"count": 1, "size": 5}
+    store.commit()
+    assert password_path.exists()
+    assert stats_path.exists()
+    assert not list((tmp_path / "alice").glob("*.tmp"))
+
+    # Le remplacement d'un mot de passe passe lui aussi par un fichier renomme en place
+    store.save_account("alice", "nouveau")
+    store.commit()
+    assert list(store.load_accounts()) == [("alice", "nouveau")]
+    store.close()
+
+
+@pytest.mark.parametrize("name", DIRECTORY_STORES)
+def test_recover_without_clean_shutdown(name, tmp_path):
+    store = open_store(name, tmp_path)
+    store.save_account("alice", "hash")
+    store.commit()
+    # Sans recover, la fermeture ne marque pas d'arret propre
+    store.close()
+
+    store = open_store(name, tmp_path)
+    assert store.recover() == ["alice"]
+    store.close()
+
+    store = open_store(name, tmp_path)
+    assert store.recover() == []
+    store.close()
+
+
+@pytest.mark.parametrize("name", DIRECTORY_STORES)
+def test_negative_stats_are_ignored(name, tmp_path):
+    store = open_store(name, tmp_path)
+    store.save_account("alice", "hash")
+    store.save_stats("alice", gloutils.StatsPayload(count=-1, size=5))
+    store.close()
+
+    store = open_store(name, tmp_path)
+    assert store.load_stats("alice") is None
+    store.close()
+
+
+def test_sqlite_recover_has_nothing_to_rebuild(tmp_path):
+    store = open_store(glostore.SqliteMailStore.name, tmp_path)
+    assert store.recover() == []
+    store.close()
+
+
+@pytest.mark.parametrize(
+    "name", [glostore.FileMailStore.name, glostore.ShardedFileMailStore.name]
+)
+def test_files_hard_link_shared_email(name, tmp_path):
+    email_id, data = make_email("un")
+    store = open_store(name, tmp_path)
+    store.create_mailbox("alice")
+    store.create_mailbox("bob")
+    store.deliver(["alice", "bob"], email_id, data, 1.0)
+    store.commit()
+
+    paths = [
+        store._find_email(store._mailbox_path(username), email_id)
+        for username in ("alice", "bob")
+    ]
+    stats = [os.stat(path) for path in paths]
+    assert stats[0].st_ino == stats[1].st_ino
+    assert stats[0].st_nlink == 2
+    assert not list(tmp_path.rglob("*.tmp"))
+    store.close()
+
+
+def test_files_recover_removes_interrupted_batch(tmp_path):
+    email_id, data = make_email("un")
+    store = open_store(glostore.FileMailStore.name, tmp_path)
+    store.save_account("alice", "hash")
+    store.create_mailbox("alice")
+    store.recover()
+    store.close()
+
+    # Un arret brutal apres la livraison, avant le commit du lot
+    store = open_store(glostore.FileMailStore.name, tmp_path)
+    store.recover()
+    store.deliver(["alice"], email_id, data, 1.0)
+    temporary_path = tmp_path / "alice" / "emails" / f"{email_id}.tmp"
+    assert temporary_path.exists()
+    del store
+
+    store = open_store(glostore.FileMailStore.name, tmp_path)
+    assert store.recover() == ["alice"]
+    assert not temporary_path.exists()
+    assert store.usage("alice") == (0, 0)
+    store.close()
+
+
+def test_segments_ignore_torn_index_entry(tmp_path):
+    email_id, data = make_email("un")
+    store = open_store(glostore.SegmentMailStore.name, tmp_path)
+    store.deliver(["alice"], email_id, data, 1.0)
+    store.close()
+
+    index_path = tmp_path / "alice" / "segments" / "index"
+    with open(index_path, "ab") as file:
+        file.write(b"\0" * (glostore._INDEX_ENTRY.size // 2))
+
+    store = open_store(glostore.SegmentMailStore.name, tmp_path)
+    assert store.usage("alice") == (1, len(data))
+    assert index_path.stat().st_size == glostore._INDEX_ENTRY.size
+    store.close()
+
+
+def test_segments_drop_entries_past_segment_end(tmp_path):
+    first_id, first_data = make_email("un")
+    second_id, second_data = make_email("deux")
+    store = open_store(glostore.SegmentMailStore.name, tmp_path)
+    store.deliver(["alice"], first_id, first_data, 1.0)
+    store.deliver(["alice"], second_id, second_data, 2.0)
+    store.close()
+
+    # L'index a ete ecrit, mais pas la fin du segment
+    segment_path = tmp_path / "alice" / "segments" / "000000.seg"
+    with open(segment_path, "r+b") as file:
+        file.truncate(len(first_data) + 1)
+
+    store = open_store(glostore.SegmentMailStore.name, tmp_path)
+    assert list(store.iter_emails("alice")) == [(first_id, first_data)]
+
+    # Un nouvel ajout n'est pas confondu avec l'entree retiree
+    third_id, third_data = make_email("trois")
+    store.deliver(["alice"], third_id, third_data, 3.0)
+    store.close()
+
+    store = open_store(glostore.SegmentMailStore.name, tmp_path)
+    assert store.read("alice", second_id) is None
+    assert store.read("alice", third_id) == third_data
+    store.close()
+
+
+def test_segments_roll_over(tmp_path):
+    emails = [make_email(str(index)) for index in range(5)]
+    store = open_store(glostore.SegmentMailStore.name, tmp_path, segment_size=64)
+    for index, (email_id, data) in enumerate(emails):
+        store.deliver(["alice"], email_id, data, float(index))
+    store.close()
+
+    assert len(list((tmp_path / "alice" / "segments").glob("*.seg"))) > 1
+    store = open_store(glostore.SegmentMailStore.name, tmp_path, segment_size=64)
+    assert list(store.iter_emails("alice")) == emails
+    store.close()
+
+
+def test_sqlite_migrates_emails_table(tmp_path):
+    email_id, data = make_email("un")
+    connection = sqlite3.connect(tmp_path / glostore._SQLITE_FILENAME)
+    connection.executescript(
+        """
+        CREATE TABLE accounts (
+            username TEXT PRIMARY KEY COLLATE NOCASE,
+            password TEXT NOT NULL,
+            count INTEGER,
+            size INTEGER
+        );
+        CREATE TABLE emails (
+            mailbox TEXT NOT NULL COLLATE NOCASE,
+            email_id TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (mailbox, email_id)
+        );
+        """
+    )
+    connection.executemany(
+        "INSERT INTO emails VALUES (?, ?, ?, ?)",
+        [("alice", email_id, 1.0, data), ("bob", email_id, 1.0, data)],
+    )
+    connection.commit()
+    connection.close()
+
+    store = open_store(glostore.SqliteMailStore.name, tmp_path)
+    assert store.read("alice", email_id) == data
+    assert store.read("bob", email_id) == data
+    assert store._connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'emails'"
+    ).fetchone() is None
+    assert store._connection.execute("SELECT count(*) FROM bodies").fetchone() == (1,)
+    store.close()
+
+
+def test_migrate_between_layouts(tmp_path, monkeypatch):
+    emails = [make_email(str(index)) for index in range(3)]
+    store = open_store(glostore.FileMailStore.name, tmp_path)
+    store.create_mailbox("alice")
+    for index, (email_id, data) in enumerate(emails):
+        store.deliver(["alice"], email_id, data, float(index))
+    store.close()
+
+    def migrate(layout: str) -> None:
+        monkeypatch.setattr(
+            sys, "argv", ["TP4_migrate.py", "--layout", layout, "--data-dir", str(tmp_path)]
+        )
+        assert TP4_migrate._main() == 0
+
+    mailbox_path = tmp_path / "alice" / "emails"
+    migrate(glostore.ShardedFileMailStore.name)
+    for email_id, _ in emails:
+        assert (mailbox_path / email_id[:glostore.SHARD_WIDTH] / f"{email_id}.json").exists()
+    store = open_store(glostore.ShardedFileMailStore.name, tmp_path)
+    assert sorted(store.iter_emails("alice")) == sorted(emails)
+    store.close()
+
+    migrate(glostore.FileMailStore.name)
+    assert sorted(path.name for path in mailbox_path.iterdir()) == sorted(
+        f"{email_id}.json" for email_id, _ in emails
+    )
+    store = open_store(glostore.FileMailStore.name, tmp_path)
+    assert sorted(store.iter_emails("alice")) == sorted(emails)
+    store.close()
+
+
+def test_mailbox_exists(store):
+    store.save_account("carol", "hash")
+    store.commit()
+    assert store.mailbox_exists("Carol")
+    assert not store.mailbox_exists("dave")
+
+
+@pytest.mark.parametrize("name", DIRECTORY_STORES)
+def test_mailbox_exists_without_password(name, tmp_path):
+    store = open_store(name, tmp_path)
+    store.save_account("Alice", "hash")
+    store.create_mailbox("Alice")
+    store.close()
+    (tmp_path / "Alice" / f"{gloutils.PASSWORD_FILENAME}.json").write_text("")
+
+    store = open_store(name, tmp_path)
+    assert list(store.load_accounts()) == []
+    assert store.mailbox_exists("alice")
+    store.close()
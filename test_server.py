@@ -0,0 +1,184 @@
+"""\
+GLO-2000 Travail pratique 4 - Tests du serveur 2025
+Noms et numéros étudiants:
+- Samuel Blanchette 111 159 329
+- Wiseley Paul Enzer Petiton 537 047 716
+- Jacob Provencher 111 272 785
+"""
+
+import hashlib
+import json
+
+import pytest
+
+import glostore
+import gloutils
+import TP4_server
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = TP4_server.Server(
+        storage=glostore.FileMailStore.name, data_dir=str(tmp_path), listen=False
+    )
+    yield server
+    server.cleanup()
+
+
+def register(server: TP4_server.Server, username: str) -> object:
+    """
+    Crée le compte et retourne la clé de sa session. Sans tampon d'envoi,
+    le serveur ne transmet rien à cette clé: les réponses sont les valeurs
+    retournées par ses traitements.
+    """
+    client = object()
+    server._finish_create_account(client, username, "haché")
+    server._commit_deliveries()
+    return client
+
+
+def make_payload(subject: str, date: str = "Mon, 06 Oct 2025 12:00:00 +0000"):
+    return gloutils.EmailContentPayload(
+        sender=f"bob@{gloutils.SERVER_DOMAIN}",
+        destination=f"alice@{gloutils.SERVER_DOMAIN}",
+        subject=subject,
+        date=date,
+        content="contenu",
+    )
+
+
+def test_legacy_email_id_is_opaque(server, tmp_path):
+    client = register(server, "alice")
+
+    # Un courriel du serveur d'origine porte l'empreinte de l'expediteur et de la date
+    payload = make_payload("ancien")
+    legacy_id = hashlib.sha256(
+        f"{payload['sender']}_{payload['date']}".encode("utf-8")
+    ).hexdigest()
+    (tmp_path / "alice" / "emails" / f"{legacy_id}.json").write_text(
+        json.dumps(payload), encoding="utf-8"
+    )
+
+    reply = server._get_email_list(client)
+    assert reply["payload"]["email_ids"] == [legacy_id]
+
+    reply = server._get_email(client, gloutils.EmailIdChoicePayload(email_id=legacy_id))
+    assert reply["header"] == gloutils.Headers.OK
+    assert reply["payload"]["subject"] == "ancien"
+
+    # Le meme contenu, relivre, recoit l'empreinte de son contenu: les deux sont indexes
+    assert server._deliver_email(payload)["header"] == gloutils.Headers.OK
+    server._commit_deliveries()
+    email_id, _ = TP4_server.encode_email(payload)
+    reply = server._get_email_list(client)
+    assert sorted(reply["payload"]["email_ids"]) == sorted([legacy_id, email_id])
+    assert reply["payload"]["total"] == 2
+
+
+def test_batch_in_same_second_keeps_every_email(server):
+    client = register(server, "alice")
+    emails = [make_payload(f"sujet {number}") for number in range(3)]
+
+    reply = server._send_email_batch(
+        client, gloutils.EmailBatchPayload(emails=emails)
+    )
+    server._commit_deliveries()
+
+    assert [result["header"] for result in reply["payload"]["results"]] == [
+        gloutils.Headers.OK
+    ] * 3
+    assert server._get_stats(client)["payload"]["count"] == 3
+    assert server._get_email_list(client)["payload"]["total"] == 3
+
+
+def deliver(server: TP4_server.Server, count: int) -> None:
+    """Livre `count` courriels à alice, un par seconde, le plus ancien en premier."""
+    for number in range(count):
+        date = f"Mon, 06 Oct 2025 12:00:{number:02d} +0000"
+        server._deliver_email(make_payload(f"sujet {number}", date))
+    server._commit_deliveries()
+
+
+def list_subjects(server: TP4_server.Server, client: object, **page) -> list[str]:
+    reply = server._get_email_list(client, gloutils.EmailListRequestPayload(**page))
+    assert reply["header"] == gloutils.Headers.OK
+    return [line.split("sujet ")[1].split()[0] for line in reply["payload"]["email_list"]]
+
+
+@pytest.mark.parametrize(
+    "page, expected",
+    [
+        ({}, ["4", "3", "2", "1", "0"]),
+        ({"limit": 2}, ["4", "3"]),
+        ({"offset": 2, "limit": 2}, ["2", "1"]),
+        ({"offset": 4, "limit": 2}, ["0"]),
+        ({"offset": 5}, []),
+        ({"offset": 50, "limit": 2}, []),
+        ({"limit": 0}, []),
+    ],
+)
+def test_pagination_bounds(server, page, expected):
+    client = register(server, "alice")
+    deliver(server, 5)
+
+    assert list_subjects(server, client, **page) == expected
+
+
+@pytest.mark.parametrize(
+    "page",
+    [{"offset": -1}, {"offset": True}, {"offset": "1"}, {"limit": -1}, {"limit": False}],
+)
+def test_invalid_page_is_an_error(server, page):
+    client = register(server, "alice")
+
+    reply = server._get_email_list(client, gloutils.EmailListRequestPayload(**page))
+    assert reply["header"] == gloutils.Headers.ERROR
+
+
+def test_not_modified_until_delivery(server):
+    client = register(server, "alice")
+    deliver(server, 1)
+
+    version = server._get_email_list(client)["payload"]["version"]
+    reply = server._get_email_list(
+        client, gloutils.EmailListRequestPayload(since_version=version)
+    )
+    assert reply == gloutils.GloMessage(header=gloutils.Headers.NOT_MODIFIED)
+
+    deliver(server, 2)
+    reply = server._get_email_list(
+        client, gloutils.EmailListRequestPayload(since_version=version)
+    )
+    assert reply["header"] == gloutils.Headers.OK
+    assert reply["payload"]["version"] > version
+    assert reply["payload"]["total"] == 2
+
+
+def test_resumption_token_is_single_use(server):
+    client = register(server, "alice")
+    token = server._session_tokens[client]
+
+    resumed = object()
+    reply = server._resume(resumed, gloutils.ResumptionPayload(token=token))
+    assert reply["header"] == gloutils.Headers.OK
+    assert server._logged_users[resumed] == "alice"
+
+    reply = server._resume(object(), gloutils.ResumptionPayload(token=token))
+    assert reply["header"] == gloutils.Headers.ERROR
+
+
+def test_resumption_token_expires(server, monkeypatch):
+    client = register(server, "alice")
+    token = server._session_tokens[client]
+
+    now = TP4_server.time.monotonic()
+    monkeypatch.setattr(
+        TP4_server.time,
+        "monotonic",
+        lambda: now + TP4_server.RESUMPTION_TOKEN_TTL + 1,
+    )
+
+    resumed = object()
+    reply = server._resume(resumed, gloutils.ResumptionPayload(token=token))
+    assert reply["header"] == gloutils.Headers.ERROR
+    assert resumed not in server._logged_users